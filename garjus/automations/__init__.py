@@ -195,9 +195,10 @@ def _run_edat_automations(automations, garjus, project):
                     return
 
     # Upload results to garjus
-    for r in results:
-        r.update({'project': project})
-        garjus.add_activity(**r)
+    with garjus.activity_writer() as writer:
+        for r in results:
+            r.update({'project': project})
+            writer.add_activity(**r)
 
 
 def _parse_scanmap(scanmap):
@@ -269,10 +270,11 @@ def _run_etl_automation(automation, garjus, project):
             return
 
     # Upload results to garjus
-    for r in results:
-        r.update({'project': project, 'category': automation})
-        r.update({'description': r.get('description', automation)})
-        garjus.add_activity(**r)
+    with garjus.activity_writer() as writer:
+        for r in results:
+            r.update({'project': project, 'category': automation})
+            r.update({'description': r.get('description', automation)})
+            writer.add_activity(**r)
 
 
 def _run_etl_fitbit(project):
@@ -880,9 +882,10 @@ def _run_scan_automations(automations, garjus, project):
         results += xnat_dcm2niix.process_project(garjus, project)
 
     # Upload results to garjus
-    for r in results:
-        r['project'] = project
-        garjus.add_activity(**r)
+    with garjus.activity_writer() as writer:
+        for r in results:
+            r['project'] = project
+            writer.add_activity(**r)
 
 
 def _make_scan_table(
@@ -0,0 +1,408 @@
+"""Caching of XNAT metadata and REDCap exports.
+
+Rows produced by Garjus._load_scan_data/_load_assr_data are saved in SQLite
+under the garjus cache directory, grouped by project and session. Each session
+has a signature built from XNAT last_modified values. On load, the signatures
+are queried with a lightweight listing and only sessions that are new or
+modified are queried again in full.
+
+Exports from the main REDCap are memoized for the duration of an update and
+invalidated when records are imported to the same form.
+
+Stats from the stats REDCap of each project are mirrored in SQLite. Each sync
+exports only the records modified since the previous sync, with a full export
+every few days to drop deleted records.
+
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from . import utils_xnat
+
+
+logger = logging.getLogger('garjus.cache')
+
+
+# Maximum number of session labels to include in a single filtered query
+SESSION_CHUNK = 100
+
+# Export records modified this long before the previous sync, REDCap
+# compares date_begin with its own local time so this must cover any
+# difference in timezone and clock with this host
+SYNC_MARGIN = timedelta(days=1)
+
+# Days between full exports of stats
+FULL_SYNC_DAYS = 7
+
+
+class XnatCache:
+    """Persistent cache of scan and assessor rows per project/session."""
+
+    def __init__(self, garjus, filename=None):
+        """Initialize cache, creating the database as needed."""
+        self._garjus = garjus
+
+        if filename is None:
+            filename = os.path.join(garjus.cachedir(), 'xnatcache.db')
+
+        self._filename = filename
+
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'datatype TEXT, project TEXT, session TEXT, signature TEXT, '
+                'PRIMARY KEY (datatype, project, session))')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rows ('
+                'datatype TEXT, project TEXT, session TEXT, data TEXT)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS rows_index '
+                'ON rows (datatype, project, session)')
+
+    def _connect(self):
+        return sqlite3.connect(self._filename, timeout=60)
+
+    def load(self, datatype, project, query):
+        """Return rows for project, querying only modified sessions.
+
+        query is called as query([project], sessions=None) and must return
+        a list of dicts that each include a SESSION key.
+        """
+        start = time.time()
+
+        current = self._signatures(datatype, project)
+        cached = self._cached_signatures(datatype, project)
+
+        changed = [k for k, v in current.items() if cached.get(k) != v]
+        deleted = [k for k in cached.keys() if k not in current]
+
+        if not cached or len(changed) > len(current) / 2:
+            logger.debug(f'cache full load:{datatype}:{project}')
+            rows = query([project])
+            self._save(datatype, project, rows, current, sessions=None)
+        elif changed or deleted:
+            logger.debug(f'cache refresh:{datatype}:{project}:{len(changed)}')
+            rows = []
+            for i in range(0, len(changed), SESSION_CHUNK):
+                chunk = changed[i:i + SESSION_CHUNK]
+                rows.extend(query([project], sessions=chunk))
+
+            self._save(
+                datatype, project, rows, current, sessions=changed + deleted)
+        else:
+            logger.debug(f'cache current:{datatype}:{project}')
+
+        rows = self._rows(datatype, project)
+
+        logger.debug(f'cache loaded:{datatype}:{project}:{len(rows)} rows:'
+                     f'{time.time() - start:.2f} secs')
+
+        return rows
+
+    def clear(self, project=None):
+        """Remove cached data for project or for all projects."""
+        with self._connect() as conn:
+            if project:
+                conn.execute('DELETE FROM sessions WHERE project=?', (project,))
+                conn.execute('DELETE FROM rows WHERE project=?', (project,))
+            else:
+                conn.execute('DELETE FROM sessions')
+                conn.execute('DELETE FROM rows')
+
+    def _signatures(self, datatype, project):
+        """Query XNAT for current signature of each session."""
+        session2mod = {}
+
+        # Session level modified, owned and shared
+        for uri in [
+            f'{utils_xnat.SESS_MOD_URI}&project={project}',
+            f'{utils_xnat.SESS_MOD_URI}&xnat:imagesessiondata/sharing/share/project={project}',
+        ]:
+            for r in self._garjus._get_result(uri):
+                session2mod.setdefault(r['label'], []).append(
+                    r['last_modified'])
+
+        if datatype == 'assessors':
+            # Assessor level modified, grouped by session in assessor label
+            for uri in [
+                f'{utils_xnat.ASSR_MOD_URI}&project={project}',
+                f'{utils_xnat.ASSR_MOD_URI}&proc:genprocdata/sharing/share/project={project}',
+            ]:
+                for r in self._garjus._get_result(uri):
+                    label = r['label']
+                    if label.count('-x-') < 3:
+                        continue
+
+                    session2mod.setdefault(label.split('-x-')[2], []).append(
+                        f'{label}:{r["last_modified"]}')
+
+        return {k: _hash(v) for k, v in session2mod.items()}
+
+    def _cached_signatures(self, datatype, project):
+        with self._connect() as conn:
+            cur = conn.execute(
+                'SELECT session, signature FROM sessions '
+                'WHERE datatype=? AND project=?', (datatype, project))
+            return {k: v for k, v in cur.fetchall()}
+
+    def _rows(self, datatype, project):
+        with self._connect() as conn:
+            cur = conn.execute(
+                'SELECT data FROM rows WHERE datatype=? AND project=?',
+                (datatype, project))
+            return [json.loads(x[0]) for x in cur.fetchall()]
+
+    def _save(self, datatype, project, rows, signatures, sessions=None):
+        """Replace rows/signatures of sessions, all if sessions is None."""
+        with self._connect() as conn:
+            if sessions is None:
+                conn.execute(
+                    'DELETE FROM sessions WHERE datatype=? AND project=?',
+                    (datatype, project))
+                conn.execute(
+                    'DELETE FROM rows WHERE datatype=? AND project=?',
+                    (datatype, project))
+                sessions = list(signatures.keys())
+            else:
+                conn.executemany(
+                    'DELETE FROM sessions '
+                    'WHERE datatype=? AND project=? AND session=?',
+                    [(datatype, project, s) for s in sessions])
+                conn.executemany(
+                    'DELETE FROM rows '
+                    'WHERE datatype=? AND project=? AND session=?',
+                    [(datatype, project, s) for s in sessions])
+
+            conn.executemany(
+                'INSERT INTO sessions VALUES (?, ?, ?, ?)',
+                [(datatype, project, s, signatures[s])
+                    for s in sessions if s in signatures])
+
+            conn.executemany(
+                'INSERT INTO rows VALUES (?, ?, ?, ?)',
+                [(datatype, project, r['SESSION'], json.dumps(r))
+                    for r in rows])
+
+
+class StatsMirror:
+    """Local mirror of the stats form of each project stats REDCap."""
+
+    def __init__(self, garjus, filename=None):
+        """Initialize mirror, creating the database as needed."""
+        self._garjus = garjus
+
+        if filename is None:
+            filename = os.path.join(garjus.cachedir(), 'statsmirror.db')
+
+        self._filename = filename
+
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS syncs ('
+                'project TEXT PRIMARY KEY, synced REAL, full REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS stats ('
+                'project TEXT, subject TEXT, assr TEXT, name TEXT, value TEXT)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS stats_assr '
+                'ON stats (project, assr)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS stats_subject '
+                'ON stats (project, subject)')
+
+    def _connect(self):
+        return sqlite3.connect(self._filename, timeout=60)
+
+    def sync(self, project, full=False):
+        """Update mirror of project with records modified since last sync."""
+        start = time.time()
+        synced, last_full = self._last_sync(project)
+
+        if synced is None or (start - last_full) > FULL_SYNC_DAYS * 86400:
+            full = True
+
+        statsrc = self._garjus._stats_redcap(project)
+        def_field = statsrc.def_field
+
+        if full:
+            logger.debug(f'stats mirror full sync:{project}')
+            rec = statsrc.export_records(forms=['stats'])
+        else:
+            date_begin = datetime.fromtimestamp(synced) - SYNC_MARGIN
+            rec = statsrc.export_records(
+                forms=['stats'], date_begin=date_begin)
+
+        # Records are exported whole, so replace all stats of each subject
+        subjects = set(x[def_field] for x in rec)
+        rows = [
+            (project, x[def_field], x['stats_assr'], x['stats_name'],
+                x['stats_value'])
+            for x in rec if x.get('stats_assr') and x.get('stats_name')]
+
+        with self._connect() as conn:
+            if full:
+                conn.execute('DELETE FROM stats WHERE project=?', (project,))
+                last_full = start
+            else:
+                conn.executemany(
+                    'DELETE FROM stats WHERE project=? AND subject=?',
+                    [(project, x) for x in subjects])
+
+            conn.executemany('INSERT INTO stats VALUES (?, ?, ?, ?, ?)', rows)
+            conn.execute(
+                'INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)',
+                (project, start, last_full))
+
+        logger.debug(f'stats mirror synced:{project}:{len(subjects)} subjects:'
+                     f'{len(rows)} rows:{time.time() - start:.2f} secs')
+
+    def stats(self, project, assessors=None, names=None):
+        """Return dataframe of stats_assr, stats_name, stats_value.
+
+        Only stats of assessors and names are read, all if None.
+        """
+        sql = (
+            'SELECT assr AS stats_assr, name AS stats_name, '
+            'value AS stats_value FROM stats WHERE project=?')
+
+        with self._connect() as conn:
+            if assessors is not None:
+                _temp_table(conn, 'selected_assr', assessors)
+                sql += ' AND assr IN (SELECT value FROM selected_assr)'
+
+            if names is not None:
+                _temp_table(conn, 'selected_name', names)
+                sql += ' AND name IN (SELECT value FROM selected_name)'
+
+            return pd.read_sql_query(sql, conn, params=(project,))
+
+    def assessors(self, project):
+        """Return list of assessors with stats in project."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                'SELECT DISTINCT assr FROM stats WHERE project=?', (project,))
+            return [x[0] for x in cur.fetchall()]
+
+    def clear(self, project=None):
+        """Remove mirrored stats for project or for all projects."""
+        with self._connect() as conn:
+            if project:
+                conn.execute('DELETE FROM syncs WHERE project=?', (project,))
+                conn.execute('DELETE FROM stats WHERE project=?', (project,))
+            else:
+                conn.execute('DELETE FROM syncs')
+                conn.execute('DELETE FROM stats')
+
+    def _last_sync(self, project):
+        with self._connect() as conn:
+            cur = conn.execute(
+                'SELECT synced, full FROM syncs WHERE project=?', (project,))
+            row = cur.fetchone()
+
+        return row if row else (None, None)
+
+
+def _temp_table(conn, name, values):
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {name} (value TEXT)')
+    conn.execute(f'DELETE FROM {name}')
+    conn.executemany(
+        f'INSERT INTO {name} VALUES (?)', [(x,) for x in set(values)])
+
+
+def _hash(values):
+    return hashlib.md5('\n'.join(sorted(values)).encode()).hexdigest()
+
+
+class RedcapMemo:
+    """Memoized exports from a REDCap project, invalidated by imports.
+
+    Exports are keyed on records, forms and fields. Importing records to a
+    form drops any saved export that includes that form.
+    """
+
+    def __init__(self, project):
+        """Initialize memo for project."""
+        self._project = project
+        self._results = {}
+        self._field2form = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def export_records(self, records=None, forms=None, fields=None):
+        """Return records from memo, exporting only on first request."""
+        key = (_key(records), _key(forms), _key(fields))
+
+        with self._lock:
+            result = self._results.get(key, None)
+            if result is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if result is None:
+            result = self._project.export_records(
+                records=records, forms=forms, fields=fields)
+
+            with self._lock:
+                self._results[key] = result
+
+        # Return copies so callers can not modify the saved records
+        return [dict(x) for x in result]
+
+    def import_records(self, records):
+        """Import records and invalidate exports of the same forms."""
+        response = self._project.import_records(records)
+
+        self.invalidate(set(
+            r.get('redcap_repeat_instrument') or None for r in records))
+
+        return response
+
+    def invalidate(self, forms=None):
+        """Drop saved exports that include forms, all if forms is None."""
+        with self._lock:
+            if not forms or None in forms:
+                self._results = {}
+                return
+
+            self._results = {
+                k: v for k, v in self._results.items()
+                if not (self._key_forms(k) & set(forms))}
+
+    def _key_forms(self, key):
+        """Return set of forms included in the export key."""
+        (_, forms, fields) = key
+
+        if forms is None and fields is None:
+            # All forms
+            return set(self._fields2forms().values())
+
+        key_forms = set(forms or [])
+        for f in (fields or []):
+            if f != self._project.def_field:
+                key_forms.add(self._fields2forms().get(f))
+
+        return key_forms
+
+    def _fields2forms(self):
+        if self._field2form is None:
+            self._field2form = {
+                x['field_name']: x['form_name'] for x in self._project.metadata}
+
+        return self._field2form
+
+
+def _key(values):
+    if values is None:
+        return None
+
+    return tuple(sorted(values))
@@ -264,10 +264,41 @@ def tasks():
     nargs=-1)
 @click.option('--project', '-p', 'project', multiple=True)
 @click.option('--types', '-t', 'types', multiple=True, required=False)
-def update(choice, project, types):
+@click.option(
+    '--cache/--no-cache', default=False,
+    help='use local cache of XNAT scans/assessors and stats.')
+@click.option(
+    '--workers', '-w', 'workers', type=int, default=1,
+    help='number of projects to update in parallel.')
+@click.option(
+    '--plan', 'plan', is_flag=True, default=False,
+    help='only print the tasks that would be built, requires tasks.')
+@click.option(
+    '--activity-log', 'activity_log', required=False,
+    help='also append activity records to this JSONL file.')
+def update(choice, project, types, cache, workers, plan, activity_log):
     click.echo('garjus! update')
     g = Garjus()
-    g.update(projects=project, choices=choice, types=types)
+    if cache:
+        g.enable_cache()
+
+    if activity_log:
+        g.set_activity_log(activity_log)
+
+    if plan:
+        if 'tasks' not in choice:
+            click.echo('--plan is only supported with update tasks')
+            return
+
+        df = g.plan_tasks(projects=project, types=types)
+        if df.empty:
+            click.echo('nothing to build')
+        else:
+            click.echo(df.groupby(['PROJECT', 'PROCTYPE', 'ACTION']).size(
+                ).unstack(fill_value=0).to_string())
+        return
+
+    g.update(projects=project, choices=choice, types=types, workers=workers)
     click.echo('ALL DONE!')
 
 
@@ -2,6 +2,7 @@
 import os
 import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 from fpdf import FPDF
@@ -63,6 +64,9 @@ REDCap projects, but all values are blank in the Second REDCap. This list \
 should be empty.'
 }]
 
+# Number of record chunks exported at the same time
+EXPORT_WORKERS = 4
+
 IGNORE_FIELDS = ['record_id', 'subj_num', 'ddes_12child', 'entry_consider_list',
     'entryconsid_c_list' 'pe_date', 'physical_specif', 'physical_yesno',
     'pvas_date', 'pvas_interfere', 'pvas_pain'
@@ -184,10 +188,11 @@ def add_sheet_description(pdf, name, description):
     pdf.multi_cell(w=6.3, h=0.4, txt=description, border='B', ln=1, align='L')
 
 
-def get_fields(p1, p2):
-    # Get all the records so we can check for all nan
-    logging.debug(f'exporting p2 records')
-    records = p2.export_records()
+def get_fields(p1, p2, records=None):
+    if records is None:
+        # Get all the records so we can check for all nan
+        logging.debug(f'exporting p2 records')
+        records = p2.export_records()
 
     common_fields = sorted(list(set(p1.field_names) & set(p2.field_names)))
     p1_only_fields = sorted(list(set(p1.field_names) - set(p2.field_names)))
@@ -262,7 +267,7 @@ def _boring_record(record, compare_fields):
     return True
 
 
-def export_all_records(project, step=100, fields=None, events=None):
+def export_all_records(project, step=100, fields=None, events=None, workers=1):
     records = []
 
     # Get a list of unique IDs
@@ -273,19 +278,45 @@ def export_all_records(project, step=100, fields=None, events=None):
     # How many?
     count = len(ids)
 
-    # Load in chunks of step size
-    for i in range(0, count, step):
+    def _export(chunk):
         if fields:
-            r = project.export_records(records=ids[i:i + step], fields=fields, events=events)
+            return project.export_records(records=chunk, fields=fields, events=events)
         else:
-            r = project.export_records(records=ids[i:i + step], events=events)
+            return project.export_records(records=chunk, events=events)
 
-        records.extend(r)
+    # Load in chunks of step size, in order of chunks
+    chunks = [ids[i:i + step] for i in range(0, count, step)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for r in executor.map(_export, chunks):
+            records.extend(r)
 
     return records
 
 
-def compare_projects(p1, p2, compare_fields=None, compare_events=None):
+def _index_records(records, def_field):
+    # Index records by record/event and by record/event/instrument/instance
+    event2records = {}
+    instance2record = {}
+
+    for r in records:
+        rid = r[def_field]
+        eid = r.get('redcap_event_name', '')
+        name = str(r.get('redcap_repeat_instrument', ''))
+        num = str(r.get('redcap_repeat_instance', ''))
+
+        event2records.setdefault((rid, eid), []).append(r)
+        instance2record.setdefault((rid, eid, name, num), r)
+
+    return event2records, instance2record
+
+
+def compare_projects(
+    p1,
+    p2,
+    compare_fields=None,
+    compare_events=None,
+    workers=EXPORT_WORKERS
+):
     # Compares two redcap projects and returns the results
     results = {}
     missing_subjects = []
@@ -314,7 +345,12 @@ def compare_projects(p1, p2, compare_fields=None, compare_events=None):
         rec = p2.export_records(fields=[def_field2])
         subj2id2 = {x[def_field2]: x[def_field2] for x in rec if x[def_field2]}
 
-    fields = get_fields(p1, p2)
+    # Get all the records of the Second once, then compare to the index
+    logging.debug(f'exporting p2 records')
+    all_records2 = export_all_records(p2, workers=workers)
+    event2records, instance2record = _index_records(all_records2, def_field2)
+
+    fields = get_fields(p1, p2, records=all_records2)
 
     if not compare_fields:
         # Determine which fields to compare
@@ -334,7 +370,8 @@ def compare_projects(p1, p2, compare_fields=None, compare_events=None):
     records1 = export_all_records(
         p1,
         fields=compare_fields,
-        events=compare_events
+        events=compare_events,
+        workers=workers
     )
 
     # Set subject id
@@ -391,12 +428,7 @@ def compare_projects(p1, p2, compare_fields=None, compare_events=None):
             continue
 
         # Get records from secondary redcap for this subject/event
-        try:
-            records2 = p2.export_records(records=[rid2], events=[eid])
-        except Exception:
-            import traceback
-            traceback.print_exc()
-            records2 = []
+        records2 = event2records.get((rid2, eid), [])
 
         # Find the best record to compare
         if len(records2) == 1:
@@ -435,14 +467,10 @@ def compare_projects(p1, p2, compare_fields=None, compare_events=None):
                     break
 
             if r2 is None:
-                for e2 in records2:
-                    name2 = str(e2.get('redcap_repeat_instrument', ''))
-                    num2 = str(e2.get('redcap_repeat_instance', ''))
-
-                    if name1 == name2 and num1 == num2:
-                        logging.debug(f'{sid}:{eid}:instance match:{name1}:{num1}:{num2}')
-                        r2 = e2
-                        break
+                r2 = instance2record.get((rid2, eid, name1, num1))
+                if r2 is not None:
+                    name2, num2 = name1, num1
+                    logging.debug(f'{sid}:{eid}:instance match:{name1}:{num1}:{num2}')
 
             if r2 is None:
                 logging.debug(f'NO MATCH:{sid}:{eid}:{name1}:{num1}')
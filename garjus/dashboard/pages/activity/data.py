@@ -1,30 +1,20 @@
 import logging
-import os
 from datetime import datetime
 
 import pandas as pd
 
-from .. import utils
 from ....garjus import Garjus
+from ..service import get_service
 
 
 logger = logging.getLogger('dashboard.activity.data')
 
 
-# This is where we save our cache of the data
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/activitydata.pkl'
+# Activity is refreshed in the background after this many secs
+ACTIVITY_TTL = 60 * 60
 
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
 
-    return filename
-
-
-def get_data(proj_filter):
+def get_data(proj_filter, garjus=None):
     df = pd.DataFrame()
     dfc = pd.DataFrame()
     dfq = pd.DataFrame()
@@ -43,7 +33,7 @@ def get_data(proj_filter):
     startdate = datetime.today() - relativedelta(months=1)
     startdate = startdate.strftime('%Y-%m-%d')
 
-    g = Garjus()
+    g = garjus or Garjus()
 
     if not g.redcap_enabled():
         logger.debug('redcap not enabled, no data')
@@ -125,24 +115,18 @@ def load_recent_jobs(df, startdate):
     return df
 
 
-def run_refresh(filename):
-    proj_filter = []
-
-    df = get_data(proj_filter)
-
-    utils.save_data(df, filename)
-
-    return df
-
-
 def load_data(refresh=False):
-    filename = get_filename()
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
 
-    if refresh or not os.path.exists(filename):
-        run_refresh(filename)
+    df = service.get_user(
+        ('activity',),
+        lambda: get_data([], garjus),
+        ACTIVITY_TTL,
+        refresh=refresh)
 
-    logger.info('reading data from file:{}'.format(filename))
-    return utils.read_data(filename)
+    # Shared by callbacks of user, give the caller a copy
+    return df.copy()
 
 
 def filter_data(df, projects, categories, sources):
@@ -1,30 +1,16 @@
 import logging
-import os
 
 import pandas as pd
 
 from ....garjus import Garjus
-from ..utils import file_age
+from ..service import get_service
 
 
 logger = logging.getLogger('dashboard.issues.data')
 
 
-# This is where we save our cache of the data
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/issuesdata.pkl'
-
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
-
-    return filename
-
-
-def get_data():
-    g = Garjus()
+def get_data(garjus=None):
+    g = garjus or Garjus()
 
     if not g.redcap_enabled():
         logger.debug('redcap not enabled, no data')
@@ -95,51 +81,18 @@ def get_data():
     return df
 
 
-def run_refresh():
-    filename = get_filename()
-
-    df = get_data()
-
-    if not df.empty:
-        save_data(df, filename)
-
-    return df
-
-
 def load_data(refresh=False, maxmins=5):
-    filename = get_filename()
-
-    if not os.path.exists(filename):
-        refresh = True
-    elif file_age(filename) > maxmins:
-        logger.info(f'refreshing, file age limit reached:{maxmins} minutes')
-        refresh = True
-
-    if refresh:
-        df = run_refresh()
-    else:
-        df = read_data(filename)
-
-    return df
-
-
-def read_data(filename):
-
-    if os.path.exists(filename):
-        df = pd.read_pickle(filename)
-    else:
-        df = pd.DataFrame(columns=[
-            'ID', 'LABEL', 'PROJECT', 'SUBJECT', 'SESSION',
-            'EVENT', 'FIELD', 'CATEGORY', 'STATUS',
-            'DESCRIPTION', 'DATETIME'
-        ])
-
-    return df
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
 
+    df = service.get_user(
+        ('issues',),
+        lambda: get_data(garjus),
+        maxmins * 60,
+        refresh=refresh)
 
-def save_data(df, filename):
-    # save to cache
-    df.to_pickle(filename)
+    # Shared by callbacks of user, give the caller a copy
+    return df.copy()
 
 
 def filter_data(df, projects, categories):
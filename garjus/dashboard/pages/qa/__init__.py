@@ -28,8 +28,8 @@ from dash import dcc, html, dash_table as dt
 from dash import Input, Output, callback
 import dash_bootstrap_components as dbc
 
-from ....garjus import Garjus
 from .. import utils
+from ..service import get_service
 from ..shared import QASTATUS2COLOR, RGB_DKBLUE, GWIDTH
 from . import data
 
@@ -92,13 +92,13 @@ TIPS_MARKDOWN = '''
 # the columns will be the merged
 # status column with harmonized values to be red/yellow/green/blue
 
-def _get_graph_content(dfp):
+def _get_graph_content(dfs):
     tabs_content = []
 
     logger.debug('get_qa_figure')
 
     # Check for empty data
-    if dfp is None or len(dfp) == 0:
+    if dfs is None or len(dfs) == 0:
         logger.debug('empty data, using empty figure')
         return [html.Div(html.H1('Choose Project(s) to load'))]
 
@@ -106,59 +106,25 @@ def _get_graph_content(dfp):
     fig = plotly.subplots.make_subplots(rows=1, cols=1)
     fig.update_layout(margin=dict(l=40, r=40, t=40, b=40))
 
-    # First we copy the dfp and then replace the values in each
-    # scan/proc type column with a metastatus,
-    # that gives us a high level status of the type for that session
-
-    # TODO: should we just make a different pivot table here going back to
-    # the original df? yes, later
-    dfp_copy = dfp.copy()
-    for col in dfp_copy.columns:
-        if col in ('SESSION', 'PROJECT', 'DATE', 'NOTE'):
-            # don't mess with these columns
-            # TODO: do we need this if we haven't reindexed yet?
-            continue
-
-        # Change each value from the multiple values in concatenated
-        # characters to a single overall status
-        dfp_copy[col] = dfp_copy[col].apply(get_metastatus)
-
-    # The pivot table for the graph is a pivot of the pivot table, instead
-    # of having a row per session, this pivot table has a row per
-    # pivot_type, we can pivot by type to get counts of each status for each
-    # scan/proc type, or we can pivot by project to get counts of sessions
-    # for each project
-    # The result will be a table with one row per TYPE (index=TYPE),
-    # and we'll have a column for each STATUS (so columns=STATUS),
-    # and we'll count how many sessions (values='SESSION') we find for each
-    # cell get a copy so it's defragmented
-    dfp_copy = dfp_copy.reset_index().copy()
-
-    # don't need subject
-    dfp_copy = dfp_copy.drop(columns=['SUBJECT', 'SUBJECTLINK', 'AGE', 'SEX', 'GROUP'])
-
-    # use pandas melt function to unpivot our pivot table
-    df = pd.melt(
-        dfp_copy,
-        id_vars=(
-            'SESSION',
-            'SESSIONLINK',
-            'PROJECT',
-            'DATE',
-            'SITE',
-            'SESSTYPE',
-            'MODALITY',
-            'NOTE'),
-        value_name='STATUS')
-
+    # The session statuses have a row per session per scan/proc type, with
+    # a metastatus that gives us a high level status of the type for that
+    # session. The result will be a table with one row per TYPE
+    # (index=TYPE), and we'll have a column for each STATUS
+    # (so columns=METASTATUS), and we'll count how many sessions
+    # (values='SESSION') we find for each cell.
     # We use fill_value to replace nan with 0
-    dfpp = df.pivot_table(
+    dfpp = dfs.pivot_table(
         index='TYPE',
-        columns='STATUS',
+        columns='METASTATUS',
         values='SESSION',
         aggfunc='count',
         fill_value=0)
 
+    # Sessions without a type are counted as NONE for that type
+    num_sessions = len(dfs[data.PIVOT_INDEX].drop_duplicates())
+    dfpp['NONE'] = num_sessions - dfpp.drop(
+        columns='NONE', errors='ignore').sum(axis=1)
+
     # sort so scans are first, then assessor
     scan_type = []
     assr_type = []
@@ -206,11 +172,7 @@ def _get_graph_content(dfp):
     # which projects have a T1 and a good FS6_v1
     # later combine with other pivot
     # table and loop on pivot type
-    dfpp = df.pivot_table(
-        index='PROJECT',
-        values='SESSION',
-        aggfunc=pd.Series.nunique,
-        fill_value=0)
+    dfpp = dfs.groupby('PROJECT')[['SESSION']].nunique()
 
     fig = plotly.subplots.make_subplots(rows=1, cols=1)
     fig.update_layout(margin=dict(l=40, r=40, t=40, b=40))
@@ -243,8 +205,8 @@ def _get_graph_content(dfp):
     tabs_content.append(dbc.Tab(label=label, children=[graph]))
 
     # Append the by-time graph (this was added later with separate function)
-    dfs = df[['PROJECT', 'DATE', 'SESSION', 'SESSTYPE', 'SITE', 'MODALITY']].drop_duplicates()
-    fig = _sessionsbytime_figure(dfs, selected_groupby='PROJECT')
+    dft = dfs[['PROJECT', 'DATE', 'SESSION', 'SESSTYPE', 'SITE', 'MODALITY']].drop_duplicates()
+    fig = _sessionsbytime_figure(dft, selected_groupby='PROJECT')
     label = 'By {}'.format('TIME')
     graph = html.Div(dcc.Graph(figure=fig), style={
         'width': '100%', 'display': 'inline-block'})
@@ -580,31 +542,36 @@ def get_metastatus(status):
 def qa_pivot(df):
     df = df.fillna('')
 
-    dfp = df.pivot_table(
-        index=(
-            'SESSION', 'SESSIONLINK', 'SUBJECT', 'SUBJECTLINK', 'PROJECT',
-            'DATE', 'SESSTYPE', 'SITE', 'GROUP', 'AGE', 'SEX', 'MODALITY', 'NOTE'),
-        columns='TYPE',
-        values='STATUS',
-        aggfunc=lambda x: ''.join(x))
+    # Links are added after pivoting, only for rows displayed
+    dfp = df.groupby(data.PIVOT_INDEX + ['TYPE'])['STATUS'].agg(
+        ''.join).unstack('TYPE')
 
     # and return our pivot table
     return dfp
 
 
 # This is where the data gets initialized
-def load_data(projects=[], refresh=False, hidetypes=True):
+def load_data(projects=[], refresh=False, hidetypes=True, pivot=None):
     if projects is None:
         projects = []
 
+    # Read only the columns the selected table needs
+    if pivot == 'scan':
+        columns = data.SCAN_COLS
+    elif pivot == 'assr':
+        columns = data.ASSR_COLS
+    else:
+        columns = data.PIVOT_COLS
+
     return data.load_data(
         projects=projects,
         refresh=refresh,
-        hidetypes=hidetypes)
+        hidetypes=hidetypes,
+        columns=columns)
 
 
 def load_options(df):
-    garjus = Garjus()
+    garjus = get_service().garjus()
     projects = garjus.projects()
     sesstypes = []
     proctypes = []
@@ -700,7 +667,8 @@ def update_qa(
         df = load_data(
             projects=selected_proj,
             refresh=refresh,
-            hidetypes=selected_autofilter)
+            hidetypes=selected_autofilter,
+            pivot=selected_pivot)
     except Exception as err:
         logger.debug(f'failed to load data:{err}')
         return [[], [], [], [], [], [], 'No data', 'Credentials Expired', 'Refresh to Login']
@@ -743,6 +711,23 @@ def update_qa(
     if not df.empty and selected_procstatus:
         df = df[df.STATUS.isin(selected_procstatus)]
 
+    # Graphs use the precomputed session statuses with the same filters
+    if selected_graph and not df.empty and selected_pivot not in ('scan', 'assr'):
+        dfs = data.filter_statuses(
+            data.load_statuses(selected_proj, hidetypes=selected_autofilter),
+            selected_proj,
+            selected_proc,
+            selected_scan,
+            selected_starttime,
+            selected_endtime,
+            selected_sess,
+            selected_modality,
+            selected_procstatus)
+    else:
+        dfs = None
+
+    host = get_service().garjus().xnat_host()
+
     if df.empty:
         records = []
         columns = []
@@ -753,7 +738,7 @@ def update_qa(
         if selected_graph:
             logger.debug('making graph')
             # Graph it
-            graph_content = _get_graph_content(dfp)
+            graph_content = _get_graph_content(dfs)
 
         # Make the table data
         selected_cols = ['PROJECT']
@@ -860,7 +845,7 @@ def update_qa(
 
         if selected_graph:
             # Make graphs
-            graph_content = _get_graph_content(dfp)
+            graph_content = _get_graph_content(dfs)
 
         # Get the table
         dfp = dfp.reset_index()
@@ -890,7 +875,7 @@ def update_qa(
                 # agg to most common value (mode) per sesstype per show_col
                 dfp = dfp.fillna('')
                 dfp = dfp.pivot_table(
-                    index=('PROJECT', 'SUBJECT', 'SUBJECTLINK'),
+                    index=('PROJECT', 'SUBJECT'),
                     columns='SESSTYPE',
                     values=show_col,
                     aggfunc=lambda x: x.mode().iat[0],
@@ -922,7 +907,7 @@ def update_qa(
             else:
                 # aggregrate to most common value (mode)
                 dfp = dfp.pivot_table(
-                    index=('PROJECT', 'SUBJECT', 'SUBJECTLINK'),
+                    index=('PROJECT', 'SUBJECT'),
                     values=show_col,
                     aggfunc=lambda x: x.mode().iat[0],
                 )
@@ -954,7 +939,7 @@ def update_qa(
             show_col = list(dfp.SESSTYPE.unique())
             selected_cols = ['SUBJECT', 'PROJECT'] + show_col
             dfp = dfp.pivot_table(
-                index=('SUBJECT', 'PROJECT', 'SUBJECTLINK'),
+                index=('SUBJECT', 'PROJECT'),
                 values='EMO',
                 columns='SESSTYPE',
                 aggfunc=lambda x: ''.join(x))
@@ -965,7 +950,8 @@ def update_qa(
 
         # Format as column names and record dictionaries for dash table
         columns = utils.make_columns(selected_cols)
-        records = dfp.reset_index().to_dict('records')
+        dfp = data.add_links(dfp.reset_index(), host, ['SUBJECTLINK'])
+        records = dfp.to_dict('records')
 
         # Format records
         for r in records:
@@ -1004,6 +990,10 @@ def update_qa(
             'EDAT',
         ]
 
+        # Make links for the rows displayed
+        df = data.add_links(df, host, [
+            'SESSIONLINK', 'SUBJECTLINK', 'NIFTI', 'JSON', 'EDAT'])
+
         # Only include columns that have values
         selected_cols = [x for x in selected_cols if (df[x].count() - df[x].eq('').sum()) > 0]
 
@@ -1070,6 +1060,10 @@ def update_qa(
             'MEMUSED',
         ]
 
+        # Make links for the rows displayed
+        df = data.add_links(df, host, [
+            'SESSIONLINK', 'SUBJECTLINK', 'PDF', 'LOG'])
+
         # Format as column names and record dictionaries for dash table
         columns = utils.make_columns(selected_cols)
         records = df.reset_index().to_dict('records')
@@ -1111,7 +1105,8 @@ def update_qa(
         dfp = qa_pivot(df)
 
         if selected_graph:
-            graph_content = _get_graph_content(dfp)
+            dfs = dfs[(dfs.MODALITY != 'SGP') & (dfs.SESSTYPE != 'SGP')]
+            graph_content = _get_graph_content(dfs)
 
         # Get the table data
         selected_cols = [
@@ -1153,7 +1148,8 @@ def update_qa(
 
         # Format as column names and record dictionaries for dash table
         columns = utils.make_columns(selected_cols)
-        records = dfp.reset_index().to_dict('records')
+        dfp = data.add_links(dfp.reset_index(), host, ['SESSIONLINK'])
+        records = dfp.to_dict('records')
 
         # Format records
         for r in records:
@@ -1,12 +1,12 @@
 """QA Dashboard."""
 import logging
-import os
 
 import numpy as np
 import pandas as pd
 
 from ....garjus import Garjus
-from ..utils import file_age
+from ..service import get_service
+from ..store import from_categories
 
 
 logger = logging.getLogger('dashboard.qa.data')
@@ -35,152 +35,146 @@ ASSR_STATUS_MAP = {
     'Do Not Run': 'N'}
 
 
-QA_COLS = [
-    'SESSION', 'SUBJECT', 'PROJECT', 'SCANID', 'ASSR',
-    'SITE', 'NOTE', 'DATE', 'TYPE', 'STATUS',
-    'ARTTYPE', 'SCANTYPE', 'PROCTYPE', 'XSITYPE', 'SESSTYPE', 'MODALITY',
-    'FRAMES', 'DURATION', 'TR', 'THICK', 'SENSE', 'MB', 'RESOURCES',
-    'JOBDATE', 'TIMEUSED', 'MEMUSED'
+# Columns used by every table pivot, others are only read when shown
+PIVOT_COLS = [
+    'SESSION', 'SUBJECT', 'PROJECT', 'DATE', 'SESSTYPE', 'SITE', 'GROUP',
+    'AGE', 'SEX', 'MODALITY', 'NOTE', 'TYPE', 'STATUS', 'ARTTYPE',
+    'SCANTYPE', 'PROCTYPE'
 ]
 
+SCAN_COLS = PIVOT_COLS + [
+    'SCANID', 'DURATION', 'TR', 'THICK', 'SENSE', 'MB', 'FRAMES', 'RESOURCES'
+]
 
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/qadata.pkl'
-
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
-
-    return filename
-
-
-def run_refresh(projects):
-    filename = get_filename()
+ASSR_COLS = PIVOT_COLS + [
+    'ASSR', 'JOBDATE', 'TIMEUSED', 'MEMUSED'
+]
 
-    # force a requery
-    df = get_data(projects)
+# Index of the qa pivot, the pivot has a row per unique values
+PIVOT_INDEX = [
+    'SESSION', 'SUBJECT', 'PROJECT', 'DATE', 'SESSTYPE', 'SITE', 'GROUP',
+    'AGE', 'SEX', 'MODALITY', 'NOTE'
+]
 
-    save_data(df, filename)
+# Status of a session for a type is the first found in this order
+STATUS_ORDER = ['P', 'Q', 'N', 'F', 'X', 'R']
 
-    return df
+METASTATUS = ['PASS', 'NQA', 'NPUT', 'FAIL', 'JOBF', 'JOBR']
 
+# Bit for each status in STATUS_ORDER, any other status is the next bit
+STATUS_BITS = {x: 1 << i for i, x in enumerate(STATUS_ORDER)}
 
-def update_data(projects):
-    fname = get_filename()
+OTHER_BIT = 1 << len(STATUS_ORDER)
 
-    # Load what we have now
-    df = read_data(fname)
 
-    # Remove projects not selected
-    df = df[df.PROJECT.isin(projects)]
+QA_COLS = [
+    'SESSION', 'SUBJECT', 'PROJECT', 'SCANID', 'ASSR',
+    'SITE', 'NOTE', 'DATE', 'TYPE', 'STATUS',
+    'ARTTYPE', 'SCANTYPE', 'PROCTYPE', 'XSITYPE', 'SESSTYPE', 'MODALITY',
+    'FRAMES', 'DURATION', 'TR', 'THICK', 'SENSE', 'MB', 'RESOURCES',
+    'JOBDATE', 'TIMEUSED', 'MEMUSED'
+]
 
-    # Find new projects in selected
-    new_projects = [x for x in projects if x not in df.PROJECT.unique()]
 
-    if new_projects:
+def load_data(
+    projects=[], refresh=False, maxmins=60, hidetypes=True, columns=None
+):
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
+    ttl = maxmins * 60
+    projects = service.user_projects(projects)
 
-        # Save a file with new projects placeholders (hacky lock)
-        for p in new_projects:
-            _newdf = pd.DataFrame.from_records([{'PROJECT': p}])
-            df = pd.concat([df, _newdf], ignore_index=True)
+    # Shared per project entries, only new projects are queried
+    df = service.get_projects(
+        'qa',
+        projects,
+        lambda x: get_data(x, garjus),
+        ttl,
+        refresh=refresh,
+        columns=columns)
 
-        save_data(df, fname)
+    if df.empty:
+        return df
 
-        # Load the new projects
-        dfp = get_data(new_projects)
+    if hidetypes:
+        df = _hide_types(service, garjus, df, ttl, refresh)
 
-        # Merge our new data with old data
-        df = read_data(fname)
-        df = df[~df.PROJECT.isin(new_projects)]
-        df = pd.concat([df, dfp])
+    # Filter projects
+    df = df[df['PROJECT'].isin(projects)]
 
-        # Save it to file
-        save_data(df, fname)
+    # Must have type
+    df = df.dropna(subset=['TYPE'])
 
     return df
 
 
-def load_data(projects=[], refresh=False, maxmins=60, hidetypes=True):
-    fname = get_filename()
+def load_statuses(projects=[], maxmins=60, hidetypes=True):
+    """Load status of each session and type, precomputed when data loads."""
+    service = get_service()
+    garjus = service.garjus()
+    ttl = maxmins * 60
+    projects = service.user_projects(projects)
+    user = service.user()
 
-    if not os.path.exists(fname):
-        refresh = True
-    elif file_age(fname) > maxmins:
-        logger.info(f'refreshing, file age limit reached:{maxmins} minutes')
-        refresh = True
+    dfs = service.get_projects(
+        'qastatus',
+        projects,
+        lambda x: session_status(service.get_projects(
+            'qa', x, lambda y: get_data(y, garjus), ttl, user=user)),
+        ttl)
 
-    if refresh:
-        df = run_refresh(projects)
-    elif set(projects) != set(read_data(fname).PROJECT.unique()):
-        logger.debug('updating data')
-        # Different projects selected, update
-        df = update_data(projects)
-    else:
-        df = read_data(fname)
-
-    if df.empty:
-        return df
+    if dfs.empty:
+        return dfs
 
     if hidetypes:
-        logger.debug('applying autofilter to hide unused types')
-        scantypes = None
-        assrtypes = None
+        dfs = _hide_types(service, garjus, dfs, ttl, False)
 
-        garjus = Garjus()
+    return dfs
 
-        if garjus.redcap_enabled():
-            # Load types
-            logger.debug('loading scan/assr types')
-            scantypes = garjus.all_scantypes()
-            assrtypes = garjus.all_proctypes()
 
-            # Make the lists unique
-            scantypes = list(set(scantypes))
-            assrtypes = list(set(assrtypes))
+def _hide_types(service, garjus, df, ttl, refresh):
+    logger.debug('applying autofilter to hide unused types')
+    scantypes = None
+    assrtypes = None
 
-            if not scantypes and not df.empty:
-                # Get list of scan types based on assessor inputs
-                logger.debug('loading used scan types')
-                scantypes = garjus.used_scantypes(
-                    df[df.TYPE == 'ASSR'],
-                    df[df.TYPE == 'SCAN']
-                )
+    if garjus.redcap_enabled():
+        # Load types
+        logger.debug('loading scan/assr types')
+        scantypes, assrtypes = service.get_user(
+            ('qatypes',),
+            lambda: _load_types(garjus),
+            ttl,
+            refresh=refresh)
 
-            # Apply filter
-            alltypes = scantypes + assrtypes
+        if not scantypes and not df.empty:
+            # Get list of scan types based on assessor inputs
+            logger.debug('loading used scan types')
+            scantypes = garjus.used_scantypes(
+                df[df.TYPE == 'ASSR'],
+                df[df.TYPE == 'SCAN']
+            )
 
-            if alltypes is not None:
-                logger.debug(f'filtering by types:{len(df)}')
-                df = df[df.TYPE.isin(alltypes)]
+        # Apply filter
+        alltypes = scantypes + assrtypes
 
-        logger.debug(f'done filtering by types:{len(df)}')
+        if alltypes is not None:
+            logger.debug(f'filtering by types:{len(df)}')
+            df = df[df.TYPE.isin(alltypes)]
 
-    # Filter projects
-    df = df[df['PROJECT'].isin(projects)]
-
-    # Must have type
-    df = df.dropna(subset=['TYPE'])
+    logger.debug(f'done filtering by types:{len(df)}')
 
     return df
 
 
-def read_data(filename):
-    df = pd.read_pickle(filename)
-
-    if df is None or len(df) == 0:
-        df = pd.DataFrame(columns=['PROJECT', 'SCANTYPE', 'SESSTYPE', 'PROCTYPE'])
-
-    return df
-
+def _load_types(garjus):
+    # Make the lists unique
+    scantypes = list(set(garjus.all_scantypes()))
+    assrtypes = list(set(garjus.all_proctypes()))
 
-def save_data(df, filename):
-    # save to cache
-    df.to_pickle(filename)
+    return scantypes, assrtypes
 
 
-def get_data(projects):
+def get_data(projects, garjus=None):
     df = pd.DataFrame(columns=QA_COLS)
 
     if not projects:
@@ -188,7 +182,8 @@ def get_data(projects):
         return df
 
     try:
-        garjus = Garjus()
+        if garjus is None:
+            garjus = Garjus()
 
         # Load data
         logger.debug(f'load data:{projects}')
@@ -208,7 +203,7 @@ def get_data(projects):
         logger.debug(f'all loaded')
     except Exception as err:
         logger.error(f'load failed:{err}')
-        _cols = QA_COLS + ['DATE', 'SESSIONLINK', 'SUBJECTLINK']
+        _cols = QA_COLS + ['DATE']
         return pd.DataFrame(columns=_cols)
 
     logger.debug(f'merging data:{projects}')
@@ -265,55 +260,101 @@ def get_data(projects):
         unit='s',
         errors='coerce').dt.strftime("%-M:%S")
 
-    df['SESSIONLINK'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION']
+    return df
+
+
+def session_status(df):
+    """Return a row per pivot session and type with bits of its statuses."""
+    if df.empty:
+        return pd.DataFrame(columns=PIVOT_INDEX + [
+            'TYPE', 'ARTTYPE', 'PROCTYPE', 'SCANTYPE', 'BITS'])
+
+    df = df.dropna(subset=['TYPE'])
+    df = from_categories(df[PIVOT_INDEX + [
+        'TYPE', 'ARTTYPE', 'PROCTYPE', 'SCANTYPE', 'STATUS']]).fillna('')
+
+    # Notes are truncated for display before pivoting
+    df['NOTE'] = df['NOTE'].str.slice(0, 70)
+
+    # Set a flag column per bit so we can aggregate with max
+    bits = df['STATUS'].map(STATUS_BITS).fillna(OTHER_BIT).astype(int)
+    flags = [f'B{i}' for i in range(len(STATUS_ORDER) + 1)]
+    for i, f in enumerate(flags):
+        df[f] = (bits & (1 << i)) > 0
+
+    dfs = df.groupby(PIVOT_INDEX + ['TYPE'], sort=False).agg(
+        {'ARTTYPE': 'first', 'PROCTYPE': 'first', 'SCANTYPE': 'first',
+         **{f: 'max' for f in flags}})
+
+    dfs['BITS'] = 0
+    for i, f in enumerate(flags):
+        dfs['BITS'] += dfs[f].astype(int) * (1 << i)
+
+    return dfs.drop(columns=flags).reset_index()
+
 
-    df['SUBJECTLINK'] = garjus.xnat_host() + \
+def filter_statuses(
+    dfs, projects, proctypes, scantypes, starttime, endtime, sesstypes,
+    modalities, procstatus
+):
+    """Apply the table filters to the session statuses, add METASTATUS."""
+    dfs = filter_data(
+        dfs, projects, proctypes, scantypes, starttime, endtime, sesstypes)
+
+    if modalities:
+        dfs = dfs[dfs.MODALITY.isin(modalities + ['SGP'])]
+
+    if procstatus:
+        # Only keep the statuses selected, drop types with none
+        mask = sum(STATUS_BITS.get(x, 0) for x in set(procstatus))
+        dfs = dfs[(dfs.BITS & mask) > 0].copy()
+        dfs['BITS'] = dfs['BITS'] & mask
+
+    # Lowest bit set is the first status in order
+    lowbit = dfs['BITS'] & -dfs['BITS']
+    dfs['METASTATUS'] = lowbit.map(
+        dict(zip(STATUS_BITS.values(), METASTATUS))).fillna('NONE')
+
+    return dfs
+
+
+def add_links(df, host, columns):
+    """Return df with xnat link columns, only made for displayed rows."""
+    df = df.copy()
+
+    subjlink = host + \
         '/data/projects/' + df['PROJECT'] + \
         '/subjects/' + df['SUBJECT']
 
-    df['PDF'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION'] + \
-        '/assessors/' + df['ASSR'] + \
-        '/out/resources/PDF/files/' + \
-        'report_' + df['ASSR'] + '.pdf'
+    if 'SUBJECTLINK' in columns:
+        df['SUBJECTLINK'] = subjlink
 
-    df['LOG'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION'] + \
-        '/assessors/' + df['ASSR'] + \
-        '/out/resources/OUTLOG/files/' + \
-        df['ASSR'] + '.txt'
+    sesslink = subjlink + '/experiments/' + df['SESSION']
 
-    df['NIFTI'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION'] + \
-        '/scans/' + df['SCANID'] + \
-        '/resources/NIFTI/files?format=zip'
+    if 'SESSIONLINK' in columns:
+        df['SESSIONLINK'] = sesslink
 
-    df['JSON'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION'] + \
-        '/scans/' + df['SCANID'] + \
-        '/resources/JSON/files?format=zip'
+    if 'PDF' in columns:
+        df['PDF'] = sesslink + \
+            '/assessors/' + df['ASSR'] + \
+            '/out/resources/PDF/files/' + \
+            'report_' + df['ASSR'] + '.pdf'
 
-    df['EDAT'] = garjus.xnat_host() + \
-        '/data/projects/' + df['PROJECT'] + \
-        '/subjects/' + df['SUBJECT'] + \
-        '/experiments/' + df['SESSION'] + \
-        '/scans/' + df['SCANID'] + \
-        '/resources/EDAT/files?format=zip'
+    if 'LOG' in columns:
+        df['LOG'] = sesslink + \
+            '/assessors/' + df['ASSR'] + \
+            '/out/resources/OUTLOG/files/' + \
+            df['ASSR'] + '.txt'
+
+    for res in ['NIFTI', 'JSON', 'EDAT']:
+        if res not in columns:
+            continue
 
-    df.loc[df.RESOURCES.str.contains('EDAT') == False, 'EDAT'] = ''
-    df.loc[df.RESOURCES.str.contains('JSON') == False, 'JSON'] = ''
-    df.loc[df.RESOURCES.str.contains('NIFTI') == False, 'NIFTI'] = ''
+        df[res] = sesslink + \
+            '/scans/' + df['SCANID'] + \
+            f'/resources/{res}/files?format=zip'
+
+        df.loc[df.RESOURCES.str.contains(res) == False, res] = ''
 
     return df
 
@@ -450,4 +491,9 @@ def filter_data(df, projects, proctypes, scantypes, starttime, endtime, sesstype
     if sesstypes:
         df = df[df['SESSTYPE'].isin(sesstypes)]
 
-    return df
+    # Filtered rows are pivoted and edited as plain values
+    return from_categories(df)
+
+
+# Precompute session statuses each time project data is loaded
+get_service().add_derived('qa', 'qastatus', session_status)
@@ -3,29 +3,16 @@ import os
 
 import pandas as pd
 
-from .. import utils
 from ....garjus import Garjus
+from ..service import get_service
 
 
 logger = logging.getLogger('dashboard.queue.data')
 
 
-# This is where we save our cache of the data
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/queuedata.pkl'
+def get_data(proj_filter, hidedone=True, garjus=None):
 
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
-
-    return filename
-
-
-def get_data(proj_filter, hidedone=True):
-
-    df = Garjus().tasks(hidedone=hidedone)
+    df = (garjus or Garjus()).tasks(hidedone=hidedone)
 
     df = df[df.STATUS != 'NEED_INPUTS']
 
@@ -57,33 +44,18 @@ def _get_proctype(row):
     return row
 
 
-def run_refresh(hidedone=True):
-    filename = get_filename()
-    proj_filter = []
-
-    df = get_data(proj_filter, hidedone=hidedone)
-
-    utils.save_data(df, filename)
-
-    return df
-
-
 def load_data(refresh=False, hidedone=True, maxmins=5):
-    filename = get_filename()
-
-    if not os.path.exists(filename):
-        refresh = True
-    elif utils.file_age(filename) > maxmins:
-        logger.info(f'refreshing, file age limit reached:{maxmins} minutes')
-        refresh = True
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
 
-    if refresh:
-        df = run_refresh(hidedone=hidedone)
-    else:
-        df = utils.read_data(filename)
+    df = service.get_user(
+        ('queue', hidedone),
+        lambda: get_data([], hidedone=hidedone, garjus=garjus),
+        maxmins * 60,
+        refresh=refresh)
 
-    logger.info('reading data from file:{}'.format(filename))
-    return df
+    # Shared by callbacks of user, give the caller a copy
+    return df.copy()
 
 
 def filter_data(df, proj, proc, user):
@@ -1,32 +1,16 @@
 import logging
-import os
 import pandas as pd
 from datetime import datetime
 
 from ....garjus import Garjus
+from ..service import get_service
 
 
 logger = logging.getLogger('dashboard.reports.data')
 
 
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/reportsdata.pkl'
-
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
-
-    return filename
-
-
-def run_refresh(filename):
-    df = get_data()
-
-    save_data(df, filename)
-
-    return df
+# Reports are refreshed in the background after this many secs
+REPORTS_TTL = 60 * 60
 
 
 def load_options(df):
@@ -35,7 +19,7 @@ def load_options(df):
     times = ['All', 'Current']
 
     # Projects
-    garjus = Garjus()
+    garjus = get_service().garjus()
     projects = garjus.projects()
 
     # Selected types
@@ -49,15 +33,17 @@ def load_options(df):
 
 
 def load_data(refresh=False):
-    filename = get_filename()
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
 
-    if refresh or not os.path.exists(filename):
-        run_refresh(filename)
+    df = service.get_user(
+        ('reports',),
+        lambda: get_data(garjus),
+        REPORTS_TTL,
+        refresh=refresh)
 
-    logger.info('reading data from file:{}'.format(filename))
-    df = read_data(filename)
-
-    return df
+    # Shared by callbacks of user, give the caller a copy
+    return df.copy()
 
 
 def filter_data(df, projects, types, timeframe):
@@ -75,18 +61,8 @@ def filter_data(df, projects, types, timeframe):
     return df
 
 
-def read_data(filename):
-    df = pd.read_pickle(filename)
-    return df
-
-
-def save_data(df, filename):
-    # save to cache
-    df.to_pickle(filename)
-
-
-def get_data():
-    g = Garjus()
+def get_data(garjus=None):
+    g = garjus or Garjus()
 
     if not g.redcap_enabled():
         logger.debug('redcap not enabled, no data')
@@ -0,0 +1,252 @@
+"""Shared data service for dashboard pages.
+
+One service per dashboard process holds the data for all users and pages.
+Entries are keyed by page name and project so that users selecting the
+same projects share one query, users only get projects they can access.
+Entries not partitioned by project are kept per user. Entries older than
+their ttl are returned as is while being refreshed in the background,
+concurrent loads of the same entry wait on a single query. Project entries
+are also saved to a columnar store of each user so they are shared across
+processes and restarts.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+from flask_login import current_user
+
+from ...garjus import Garjus
+from .store import ColumnStore, to_categories
+
+
+logger = logging.getLogger('dashboard.service')
+
+
+REFRESH_WORKERS = 4
+
+STORE_DIR = os.path.expanduser('~/.garjus/DASHBOARD')
+
+
+class DataService:
+    """In-process cache of dashboard data with per-key refresh."""
+
+    def __init__(self, workers=REFRESH_WORKERS, store=None):
+        self._store = store
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pending = {}
+        self._garjus = {}
+        self._derivers = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def garjus(self, renew=False):
+        """Return the Garjus of the current user, reused across callbacks."""
+        user = _current_user()
+
+        with self._lock:
+            g = self._garjus.get(user)
+
+        if g is None or renew:
+            # Connect outside the lock, last one in wins
+            g = Garjus()
+            g.enable_stats_mirror()
+            with self._lock:
+                self._garjus[user] = g
+
+        return g
+
+    def user(self):
+        """Return the id of the current user."""
+        return _current_user()
+
+    def user_projects(self, projects):
+        """Return the projects of projects the current user can access."""
+        allowed = self.garjus().projects()
+        return [x for x in projects if x in allowed]
+
+    def get_user(self, key, loader, ttl, refresh=False):
+        """Return data for key of the current user, see get().
+
+        Use for data not partitioned by project, loader() loads all
+        projects of the user.
+        """
+        return self.get(key + (_current_user(),), loader, ttl, refresh)
+
+    def get(self, key, loader, ttl, refresh=False):
+        """Return data for key, calling loader() if missing or refreshing.
+
+        Data older than ttl secs is returned and refreshed in the background.
+        Returned data is shared, callers must not modify it in place.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            pending = self._pending.get(key)
+
+            if entry is not None and not refresh:
+                data, loaded = entry
+                if time.time() - loaded > ttl and pending is None:
+                    logger.debug(f'background refresh:{key}')
+                    self._pending[key] = self._executor.submit(
+                        self._load, key, loader)
+
+                return data
+
+            owner = pending is None
+            if owner:
+                pending = Future()
+                self._pending[key] = pending
+
+        if owner:
+            self._load(key, loader, pending)
+        else:
+            logger.debug(f'waiting on refresh:{key}')
+
+        return pending.result()
+
+    def get_projects(
+        self, name, projects, loader, ttl, refresh=False, columns=None,
+        user=None
+    ):
+        """Return concatenated data of projects, one entry per project.
+
+        loader is called with a list of one project. Only the partitions
+        of projects are loaded and only the columns requested are returned,
+        columns are read from the store without the rest of the partition.
+        Callers filter projects with user_projects(). Store partitions are
+        those of user, the current user if not given.
+        """
+        dfs = []
+
+        if user is None:
+            user = _current_user()
+
+        if columns:
+            columns = tuple(columns)
+
+        for p in projects:
+            with self._lock:
+                # Whole partitions already loaded are sliced
+                key = (name, p) if (
+                    not columns or (name, p) in self._entries) else (
+                    name, p, columns)
+
+            df = self.get(
+                key,
+                lambda p=p: self._load_project(
+                    name, p, loader, ttl, refresh, user, columns),
+                ttl,
+                refresh=refresh)
+
+            if columns:
+                df = df[[x for x in columns if x in df.columns]]
+
+            dfs.append(df)
+
+        if not dfs:
+            return loader([])
+
+        # Categories are unioned so they stay categories
+        return to_categories(pd.concat(dfs, ignore_index=True))
+
+    def _load_project(
+        self, name, project, loader, ttl, refresh, user, columns=None
+    ):
+        # Each user has their own partitions in the store
+        store_name = f'{user}/{name}'
+
+        if self._store and not refresh:
+            age = self._store.age(store_name, project)
+            if age is not None and age < ttl:
+                logger.debug(f'reading store:{store_name}:{project}')
+                return self._store.read(
+                    store_name, project, columns=list(columns) if columns else None)
+
+        df = to_categories(loader([project]))
+
+        if self._store:
+            try:
+                self._store.write(store_name, project, df)
+            except Exception as err:
+                logger.warning(
+                    f'failed to write store:{store_name}:{project}:{err}')
+
+        if columns:
+            # Keep only the columns of this entry
+            df = df[[x for x in columns if x in df.columns]]
+
+        return df
+
+    def add_derived(self, name, derived, func):
+        """Compute entry of derived from each entry of name as it loads.
+
+        The derived entry has the same key with name replaced by derived.
+        """
+        self._derivers.setdefault(name, []).append((derived, func))
+
+    def clear(self, name=None):
+        """Remove entries of name or all entries."""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if name is None or key[0] == name:
+                    del self._entries[key]
+
+    def _load(self, key, loader, future=None):
+        start = time.time()
+
+        try:
+            data = loader()
+        except Exception as err:
+            logger.error(f'load failed:{key}:{err}')
+            with self._lock:
+                self._pending.pop(key, None)
+
+            if future:
+                future.set_exception(err)
+
+            raise
+
+        # Data read from the store is as old as the file
+        loaded = getattr(data, 'attrs', {}).get('loaded', time.time())
+
+        # Precompute derived entries in the same thread, not from entries
+        # of only some columns
+        derived = {}
+        derivers = self._derivers.get(key[0], []) if len(key) == 2 else []
+        for name, func in derivers:
+            try:
+                derived[(name,) + key[1:]] = (func(data), loaded)
+            except Exception as err:
+                logger.error(f'derive failed:{name}:{key}:{err}')
+
+        with self._lock:
+            self._entries[key] = (data, loaded)
+            self._entries.update(derived)
+            self._pending.pop(key, None)
+
+        logger.debug(f'loaded:{key}:{time.time() - start:.1f} secs')
+
+        if future:
+            future.set_result(data)
+
+        return data
+
+
+def _current_user():
+    try:
+        if current_user.is_authenticated:
+            return current_user.id
+    except Exception as err:
+        logger.debug(err)
+
+    return 'UnknownUser'
+
+
+_service = DataService(store=ColumnStore(STORE_DIR))
+
+
+def get_service():
+    """Return the data service of this process."""
+    return _service
@@ -29,20 +29,8 @@ HIDECOLS = [
 
 
 def _plottable(var):
-    if pd.api.types.is_numeric_dtype(var):
-        return True
-
-    try:
-        _ = var.astype(float)
-        return True
-    except Exception:
-        pass
-
-    try:
-        _ = var.str.strip('%').astype(float)
-        return True
-    except Exception:
-        return False
+    # Stats are parsed to numeric columns when loaded
+    return pd.api.types.is_numeric_dtype(var)
 
 
 def get_graph_content(df, selected_pivot):
@@ -139,7 +127,7 @@ def get_stats_graph(df, var_list, pivot=None):
 
         fig.append_trace(
             go.Box(
-                y=df[var].str.strip('%').astype(float),
+                y=df[var],
                 x=_xvalues,
                 boxpoints='all',
                 text=df['ASSR'],
@@ -293,12 +281,12 @@ def get_content():
     return content
 
 
-def load_stats(projects=[], refresh=False, filename=None):
+def load_stats(projects=[], refresh=False):
 
     if projects is None:
         projects = []
 
-    return data.load_data(projects, refresh=refresh, filename=filename)
+    return data.load_data(projects, refresh=refresh)
 
 
 def _subject_pivot(df):
@@ -332,6 +320,9 @@ def _subject_pivot(df):
     # Make the pivot table based on _index, _cols, _vars
     dfp = df.pivot(index=index_cols, columns=level_cols, values=stat_cols)
 
+    # Pivot of mixed types makes objects, restore numeric columns
+    dfp = dfp.infer_objects()
+
     if len(level_cols) == 1:
         # Concatenate column levels to get one level with delimiter
         dfp.columns = [f'{c[1]}_{c[0]}' for c in dfp.columns.values]
@@ -367,6 +358,9 @@ def _session_pivot(df):
     # Make the pivot table based on _index, _cols, _vars
     dfp = df.pivot(index=index_cols, columns=level_cols, values=stat_cols)
 
+    # Pivot of mixed types makes objects, restore numeric columns
+    dfp = dfp.infer_objects()
+
     dfp.columns = [c[0] for c in dfp.columns.values]
 
     # Clear the index so all columns are named
@@ -411,14 +405,9 @@ def update_stats(
         logger.debug('refresh:clicks={}'.format(n_clicks))
         refresh = True
 
-    # Load selected data with refresh if requested
+    # Load selected data with refresh if requested, new projects are loaded
     df = load_stats(selected_proj, refresh=refresh)
 
-    if selected_proj and (df.empty or (sorted(selected_proj) != sorted(df.PROJECT.unique()))):
-        # A new project was selected so we force refresh
-        logger.debug('new project selected, refreshing')
-        df = load_stats(selected_proj, refresh=True)
-
     # Get options based on selected projects, only show proc for those projects
     proj_options, proc_options = data.load_options(selected_proj)
 
@@ -439,11 +428,6 @@ def update_stats(
     # Get the graph content in tabs (currently only one tab)
     tabs = get_graph_content(df, selected_pivot)
 
-    # format floats so they sort in the table
-    for c in list(df.columns):
-        if _plottable(df[c]):
-            df[c] = df[c].str.strip('%').astype(float)
-
     # Apply pivot
     if selected_pivot == 'subj':
         df = _subject_pivot(df)
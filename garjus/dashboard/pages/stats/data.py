@@ -1,39 +1,23 @@
 import logging
-import os
 from datetime import datetime
 import pandas as pd
 
 from ....garjus import Garjus
+from ..service import get_service
+from ..store import from_categories
 
 
 logger = logging.getLogger('dashboard.stats.data')
 
 
-def get_filename():
-    datadir = f'{Garjus.userdir()}/DATA'
-    filename = f'{datadir}/statsdata.pkl'
-
-    try:
-        os.makedirs(datadir)
-    except FileExistsError:
-        pass
-
-    return filename
-
-
-def run_refresh(filename, projects):
-    # force a requery
-    df = get_data(projects)
-
-    save_data(df, filename)
-
-    return df
+# Stats are refreshed in the background after this many secs
+STATS_TTL = 60 * 60
 
 
 def load_options(selected_proj=None):
 
     try:
-        garjus = Garjus()
+        garjus = get_service().garjus()
 
         if not garjus.redcap_enabled():
             return [], []
@@ -53,35 +37,29 @@ def load_options(selected_proj=None):
         return [], []
 
 
-def load_data(projects, refresh=False, filename=None):
-    if not filename:
-        filename = get_filename()
-
-    if refresh or not os.path.exists(filename):
-        # TODO: check for old file and refresh too
-        run_refresh(filename, projects)
+def load_data(projects, refresh=False):
+    service = get_service()
+    garjus = service.garjus(renew=refresh)
+    projects = service.user_projects(projects)
 
-    logger.info('reading data from file:{}'.format(filename))
-    return read_data(filename)
+    # Shared per project entries, only new projects are queried
+    return service.get_projects(
+        'stats',
+        projects,
+        lambda x: get_data(x, garjus),
+        STATS_TTL,
+        refresh=refresh)
 
 
-def read_data(filename):
-    df = pd.read_pickle(filename)
-    return df
-
-
-def save_data(df, filename):
-    # save to cache
-    df.to_pickle(filename)
-
-
-def get_data(projects):
+def get_data(projects, garjus=None):
     df = pd.DataFrame()
-    garjus = Garjus()
 
     if not projects:
         return df
 
+    if garjus is None:
+        garjus = Garjus()
+
     # Concat project stats list of stats
     assessors = garjus.assessors(projects)
     for p in sorted(projects):
@@ -89,6 +67,12 @@ def get_data(projects):
         stats = garjus.stats(p, assessors)
         df = pd.concat([df, stats])
 
+    if df.empty:
+        return df
+
+    # Labels are edited below, categories are applied again by the service
+    df = from_categories(df)
+
     # Apply tweaks
     if 'SESSTYPE' in df.columns:
         df['SESSTYPE'] = df['SESSTYPE'].fillna('UNKNOWN')
@@ -143,4 +127,5 @@ def filter_data(df, proctypes, timeframe, sesstypes):
     # Remove empty columns
     df = df.dropna(axis=1, how='all')
 
-    return df
+    # Filtered rows are pivoted and edited as plain values
+    return from_categories(df)
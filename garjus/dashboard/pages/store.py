@@ -0,0 +1,100 @@
+"""Columnar file store of dashboard data partitioned by project.
+
+Each page name has a directory with one file per project. Parquet is used
+when pyarrow is installed, otherwise pickle. Low cardinality columns are
+stored as categories.
+"""
+import logging
+import os
+import time
+
+import pandas as pd
+
+
+logger = logging.getLogger('dashboard.store')
+
+
+try:
+    import pyarrow.parquet
+    FORMAT = 'parquet'
+except ModuleNotFoundError:
+    logger.debug('pyarrow not installed, using pickle')
+    FORMAT = 'pkl'
+
+
+CATEGORY_COLUMNS = ['PROJECT', 'SESSTYPE', 'SITE', 'TYPE', 'STATUS']
+
+
+class ColumnStore:
+    """Project partitioned files of dashboard data."""
+
+    def __init__(self, datadir):
+        self._datadir = datadir
+
+    def path(self, name, project):
+        return f'{self._datadir}/{name}/PROJECT={project}.{FORMAT}'
+
+    def age(self, name, project):
+        """Return secs since partition was written or None if missing."""
+        try:
+            return time.time() - os.path.getmtime(self.path(name, project))
+        except OSError:
+            return None
+
+    def read(self, name, project, columns=None):
+        """Read partition of project, only columns if specified."""
+        filename = self.path(name, project)
+
+        if FORMAT == 'parquet':
+            if columns:
+                # Columns missing from the partition are skipped
+                names = pyarrow.parquet.read_schema(filename).names
+                columns = [x for x in columns if x in names]
+
+            df = pd.read_parquet(filename, columns=columns)
+        else:
+            df = pd.read_pickle(filename)
+            if columns:
+                df = df[[x for x in columns if x in df.columns]]
+
+        # Entries are as old as the file
+        df.attrs['loaded'] = os.path.getmtime(filename)
+
+        return df
+
+    def write(self, name, project, df):
+        """Write partition of project, replacing existing."""
+        filename = self.path(name, project)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # Write to temp then move so readers never see partial file
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+
+        if FORMAT == 'parquet':
+            _to_strings(df).to_parquet(tmpname, index=False)
+        else:
+            df.to_pickle(tmpname)
+
+        os.replace(tmpname, filename)
+
+
+def to_categories(df):
+    """Convert low cardinality columns to categories."""
+    cols = [x for x in CATEGORY_COLUMNS if x in df.columns]
+    return df.astype({x: 'category' for x in cols})
+
+
+def _to_strings(df):
+    # Parquet columns have one type, store mixed objects as strings
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+
+    return df
+
+
+def from_categories(df):
+    """Convert category columns back to objects for pivots and edits."""
+    cols = [x for x in df.columns if isinstance(df[x].dtype, pd.CategoricalDtype)]
+    return df.astype({x: object for x in cols})
@@ -12,6 +12,10 @@ import glob
 import os
 import tempfile
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import yaml
 
 import pandas as pd
@@ -22,6 +26,7 @@ from flask_login import current_user
 from dax.XnatUtils import get_interface
 
 from .subjects import load_subjects
+from .cache import XnatCache, RedcapMemo, StatsMirror
 from . import utils_redcap
 from . import utils_xnat
 from . import utils_dcm2nii
@@ -31,12 +36,12 @@ from .compare import make_double_report, update as update_compare
 from .stats import update as update_stats
 from .automations import update as update_automations
 from .image03 import update as update_image03, download as download_image03
-from .issues import update as update_issues
+from .issues import update as update_issues, find_unmatched
 from .import_dicom import import_dicom_zip, import_dicom_url, import_dicom_dir
 from .dictionary import COLUMNS, PROCLIB, STATLIB
 from .dictionary import ACTIVITY_RENAME, PROCESSING_RENAME, ISSUES_RENAME, REPORTS_RENAME
 from .dictionary import TASKS_RENAME, ANALYSES_RENAME, DISABLE_STATTYPES
-from .tasks import update as update_tasks
+from .tasks import update as update_tasks, plan as plan_tasks
 from .analyses import run_analysis, download_resources, download_scan_resources
 from .scans import update as update_scans
 
@@ -44,6 +49,16 @@ from .scans import update as update_scans
 logger = logging.getLogger('garjus')
 
 
+# Maximum number of assessor labels to include in a single filtered query
+LABEL_CHUNK = 50
+
+# Maximum number of task records in a single import
+TASK_CHUNK = 100
+
+# Stats columns with few distinct values
+STATS_CATEGORIES = ['PROJECT', 'SESSTYPE', 'PROCTYPE', 'SITE']
+
+
 class Garjus:
     """
     Handles data in xnat and redcap.
@@ -128,6 +143,12 @@ class Garjus:
         self._tempdir = tempfile.mkdtemp()
         self._our_assessors = set()
         self._cachedir = os.path.expanduser('~/.garjus')
+        self._xnat_cache = None
+        self._stats_mirror = None
+        self._rc_memo = None
+        self._xnat_limit = None
+        self._rc_limit = None
+        self._activity_log = None
 
         try:
             os.makedirs(self._cachedir)
@@ -238,6 +259,43 @@ class Garjus:
     def cachedir(self):
         return self._cachedir
 
+    def enable_cache(self):
+        """Use local caches of XNAT and stats, refresh modified only."""
+        self._xnat_cache = XnatCache(self)
+        self.enable_stats_mirror()
+
+    def enable_stats_mirror(self):
+        """Use local mirror of stats, synced with modified records only."""
+        self._stats_mirror = StatsMirror(self)
+
+    def disable_cache(self):
+        """Stop using local caches, query XNAT and REDCap in full."""
+        self._xnat_cache = None
+        self._stats_mirror = None
+
+    def clear_cache(self, project=None):
+        """Delete local caches of XNAT scans/assessors and stats."""
+        XnatCache(self).clear(project)
+        StatsMirror(self).clear(project)
+
+    def _rc_export(self, records=None, forms=None, fields=None):
+        """Export from main REDCap, memoized during an update."""
+        with (self._rc_limit or nullcontext()):
+            if self._rc_memo:
+                return self._rc_memo.export_records(
+                    records=records, forms=forms, fields=fields)
+
+            return self._rc.export_records(
+                records=records, forms=forms, fields=fields)
+
+    def _rc_import(self, records):
+        """Import to main REDCap, invalidating memoized exports."""
+        with (self._rc_limit or nullcontext()):
+            if self._rc_memo:
+                return self._rc_memo.import_records(records)
+
+            return self._rc.import_records(records)
+
     def redcap_enabled(self):
         return (self._rc is not None)
 
@@ -400,6 +458,54 @@ class Garjus:
         result=None,
     ):
         """Add an activity record."""
+        record = self._activity_record(
+            project=project,
+            category=category,
+            description=description,
+            subject=subject,
+            event=event,
+            repeat=repeat,
+            session=session,
+            scan=scan,
+            field=field,
+            actdatetime=actdatetime,
+            result=result)
+
+        # Add new record
+        try:
+            response = self._rc_import([record])
+            assert 'count' in response
+            logger.debug('activity record created')
+        except (ValueError, RedcapError, AssertionError) as err:
+            logger.error(f'error uploading:{err}')
+
+    def activity_writer(self, batch_size=100, log_file=None):
+        """Return writer that adds activity records in batches.
+
+        Use as a context manager so remaining records are added on exit,
+        including on error. Records are added with writer.add_activity().
+        """
+        return ActivityWriter(
+            self, batch_size=batch_size, log_file=log_file or self._activity_log)
+
+    def set_activity_log(self, filename):
+        """Also append activity written in batches to local JSONL file."""
+        self._activity_log = filename
+
+    def _activity_record(
+        self,
+        project=None,
+        category=None,
+        description=None,
+        subject=None,
+        event=None,
+        repeat=None,
+        session=None,
+        scan=None,
+        field=None,
+        actdatetime=None,
+        result=None,
+    ):
         def_field = self._rc.def_field
 
         if not actdatetime:
@@ -408,7 +514,7 @@ class Garjus:
         # Format for REDCap
         activity_datetime = actdatetime.strftime("%Y-%m-%d %H:%M:%S")
 
-        record = {
+        return {
             def_field: project,
             'activity_description': f'{description}:{result}',
             'activity_datetime': activity_datetime,
@@ -425,14 +531,6 @@ class Garjus:
             'activity_complete': '2',
         }
 
-        # Add new record
-        try:
-            response = self._rc.import_records([record])
-            assert 'count' in response
-            logger.debug('activity record created')
-        except (ValueError, RedcapError, AssertionError) as err:
-            logger.error(f'error uploading:{err}')
-
     def assessors(self, projects=None, proctypes=None, sesstypes=None):
         """Query XNAT for all assessors of and return list of dicts."""
         if not projects:
@@ -1005,13 +1103,13 @@ class Garjus:
         else:
             projects = self.projects()
 
-        return self._rc.export_records(records=projects, forms=['sites'])
+        return self._rc_export(records=projects, forms=['sites'])
 
     def _load_project_names(self):
 
         # Get list of projects in redcap
         if self.redcap_enabled():
-            _records = self._rc.export_records(fields=[self._rc.def_field])
+            _records = self._rc_export(fields=[self._rc.def_field])
             redcap_names = [x[self._rc.def_field] for x in _records]
             logger.debug(f'redcap projects={redcap_names}')
         else:
@@ -1049,7 +1147,7 @@ class Garjus:
         if project not in self._project2stats:
             # get the project ID for the stats redcap for this project
             _fields = [def_field, 'project_stats']
-            rec = self._rc.export_records(records=[project], fields=_fields)
+            rec = self._rc_export(records=[project], fields=_fields)
             rec = [x for x in rec if x[def_field] == project][0]
             redcap_id = rec['project_stats']
 
@@ -1255,32 +1353,50 @@ class Garjus:
         assessors=None,
         proctypes=None,
         sesstypes=None,
-        persubject=False
+        persubject=False,
+        statnames=None
     ):
-        """Return all stats for project, filtered by proctypes."""
+        """Return all stats for project, filtered by proctypes.
+
+        If statnames is given, only those stats are included.
+        """
 
         if not self.redcap_enabled():
             logger.info('cannot load stats, redcap not enabled')
             return None
 
+        if assessors is None:
+            assessors = self.assessors(projects=[project], proctypes=proctypes)
+
         try:
-            """Get the stats data from REDCap."""
-            statsrc = self._stats_redcap(project)
-            rec = statsrc.export_records(forms=['stats'])
+            if self._stats_mirror:
+                # Read only stats of the assessors and names we need
+                self._stats_mirror.sync(project)
+                df = self._stats_mirror.stats(
+                    project,
+                    assessors=_filter_assessors(
+                        assessors, proctypes, sesstypes).ASSR,
+                    names=statnames)
+            else:
+                """Get the stats data from REDCap."""
+                statsrc = self._stats_redcap(project)
+                rec = statsrc.export_records(forms=['stats'])
+
+                # Make a dataframe of columns we need
+                df = pd.DataFrame(
+                    rec,
+                    columns=['stats_assr', 'stats_name', 'stats_value'])
 
+                if statnames is not None:
+                    df = df[df.stats_name.isin(statnames)]
         except:
             return pd.DataFrame(columns=['ASSR', 'PROCTYPE', 'SESSTYPE'])
 
         # Filter out FS6 if found
-        rec = [x for x in rec if 'FS6_v1' not in x['stats_assr']]
+        df = df[~df.stats_assr.str.contains('FS6_v1', regex=False)]
 
         # Filter out old FS7 if found
-        rec = [x for x in rec if not x['stats_name'].startswith('fs7_')]
-
-        # Make a dataframe of columns we need
-        df = pd.DataFrame(
-            rec,
-            columns=['stats_assr', 'stats_name', 'stats_value'])
+        df = df[~df.stats_name.str.startswith('fs7_')]
 
         df = df.drop_duplicates(subset=['stats_assr', 'stats_name'])
 
@@ -1293,8 +1409,8 @@ class Garjus:
 
         df = df.reset_index()
 
-        if assessors is None:
-            assessors = self.assessors(projects=[project], proctypes=proctypes)
+        # Parse values once here so callers get numeric columns
+        df, report = _parse_stats(df)
 
         # Merge with assessors
         df = pd.merge(
@@ -1302,6 +1418,9 @@ class Garjus:
 
         # Clean up
         df = df.drop(columns=['stats_assr'])
+
+        # Apply filters, then drop columns of stats from other types
+        df = _filter_assessors(df, proctypes, sesstypes)
         df = df.dropna(axis=1, how='all')
 
         if df.empty:
@@ -1309,19 +1428,15 @@ class Garjus:
 
         df = df.sort_values('ASSR')
 
-        # Apply filters
-        if proctypes:
-            df = df[df.PROCTYPE.isin(proctypes)]
-
-        if sesstypes:
-            df = df[df.SESSTYPE.isin(sesstypes)]
-
         if persubject:
             logger.debug(f'pivot to row per subject')
 
             # Pivot to row per subject
             df = _subject_pivot(df)
 
+        df = _stats_categories(df)
+        df.attrs['stats_parse'] = report
+
         return df
 
     def stats_assessors(self, project, proctypes=None):
@@ -1331,6 +1446,10 @@ class Garjus:
             logger.info('cannot load stats, redcap not enabled')
             return None
 
+        if self._stats_mirror:
+            self._stats_mirror.sync(project)
+            return self._stats_mirror.assessors(project)
+
         statsrc = self._stats_redcap(project)
 
         _records = statsrc.export_records(fields=['stats_assr'])
@@ -1502,7 +1621,7 @@ class Garjus:
 
         logger.debug(f'getting scantypes:{projects}')
 
-        records = self._rc.export_records(
+        records = self._rc_export(
             records=projects,
             fields=['project_scanmap'])
 
@@ -1594,17 +1713,46 @@ class Garjus:
         sites=None
     ):
         """Get scan info from XNAT as list of dicts."""
-        scans = []
+        if self._xnat_cache:
+            scans = []
+            for p in projects:
+                scans.extend(self._xnat_cache.load(
+                    'scans', p, self._query_scan_data))
+        else:
+            scans = self._query_scan_data(projects)
+
+        # Filter by scan type
+        if scantypes:
+            scans = [x for x in scans if x['SCANTYPE'] in scantypes]
+
+        # Filter by modality
+        if modalities:
+            scans = [x for x in scans if x['MODALITY'] in modalities]
+
+        # Filter by site
+        if sites:
+            scans = [x for x in scans if x['SITE'] in sites]
+
+        return scans
+
+    def _query_scan_data(self, projects, sessions=None):
+        """Query XNAT for scans, optionally only specified sessions."""
         uri = self.scan_uri
 
         if projects is not None:
             uri += f'&project={",".join(projects)}'
 
+        if sessions:
+            uri += f'&xnat:imagesessiondata/label={",".join(sessions)}'
+
         result = self._get_result(uri)
 
         # Get shared
         uri = self.scan_uri
         uri += f'&xnat:imagesessiondata/sharing/share/project={",".join(projects)}'
+        if sessions:
+            uri += f'&xnat:imagesessiondata/label={",".join(sessions)}'
+
         result2 = self._get_result(uri)
         # Set project to shared name
         for r in result2:
@@ -1626,35 +1774,43 @@ class Garjus:
                 scans[k] = self._scan_info(r)
 
         # Get just the values in a list
-        scans = list(scans.values())
+        return list(scans.values())
 
-        # Filter by scan type
-        if scantypes:
-            scans = [x for x in scans if x['SCANTYPE'] in scantypes]
-
-        # Filter by modality
-        if modalities:
-            scans = [x for x in scans if x['MODALITY'] in modalities]
+    def _load_assr_data(self, projects=None, proctypes=None):
+        """Get assessor info from XNAT as list of dicts."""
+        if self._xnat_cache:
+            assessors = []
+            for p in projects:
+                assessors.extend(self._xnat_cache.load(
+                    'assessors', p, self._query_assr_data))
+        else:
+            assessors = self._query_assr_data(projects)
 
-        # Filter by site
-        if sites:
-            scans = [x for x in scans if x['SITE'] in sites]
+        # Filter by type
+        if proctypes is not None:
+            assessors = [x for x in assessors if x['PROCTYPE'] in proctypes]
 
-        return scans
+        return assessors
 
-    def _load_assr_data(self, projects=None, proctypes=None):
-        """Get assessor info from XNAT as list of dicts."""
+    def _query_assr_data(self, projects, sessions=None):
+        """Query XNAT for assessors, optionally only specified sessions."""
         assessors = []
         uri = self.assr_uri
 
         if projects is not None:
             uri += f'&project={",".join(projects)}'
 
+        if sessions:
+            uri += f'&xnat:imagesessiondata/label={",".join(sessions)}'
+
         result = self._get_result(uri)
 
         # Get shared
         uri = self.assr_uri
         uri += f'&xnat:imagesessiondata/sharing/share/project={",".join(projects)}'
+        if sessions:
+            uri += f'&xnat:imagesessiondata/label={",".join(sessions)}'
+
         result2 = self._get_result(uri)
         # Set project to shared name
         for r in result2:
@@ -1666,12 +1822,43 @@ class Garjus:
         for r in result:
             assessors.append(self._assessor_info(r))
 
-        # Filter by type
-        if proctypes is not None:
-            assessors = [x for x in assessors if x['PROCTYPE'] in proctypes]
-
         return assessors
 
+    def assessor_statuses(self, labels):
+        """Query XNAT for status of assessors with labels, return dataframe.
+
+        Only the specified labels are queried, in batches, so the cost is
+        proportional to the number of labels not the size of the projects.
+        """
+        data = []
+        sgp_labels = [x for x in labels if is_sgp_assessor(x)]
+        assr_labels = [x for x in labels if not is_sgp_assessor(x)]
+
+        for i in range(0, len(assr_labels), LABEL_CHUNK):
+            chunk = assr_labels[i:i + LABEL_CHUNK]
+            uri = f'{utils_xnat.ASSR_STATUS_URI}&label={",".join(chunk)}'
+            for r in self._get_result(uri):
+                data.append({
+                    'PROJECT': r['project'],
+                    'ASSR': r['label'],
+                    'PROCSTATUS': r['proc:genprocdata/procstatus']})
+
+        for i in range(0, len(sgp_labels), LABEL_CHUNK):
+            chunk = sgp_labels[i:i + LABEL_CHUNK]
+            uri = f'{utils_xnat.SGP_STATUS_URI}&proc:subjgenprocdata/label={",".join(chunk)}'
+            for r in self._get_result(uri):
+                data.append({
+                    'PROJECT': r['project'],
+                    'ASSR': r['proc:subjgenprocdata/label'],
+                    'PROCSTATUS': r['proc:subjgenprocdata/procstatus']})
+
+        df = pd.DataFrame(data, columns=['PROJECT', 'ASSR', 'PROCSTATUS'])
+
+        # Subject query returns a row per subject assessor, keep requested
+        df = df[df.ASSR.isin(labels)].drop_duplicates('ASSR')
+
+        return df
+
     def _load_ares_data(self, project, proctype):
         data = {}
         uri = self.assr_uri + ',proc:genprocdata/out/file/label'
@@ -1719,7 +1906,8 @@ class Garjus:
             raise Exception('xnat not enabled')
 
         logger.debug(uri)
-        json_data = json.loads(self._xnat._exec(uri, 'GET'), strict=False)
+        with (self._xnat_limit or nullcontext()):
+            json_data = json.loads(self._xnat._exec(uri, 'GET'), strict=False)
         result = json_data['ResultSet']['Result']
         return result
 
@@ -1984,8 +2172,86 @@ class Garjus:
         """Return stats library."""
         return STATLIB
 
-    def update(self, projects=None, choices=None, types=None):
-        """Update projects."""
+    def update(
+        self,
+        projects=None,
+        choices=None,
+        types=None,
+        workers=1,
+        xnat_connections=None,
+        redcap_connections=None,
+    ):
+        """Update projects, in parallel across projects if workers > 1."""
+        if self.redcap_enabled():
+            # Memoize main REDCap exports for the duration of the update
+            self._rc_memo = RedcapMemo(self._rc)
+
+        try:
+            if workers > 1:
+                self._update_parallel(
+                    projects,
+                    choices,
+                    types,
+                    workers,
+                    xnat_connections or workers,
+                    redcap_connections or workers)
+            else:
+                self._update(projects, choices, types)
+        finally:
+            if self._rc_memo:
+                logger.info(
+                    f'redcap exports:hits={self._rc_memo.hits}, '
+                    f'misses={self._rc_memo.misses}')
+
+            self._rc_memo = None
+            self._xnat_limit = None
+            self._rc_limit = None
+
+    def _update_parallel(
+        self,
+        projects,
+        choices,
+        types,
+        workers,
+        xnat_connections,
+        redcap_connections
+    ):
+        """Run update of each project in a pool of threads."""
+        project2secs = {}
+
+        if not projects:
+            projects = self.projects()
+
+        logger.info(f'updating {len(projects)} projects with {workers} workers')
+
+        # Limit concurrent connections to each host
+        self._xnat_limit = threading.BoundedSemaphore(xnat_connections)
+        self._rc_limit = threading.BoundedSemaphore(redcap_connections)
+
+        # Find unmatched sessions once across all projects
+        unmatched = None
+        if (not choices or 'issues' in choices) and self.xnat_enabled():
+            unmatched = find_unmatched(self)
+
+        def _update_project(project):
+            start = time.time()
+            try:
+                self._update([project], choices, types, unmatched=unmatched)
+            except Exception as err:
+                logger.error(f'update failed:{project}:{err}')
+
+            return time.time() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_update_project, p): p for p in projects}
+            for f in as_completed(futures):
+                project2secs[futures[f]] = f.result()
+
+        # Report wall time per project, slowest first
+        for p, secs in sorted(project2secs.items(), key=lambda x: -x[1]):
+            logger.info(f'update time:{p}:{secs:.1f} secs')
+
+    def _update(self, projects=None, choices=None, types=None, unmatched=None):
         if not projects:
             projects = self.projects()
 
@@ -2007,7 +2273,7 @@ class Garjus:
 
         if 'issues' in choices:
             logger.info('updating issues')
-            update_issues(self, projects)
+            update_issues(self, projects, unmatched=unmatched)
             logger.debug('deleting old issues')
             self.delete_old_issues(projects)
 
@@ -2046,6 +2312,13 @@ class Garjus:
             logger.info('updating scans')
             update_scans(self, projects)
 
+    def plan_tasks(self, projects=None, types=None):
+        """Return dataframe of planned task builds, without making changes."""
+        if not projects:
+            projects = self.projects()
+
+        return plan_tasks(self, projects, types=types)
+
     def report(self, project, monthly=False):
         """Create a PDF report."""
         pdf_file = f'{project}_report.pdf'
@@ -2149,7 +2422,7 @@ class Garjus:
             return None
 
         _fields = [def_field, 'project_stats']
-        rec = self._rc.export_records(fields=_fields)
+        rec = self._rc_export(fields=_fields)
         return [x[def_field] for x in rec if x['project_stats']]
 
     def add_task(self, project, assr, inputlist, var2val, walltime, memreq, yamlfile, userinputs):
@@ -2176,6 +2449,7 @@ class Garjus:
                     'redcap_repeat_instrument': 'taskqueue',
                     'redcap_repeat_instance': task_id,
                     'task_status': 'QUEUED',
+                    'task_procdate': _queued_date(),
                     'task_inputlist': inputlist,
                     'task_var2val': var2val,
                     'task_walltime': walltime,
@@ -2200,6 +2474,7 @@ class Garjus:
                     'redcap_repeat_instance': 'new',
                     'task_assessor': assr,
                     'task_status': 'QUEUED',
+                    'task_procdate': _queued_date(),
                     'task_inputlist': inputlist,
                     'task_var2val': var2val,
                     'task_walltime': walltime,
@@ -2230,6 +2505,133 @@ class Garjus:
                 yamlfile,
                 repeat_id=task_id)
 
+    def task_assessors(self, project):
+        """Return dict of task id to (assessor label, status) of project."""
+        def_field = self._rcq.def_field
+
+        rec = self._rcq.export_records(
+            records=[project],
+            fields=[def_field, 'task_assessor', 'task_status'])
+
+        rec = [x for x in rec if x['redcap_repeat_instrument'] == 'taskqueue']
+
+        return {
+            r['redcap_repeat_instance']: (r['task_assessor'], r['task_status'])
+            for r in rec}
+
+    def add_tasks(self, project, tasks):
+        """Add or update task records of project, imported in chunks.
+
+        Each task is a dict with the arguments of add_task: assr, inputlist,
+        var2val, walltime, memreq, yamlfile, userinputs. A chunk that fails
+        is imported again one task at a time, new tasks the failed request
+        may have created are found first so they are not duplicated.
+        Returns list of assessor labels of tasks that failed to import.
+        """
+        records = []
+        custom = []
+        def_field = self._rcq.def_field
+
+        if not tasks:
+            return []
+
+        # Match existing records with one export, first task of assessor
+        assr2id = {}
+        for task_id, (assr, _) in self.task_assessors(project).items():
+            assr2id.setdefault(assr, task_id)
+
+        for t in tasks:
+            assr = t['assr']
+
+            if os.path.dirname(t['yamlfile']) != self._yamldir:
+                task_yamlfile = 'CUSTOM'
+                custom.append(t)
+            else:
+                task_yamlfile = os.path.basename(t['yamlfile'])
+
+            record = {
+                def_field: project,
+                'redcap_repeat_instrument': 'taskqueue',
+                'task_status': 'QUEUED',
+                'task_procdate': _queued_date(),
+                'task_inputlist': json.dumps(t['inputlist']),
+                'task_var2val': json.dumps(t['var2val']),
+                'task_walltime': t['walltime'],
+                'task_memreq': t['memreq'],
+                'task_yamlfile': task_yamlfile,
+                'task_userinputs': t['userinputs'],
+            }
+
+            task_id = assr2id.get(assr, None)
+            if task_id:
+                # Update existing record
+                record['redcap_repeat_instance'] = task_id
+                record['task_timeused'] = ''
+                record['task_memused'] = ''
+            else:
+                # Create a new record
+                record['redcap_repeat_instance'] = 'new'
+                record['task_assessor'] = assr
+
+            records.append(record)
+
+        failed = []
+        labels = [t['assr'] for t in tasks]
+        for i in range(0, len(records), TASK_CHUNK):
+            chunk = list(zip(labels[i:i + TASK_CHUNK], records[i:i + TASK_CHUNK]))
+            err = self._import_tasks([r for _, r in chunk])
+            if err is None:
+                continue
+
+            if isinstance(err, ConnectionError) and utils_redcap.maybe_sent(err):
+                # Request may have created new tasks, only retry missing
+                found = set(x for x, _ in self.task_assessors(project).values())
+                chunk = [(x, r) for x, r in chunk if not (
+                    utils_redcap.is_new_record(r) and x in found)]
+
+            # Import one at a time so only bad tasks are lost
+            for label, record in chunk:
+                if self._import_tasks([record]) is not None:
+                    logger.error(f'failed to add task:{label}')
+                    failed.append(label)
+
+        logger.debug(f'task records created:{len(records) - len(failed)}')
+
+        custom = [t for t in custom if t['assr'] not in failed]
+        if not custom:
+            return failed
+
+        # Find ids of new records and upload yamls not in yaml dir
+        assr2id = {}
+        for task_id, (assr, _) in self.task_assessors(project).items():
+            assr2id.setdefault(assr, task_id)
+
+        for t in custom:
+            task_id = assr2id.get(t['assr'], None)
+            if not task_id:
+                logger.error(f'task not found:{t["assr"]}')
+                continue
+
+            logger.debug(f'uploading file:{t["yamlfile"]}')
+            utils_redcap.upload_file(
+                self._rcq,
+                project,
+                'task_yamlupload',
+                t['yamlfile'],
+                repeat_id=task_id)
+
+        return failed
+
+    def _import_tasks(self, records):
+        # Returns None if imported, otherwise the error
+        try:
+            response = self._rcq.import_records(records)
+            assert 'count' in response
+            return None
+        except (RedcapError, ConnectionError, AssertionError) as err:
+            logger.error(f'task import failed:{len(records)}:{err}')
+            return err
+
     def assessor_task_id(self, project, assessor):
         task_id = None
         def_field = self._rcq.def_field
@@ -2270,7 +2672,7 @@ class Garjus:
                 'progress_name': prog_name,
                 'progress_complete': '2',
             }
-            response = self._rc.import_records([record])
+            response = self._rc_import([record])
             assert 'count' in response
             logger.debug('created new progress record')
 
@@ -2321,7 +2723,7 @@ class Garjus:
                 'double_name': comp_name,
                 'double_complete': '2',
             }
-            response = self._rc.import_records([record])
+            response = self._rc_import([record])
             assert 'count' in response
             logger.debug('double record created')
 
@@ -2404,8 +2806,13 @@ class Garjus:
 
         return stats
 
-    def set_stats(self, project, subject, session, assessor, data):
-        """Upload stats to redcap."""
+    def stats_writer(self, project, batch_size=1000):
+        """Return writer to upload stats to redcap in batches."""
+        return utils_redcap.RecordWriter(
+            self._stats_redcap(project), batch_size=batch_size)
+
+    def set_stats(self, project, subject, session, assessor, data, writer=None):
+        """Upload stats to redcap, or add to writer to upload in batch."""
 
         if 'Multi_Atlas_v3' in assessor:
             data = {k: data.get(k, '') for k in ['ticv_mm3']}
@@ -2425,6 +2832,11 @@ class Garjus:
             r['redcap_repeat_instance'] = 'new'
             r['stats_complete'] = 2
 
+        if writer:
+            logger.debug(f'adding to batch:{assessor}')
+            writer.add(rec)
+            return
+
         # Now upload
         logger.debug(f'uploading to redcap:{project}')
         statsrc = self._stats_redcap(project)
@@ -2484,7 +2896,7 @@ class Garjus:
         if isinstance(project, list):
             return self.projects_setting(project, setting)
 
-        records = self._rc.export_records(records=[project], forms=['main'])
+        records = self._rc_export(records=[project], forms=['main'])
         if not records:
             return None
 
@@ -2501,7 +2913,7 @@ class Garjus:
             logger.info('cannot load project setting, redcap not enabled')
             return None
 
-        records = self._rc.export_records(records=projects, forms=['main'])
+        records = self._rc_export(records=projects, forms=['main'])
         if not records:
             return None
 
@@ -2525,7 +2937,7 @@ class Garjus:
         auto_names = self.etl_automation_choices()
         logger.debug(f'loading etl_automations:{project}')
         try:
-            rec = self._rc.export_records(records=[project], forms=['main'])[0]
+            rec = self._rc_export(records=[project], forms=['main'])[0]
         except IndexError:
             return []
 
@@ -2586,7 +2998,7 @@ class Garjus:
         auto_names = self.scan_automation_choices()
 
         try:
-            rec = self._rc.export_records(records=[project], forms=['main'])[0]
+            rec = self._rc_export(records=[project], forms=['main'])[0]
         except IndexError:
             return []
 
@@ -2604,7 +3016,7 @@ class Garjus:
             logger.info('cannot load edat protocols, redcap not enabled')
             return []
 
-        rec = self._rc.export_records(records=[project], forms=['edat'])
+        rec = self._rc_export(records=[project], forms=['edat'])
 
         rec = [x for x in rec if x['redcap_repeat_instrument'] == 'edat']
 
@@ -2617,13 +3029,32 @@ class Garjus:
             logger.info('cannot load scanning protocols, redcap not enabled')
             return []
 
-        rec = self._rc.export_records(records=[project], forms=['scanning'])
+        rec = self._rc_export(records=[project], forms=['scanning'])
 
         # this will remove the main record that is sometimes included
         rec = [x for x in rec if x['redcap_repeat_instrument'] == 'scanning']
 
         return rec
 
+    def scanning_protocols_by_project(self, projects):
+        """Return dict of project to list of scanning protocol records."""
+        protocols = {}
+
+        if not self.redcap_enabled():
+            logger.info('cannot load scanning protocols, redcap not enabled')
+            return protocols
+
+        def_field = self._rc.def_field
+        rec = self._rc_export(records=projects, forms=['scanning'])
+
+        # this will remove the main record that is sometimes included
+        rec = [x for x in rec if x['redcap_repeat_instrument'] == 'scanning']
+
+        for r in rec:
+            protocols.setdefault(r[def_field], []).append(r)
+
+        return protocols
+
     def add_issues(self, issues):
         """Add list of issues."""
         records = []
@@ -2647,7 +3078,7 @@ class Garjus:
 
         try:
             logger.debug(records)
-            response = self._rc.import_records(records)
+            response = self._rc_import(records)
             assert 'count' in response
             logger.debug('issues uploaded')
         except AssertionError as err:
@@ -2683,7 +3114,7 @@ class Garjus:
 
         # Add new record
         try:
-            response = self._rc.import_records([record])
+            response = self._rc_import([record])
             assert 'count' in response
             logger.debug('issue record created')
         except (ValueError, RedcapError, AssertionError) as err:
@@ -2862,7 +3293,7 @@ class Garjus:
             })
 
         try:
-            response = self._rc.import_records(records)
+            response = self._rc_import(records)
             assert 'count' in response
             logger.debug('issues records completed')
         except AssertionError as err:
@@ -2871,27 +3302,36 @@ class Garjus:
     def delete_issues(self, issues):
         """Delete specified issues, delete in REDCap."""
         def_field = self._rc.def_field
+        id2main = {}
+
+        # Group by instance, each call deletes one instance of many records
+        for i in issues:
+            id2main.setdefault(i['redcap_repeat_instance'], []).append(i[def_field])
 
         try:
-            for i in issues:
-                _main = i[def_field],
-                _id = i['redcap_repeat_instance']
-                logger.debug(f'deleting:issue:{_main}:{_id}')
+            for _id, _mains in id2main.items():
+                logger.debug(f'deleting:issue:{_mains}:{_id}')
                 # https://redcap.vanderbilt.edu/api/help/?content=del_records
                 _payload = {
                     'action': 'delete',
                     'returnFormat': 'json',
-                    'records[0]': _main,
                     'instrument': 'issues',
                     'repeat_instance': _id,
                     'content': 'record',
                     'token': self._rc.token,
                     'format': 'json'}
 
-                self._rc._call_api(_payload, 'del_record')
+                for n, _main in enumerate(_mains):
+                    _payload[f'records[{n}]'] = _main
+
+                with (self._rc_limit or nullcontext()):
+                    self._rc._call_api(_payload, 'del_record')
         except Exception as err:
             logger.error(f'failed to delete records:{err}')
 
+        if self._rc_memo:
+            self._rc_memo.invalidate(['issues'])
+
     def rename_dicom(self, in_dir, out_dir):
         """Sort DICOM folder into scans."""
         utils_dcm2nii.rename_dicom(in_dir, out_dir)
@@ -3220,10 +3660,15 @@ class Garjus:
         download_scan_resources(self, project, download_dir, scantype, resources, files, sesstypes, sessinclude)
 
     # Pass tasks from garjus to dax by writing files to DISKQ
-    def queue2dax(self):
+    def queue2dax(self, **kwargs):
+        """Write queued tasks to DISKQ, kwargs are limits and priority.
+
+        Throttling is opt-in, no limits apply unless max_jobs,
+        max_project_jobs or max_proctype_jobs are given.
+        """
         from .tasks import garjus2dax
         # TODO: check for duplicate inputs
-        garjus2dax.queue2dax(self)
+        garjus2dax.queue2dax(self, **kwargs)
 
     # Update queue from dax
     def dax2queue(self):
@@ -3312,6 +3757,7 @@ class Garjus:
                 'redcap_repeat_instrument': 'taskqueue',
                 'redcap_repeat_instance': t['ID'],
                 'task_status': 'QUEUED',
+                'task_procdate': _queued_date(),
                 'task_timeused': '',
                 'task_memused': '',
                 'task_failcount': '1',
@@ -3371,6 +3817,50 @@ class Garjus:
         return list(self._our_assessors)
 
 
+class ActivityWriter(utils_redcap.RecordWriter):
+    """Buffered writer of activity records to the main REDCap."""
+
+    def __init__(self, garjus, batch_size=100, log_file=None):
+        super().__init__(
+            _RedcapImporter(garjus),
+            batch_size=batch_size,
+            log_file=log_file)
+        self._garjus = garjus
+
+    def add_activity(self, **kwargs):
+        """Add an activity record, same arguments as Garjus.add_activity."""
+        self.add([self._garjus._activity_record(**kwargs)])
+
+    def _import(self, records):
+        try:
+            super()._import(records)
+        except ValueError as err:
+            # Skip bad records like add_activity, import the others alone
+            if len(records) == 1:
+                logger.error(f'error uploading:{err}')
+                self._failed(records, time.time())
+                return
+
+            for r in records:
+                self._import([r])
+
+
+class _RedcapImporter:
+    """Imports to the main REDCap through Garjus, with memo and limits."""
+
+    def __init__(self, garjus):
+        self._garjus = garjus
+
+    def import_records(self, records):
+        return self._garjus._rc_import(records)
+
+
+def _queued_date():
+    # Time a task was queued, stored in task_procdate which is only set
+    # when a task is queued. queue2dax releases oldest tasks first by it
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
 def is_sgp_assessor(assessor):
     import re
     SGP_PATTERN = '^\w+-x-\w+-x-\w+_v[0-9]+-x-[0-9a-f]+$'
@@ -3379,6 +3869,66 @@ def is_sgp_assessor(assessor):
     return re.match(SGP_PATTERN, assessor)
 
 
+def _filter_assessors(df, proctypes=None, sesstypes=None):
+    if proctypes:
+        df = df[df.PROCTYPE.isin(proctypes)]
+
+    if sesstypes:
+        df = df[df.SESSTYPE.isin(sesstypes)]
+
+    return df
+
+
+def _parse_stats(df):
+    """Convert stats columns to numbers, return df and report of each column.
+
+    A column is converted only if all values parse, otherwise it is left as
+    text. Columns of whole numbers are Int64 so they are written without
+    decimals, others are float32 where no precision is lost.
+    """
+    report = {}
+    df = df.copy()
+
+    for c in df.columns:
+        if c == 'stats_assr':
+            continue
+
+        values = df[c]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = values.where(values != '')
+            parsed = pd.to_numeric(
+                values.str.strip().str.strip('%'), errors='coerce')
+
+            failed = int((parsed.isna() & values.notna()).sum())
+            if failed:
+                report[c] = {'dtype': 'text', 'failed': failed}
+                continue
+
+            values = parsed.astype('float64')
+
+        whole = values.dropna()
+        if len(whole) and (whole % 1 == 0).all():
+            values = values.astype('Int64')
+        else:
+            f32 = values.astype('float32')
+            if f32.astype('float64').equals(values):
+                values = f32
+
+        df[c] = values
+        report[c] = {'dtype': str(values.dtype), 'failed': 0}
+
+    text = [c for c, r in report.items() if r['dtype'] == 'text']
+    logger.debug(f'stats parsed:{len(report) - len(text)} numeric:{text}')
+
+    return df, report
+
+
+def _stats_categories(df):
+    # Repeated labels are stored once per value
+    cols = [x for x in STATS_CATEGORIES if x in df.columns]
+    return df.astype({x: 'category' for x in cols})
+
+
 def _subject_pivot(df):
     # Pivot to one row per subject
     level_cols = ['SESSTYPE', 'PROCTYPE']
@@ -3400,6 +3950,9 @@ def _subject_pivot(df):
     # Make the pivot table based on _index, _cols, _vars
     dfp = df.pivot(index=index_cols, columns=level_cols, values=stat_cols)
 
+    # Pivot of mixed types makes objects, restore numeric columns
+    dfp = dfp.infer_objects()
+
     if len(df.SESSTYPE.unique()) > 1:
         # Concatenate column levels to get one level with delimiter
         dfp.columns = [f'{c[1]}_{c[0]}' for c in dfp.columns.values]
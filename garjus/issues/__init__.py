@@ -3,22 +3,24 @@ import os
 
 import logging
 import importlib
+import time
 
 
 logger = logging.getLogger('garjus.issues')
 
 
-def update(garjus, projects=None):
+def update(garjus, projects=None, unmatched=None):
     """Update issues."""
 
     if not garjus.xnat_enabled():
         logger.debug('no xnat, cannot update issues')
         return
 
-    # First find unmatched sessions across projects.
-    # these are sessions that are in source project
-    # but not found in destination projects
-    unmatched = _unmatched(garjus)
+    if unmatched is None:
+        # First find unmatched sessions across projects.
+        # these are sessions that are in source project
+        # but not found in destination projects
+        unmatched = find_unmatched(garjus)
 
     # TODO: only need to check projects with same source project
 
@@ -29,16 +31,28 @@ def update(garjus, projects=None):
             update_project(garjus, p, unmatched[p])
 
 
-def _unmatched(garjus):
+def find_unmatched(garjus, return_counts=False):
+    """Find sessions in source projects not found in destination projects.
+
+    Returns dict of destination project to list of unmatched sessions. If
+    return_counts is True, also returns a list with counts and time for
+    each source project.
+    """
     src2dst = {}
     src2ignore = {}
     unmatched = {}
+    counts = []
+    dst2srcids = {}
+
+    # Load scanning protocols of all projects at once
+    projects = garjus.projects()
+    protocols = garjus.scanning_protocols_by_project(projects)
 
     # Build the list of dst projects (and ignore list) for each source project
-    for dst_project in garjus.projects():
+    for dst_project in projects:
         unmatched[dst_project] = []
 
-        for p in garjus.scanning_protocols(dst_project):
+        for p in protocols.get(dst_project, []):
             src_project = p['scanning_srcproject']
 
             if not src_project:
@@ -47,7 +61,7 @@ def _unmatched(garjus):
 
             # Get sessions to ignore
             ignore_sessions = p['scanning_ignore'].split(',')
-            ignore_sessions = [x.strip() for x in ignore_sessions]
+            ignore_sessions = set(x.strip() for x in ignore_sessions)
 
             # Append dst project to list
             if src_project not in src2dst:
@@ -58,25 +72,31 @@ def _unmatched(garjus):
             elif dst_project not in src2dst[src_project]:
                 # Add to existing lists
                 src2dst[src_project].append(dst_project)
-                src2ignore[src_project].extend(ignore_sessions)
+                src2ignore[src_project].update(ignore_sessions)
 
     # Find unmatched in each source project
     for src_project, dst_projects in src2dst.items():
+        start = time.time()
         logger.debug(f'finding unmatched sessions:{src_project}')
         src_labels = garjus.session_labels(src_project)
         src_ignore = src2ignore[src_project]
 
-        # Build the list of src IDs for sessions in the destination projects
-        srcid_list = []
+        # Build the set of src IDs for sessions in the destination projects
+        srcid_set = set()
         for dst_project in dst_projects:
             # These are the original session labels before being renamed
-            srcid_list += garjus.session_source_labels(dst_project)
+            if dst_project not in dst2srcids:
+                dst2srcids[dst_project] = garjus.session_source_labels(
+                    dst_project)
+
+            srcid_set.update(dst2srcids[dst_project])
 
         # Apply ignore list
+        num_ignored = len([x for x in src_labels if x in src_ignore])
         src_labels = [x for x in src_labels if x not in src_ignore]
 
         # Get unmatched, not in list of sources in destination
-        src_unmatched = [x for x in src_labels if x not in srcid_list]
+        src_unmatched = [x for x in src_labels if x not in srcid_set]
 
         # Create an issue for each dst project, we don't know which is the dst
         for sess in src_unmatched:
@@ -84,6 +104,23 @@ def _unmatched(garjus):
             for dst_project in dst_projects:
                 unmatched[dst_project].append(sess)
 
+        secs = time.time() - start
+        logger.info(
+            f'unmatched:{src_project}:{len(src_labels)} sessions:'
+            f'{len(src_unmatched)} unmatched:{secs:.1f} secs')
+
+        counts.append({
+            'SOURCE': src_project,
+            'DESTINATIONS': ','.join(dst_projects),
+            'SESSIONS': len(src_labels),
+            'IGNORED': num_ignored,
+            'UNMATCHED': len(src_unmatched),
+            'SECS': secs,
+        })
+
+    if return_counts:
+        return unmatched, counts
+
     return unmatched
 
 
@@ -181,20 +218,34 @@ def update_project(garjus, project, unmatched):
     _add_issues(garjus, results, project)
 
 
-def _matching_issues(issue1, issue2):
-    # Matching means both issues are of the same category
-    # and on the same Project/Subject
-    # and as applicable, the same XNAT Session/Scan
-    # and as applicable the same REDCap Event/Field
-    keys = [
-        'PROJECT', 'CATEGORY', 'SUBJECT', 'SESSION', 'SCAN', 'EVENT', 'FIELD']
+# Matching means both issues are of the same category
+# and on the same Project/Subject
+# and as applicable, the same XNAT Session/Scan
+# and as applicable the same REDCap Event/Field.
+# A field missing from a new record matches any value of the existing issue.
+MATCH_KEYS = [
+    'PROJECT', 'CATEGORY', 'SUBJECT', 'SESSION', 'SCAN', 'EVENT', 'FIELD']
+
+
+def _norm(value):
+    # Normalize values for comparison, REDCap returns blanks as empty string
+    if value is None:
+        return ''
+
+    return str(value)
+
 
-    for k in keys:
-        if (k.lower() in issue1) and (issue1[k.lower()] != issue2[k]):
-            return False
+def _match_keys(rec):
+    # Keys of issue fields present in record
+    return tuple(k for k in MATCH_KEYS if k.lower() in rec)
 
-    # Everything matched
-    return True
+
+def _record_key(rec, keys):
+    return tuple(_norm(rec[k.lower()]) for k in keys)
+
+
+def _issue_key(issue, keys):
+    return tuple(_norm(issue[k]) for k in keys)
 
 
 def _audit_edat(project, events, rawfield, convfield, readyfield):
@@ -261,20 +312,23 @@ def _add_issues(garjus, records, project):
 
 def _find_new(issues, records):
     results = []
+    index = {}
+    cur_issues = issues.to_dict('records')
 
     for rec in records:
-        isnew = True
+        keys = _match_keys(rec)
+
+        # Index existing issues by the fields in this kind of record
+        if keys not in index:
+            index[keys] = {}
+            for cur in cur_issues:
+                index[keys].setdefault(_issue_key(cur, keys), cur)
 
         # Try to find a matching record
-        for cur in issues.to_dict('records'):
-            cur_id = cur['ID']
-            cur_proj = cur['PROJECT']
-            if _matching_issues(rec, cur):
-                isnew = False
-                logger.debug(f'matches existing issue:{cur_proj}:{cur_id}')
-                break
-
-        if isnew:
+        cur = index[keys].get(_record_key(rec, keys), None)
+        if cur:
+            logger.debug(f'matches existing issue:{cur["PROJECT"]}:{cur["ID"]}')
+        else:
             results.append(rec)
 
     return results
@@ -283,24 +337,29 @@ def _find_new(issues, records):
 def _find_fixed(issues, records):
     """Return issues that are not in current search, i.e. resolved"""
     results = []
+    index = {}
+
+    # Index records by the fields they include
+    for rec in records:
+        keys = _match_keys(rec)
+        index.setdefault(keys, set()).add(_record_key(rec, keys))
+
     # Find old issues
     logger.debug('checking for resolved issues')
     for cur in issues.to_dict('records'):
-        isold = True
         cur_id = cur['ID']
         cur_proj = cur['PROJECT']
 
         # Try to find a matching record
-        for rec in records:
-            if _matching_issues(rec, cur):
-                isold = False
-                logger.debug(f'matches existing issue:{cur_proj}:{cur_id}')
-                break
+        isold = not any(
+            _issue_key(cur, k) in v for k, v in index.items())
 
         if isold:
             # Append to list as closed with current time
             logger.debug(f'found resolved issue:{cur_proj}:{cur_id}')
             results.append({'project': cur_proj, 'id': cur_id})
+        else:
+            logger.debug(f'matches existing issue:{cur_proj}:{cur_id}')
 
     return results
 
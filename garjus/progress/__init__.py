@@ -12,6 +12,7 @@ import pandas as pd
 
 from .report import make_project_report
 from .export import make_export_report
+from .data import ProjectData, get_bundle, from_categories
 
 
 logger = logging.getLogger('garjus.progress')
@@ -35,11 +36,15 @@ def update(garjus, projects=None):
     for p in (projects or garjus.projects()):
         if p in projects:
             logger.debug(f'updating progress:{p}')
-            update_project(garjus, p)
+            update_project(garjus, p, bundles={})
 
 
-def update_project(garjus, project):
+def update_project(garjus, project, bundles=None):
     """Update project progress."""
+    if bundles is None:
+        # Report and zip builders share one load of the project data
+        bundles = {}
+
     progs = garjus.progress_reports(projects=[project])
 
     # what time is it? we will use this for naming
@@ -52,22 +57,32 @@ def update_project(garjus, project):
     has_cur = any(d.get('progress_name') == cur_progress for d in progs)
     if not has_cur:
         logger.debug(f'making new progress record:{project}:{cur_progress}')
-        make_progress(garjus, project, cur_progress, now)
+        make_progress(garjus, project, cur_progress, now, bundles=bundles)
     else:
         logger.debug(f'progress record exists:{project}:{cur_progress}')
 
 
-def make_progress(garjus, project, cur_progress, now):
+def make_progress(garjus, project, cur_progress, now, bundles=None):
     with tempfile.TemporaryDirectory() as outdir:
         fnow = now.strftime("%Y-%m-%d_%H_%M_%S")
         pdf_file = f'{outdir}/{project}_report_{fnow}.pdf'
         zip_file = f'{outdir}/{project}_data_{fnow}.zip'
 
-        make_project_report(garjus, project, pdf_file, zip_file, monthly=True)
+        # Report and zip share one load of the project data
+        make_project_report(
+            garjus, project, pdf_file, zip_file, monthly=True, bundles=bundles)
         garjus.add_progress(project, cur_progress, now, pdf_file, zip_file)
 
 
-def make_export_zip(garjus, filename, projects, proctypes, sesstypes, sessions):
+def make_export_zip(
+    garjus,
+    filename,
+    projects,
+    proctypes,
+    sesstypes,
+    sessions,
+    bundles=None
+):
     stats = pd.DataFrame()
     subjects = pd.DataFrame()
 
@@ -84,11 +99,13 @@ def make_export_zip(garjus, filename, projects, proctypes, sesstypes, sessions):
         sessions = sessions.split(',')
 
     for p in sorted(projects):
+        data = get_bundle(garjus, p, bundles)
+
         # Load project subjects
-        psubjects = garjus.subjects(p).reset_index()
+        psubjects = data.subjects().reset_index()
 
         # Load project stats
-        pstats = garjus.stats(p, proctypes=proctypes, sesstypes=sesstypes)
+        pstats = data.stats(proctypes=proctypes, sesstypes=sesstypes)
 
         # Check for empty
         if len(pstats) == 0:
@@ -99,6 +116,9 @@ def make_export_zip(garjus, filename, projects, proctypes, sesstypes, sessions):
         subjects = pd.concat([subjects, psubjects])
         stats = pd.concat([stats, pstats])
 
+    # Unobserved categories would be counted as missing types
+    stats = from_categories(stats)
+
     # Filter duplicate GUID to handle same subject in multiple projects
     subjects = subjects[(subjects['GUID'] == '') | (subjects['GUID'].isna()) | ~subjects.duplicated(subset='GUID')]
 
@@ -161,7 +181,9 @@ def make_statshot(
     garjus,
     projects,
     proctypes,
-    sesstypes):
+    sesstypes,
+    bundles=None
+):
     """Export stats and upload results as a new analysis."""
     stats = pd.DataFrame()
     subj = pd.DataFrame()
@@ -173,11 +195,13 @@ def make_statshot(
         sesstypes = sesstypes.split(',')
 
     for p in sorted(projects):
+        data = get_bundle(garjus, p, bundles)
+
         # Load project subjects
-        psubjects = garjus.subjects(p).reset_index()
+        psubjects = data.subjects().reset_index()
 
         # Load project stats
-        pstats = garjus.stats(p, proctypes=proctypes, sesstypes=sesstypes)
+        pstats = data.stats(proctypes=proctypes, sesstypes=sesstypes)
 
         # Check for empty
         if len(pstats) == 0:
@@ -188,6 +212,9 @@ def make_statshot(
         subj = pd.concat([subj, psubjects])
         stats = pd.concat([stats, pstats])
 
+    # Unobserved categories would be counted as missing types
+    stats = from_categories(stats)
+
     # Pivot table to count occurrences of each type for each subject
     dfp = stats.pivot_table(index='SUBJECT', columns='PROCTYPE', aggfunc='size', fill_value=0)
     valid_subjects = dfp[(dfp > 0).all(axis=1)].index
@@ -254,7 +281,8 @@ def make_stats_csv(
     csvname,
     persubject=False,
     analysis=None,
-    sessions=None
+    sessions=None,
+    bundles=None
 ):
     """"Make the file."""
     df = pd.DataFrame()
@@ -273,10 +301,12 @@ def make_stats_csv(
 
     for p in sorted(projects):
         # Load stats
-        stats = garjus.stats(
-            p, proctypes=proctypes, sesstypes=sesstypes, persubject=persubject)
+        stats = get_bundle(garjus, p, bundles).stats(
+            proctypes=proctypes, sesstypes=sesstypes, persubject=persubject)
         df = pd.concat([df, stats])
 
+    df = from_categories(df)
+
     if analysis:
         # Get the list of subjects for specified analysis and apply as filter
         logger.info(f'{analysis=}')
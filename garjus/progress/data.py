@@ -0,0 +1,141 @@
+"""Project data shared by report and export builders."""
+import logging
+import time
+
+import pandas as pd
+
+
+logger = logging.getLogger('garjus.progress.data')
+
+
+class ProjectData:
+    """Data of a project, each part is loaded on first use then reused.
+
+    Returned frames are copies so builders can modify them. If not shared,
+    stats are loaded for the requested types only and not kept.
+    """
+
+    def __init__(self, garjus, project, shared=True):
+        self._garjus = garjus
+        self.project = project
+        self._shared = shared
+        self._data = {}
+
+    def _get(self, name, loader):
+        if name not in self._data:
+            start = time.time()
+            self._data[name] = loader()
+            secs = time.time() - start
+            logger.debug(f'loaded:{self.project}:{name}:{secs:.1f} secs')
+
+        return self._data[name]
+
+    def _copy(self, name, loader):
+        df = self._get(name, loader)
+        return df.copy() if df is not None else None
+
+    def proctypes(self):
+        return self._get(
+            'proctypes', lambda: self._garjus.proctypes(self.project))
+
+    def scantypes(self):
+        return self._get(
+            'scantypes', lambda: self._garjus.scantypes(self.project))
+
+    def stattypes(self):
+        return self._get(
+            'stattypes', lambda: self._garjus.stattypes(self.project))
+
+    def activity(self):
+        return self._copy(
+            'activity', lambda: self._garjus.activity(self.project))
+
+    def issues(self):
+        return self._copy(
+            'issues', lambda: self._garjus.issues(self.project))
+
+    def analyses(self):
+        return self._copy(
+            'analyses',
+            lambda: self._garjus.analyses([self.project], download=False))
+
+    def phantoms(self):
+        return self._copy(
+            'phantoms', lambda: self._garjus.phantoms(self.project))
+
+    def subjects(self):
+        return self._copy(
+            'subjects', lambda: self._garjus.subjects(self.project))
+
+    def scans(self):
+        """Scans of the scan types of project."""
+        return self._copy('scans', lambda: self._garjus.scans(
+            projects=[self.project], scantypes=self.scantypes()))
+
+    def _assessors(self):
+        return self._get('assessors', lambda: self._garjus.assessors(
+            projects=[self.project]))
+
+    def assessors(self, proctypes=None):
+        """Assessors of project, all types unless proctypes given."""
+        df = self._assessors().copy()
+
+        if proctypes is not None:
+            df = df[df.PROCTYPE.isin(proctypes)]
+
+        return df
+
+    def stats(self, proctypes=None, sesstypes=None, persubject=False):
+        """Stats of project, filtered by proctypes and sesstypes."""
+        if persubject:
+            # Pivots are not kept, assessors are still reused
+            return self._garjus.stats(
+                self.project,
+                assessors=self._assessors(),
+                proctypes=proctypes,
+                sesstypes=sesstypes,
+                persubject=True)
+
+        if not self._shared:
+            return self._garjus.stats(
+                self.project,
+                assessors=self._assessors(),
+                proctypes=proctypes,
+                sesstypes=sesstypes)
+
+        df = self._get('stats', lambda: self._garjus.stats(
+            self.project, assessors=self._assessors()))
+
+        if df is None:
+            return None
+
+        if proctypes:
+            df = df[df.PROCTYPE.isin(proctypes)]
+
+        if sesstypes:
+            df = df[df.SESSTYPE.isin(sesstypes)]
+
+        # Drop columns of stats from other types
+        df = df.dropna(axis=1, how='all').copy()
+
+        for c in df.select_dtypes('category').columns:
+            df[c] = df[c].cat.remove_unused_categories()
+
+        return df
+
+
+def from_categories(df):
+    """Convert category columns back to objects for pivots and exports."""
+    cols = [x for x in df.columns if isinstance(df[x].dtype, pd.CategoricalDtype)]
+    return df.astype({x: object for x in cols})
+
+
+def get_bundle(garjus, project, bundles=None):
+    """Return data of project from bundles, adding it if missing."""
+    if bundles is None:
+        return ProjectData(garjus, project, shared=False)
+
+    if project not in bundles:
+        bundles[project] = ProjectData(garjus, project)
+
+    return bundles[project]
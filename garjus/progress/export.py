@@ -4,7 +4,6 @@ import io
 from datetime import datetime
 import math
 
-import numpy as np
 import pandas as pd
 import plotly
 import plotly.graph_objs as go
@@ -426,11 +425,8 @@ def _add_stats(pdf, stats, plot_title=None):
 
 
 def _plottable(var):
-    try:
-        _ = var.replace('', np.nan).dropna().str.strip('%').astype(float)
-        return True
-    except Exception:
-        return False
+    # Stats are parsed to numeric columns when loaded
+    return pd.api.types.is_numeric_dtype(var)
 
 
 def plot_stats(df, plot_title=None):
@@ -505,7 +501,7 @@ def plot_stats(df, plot_title=None):
 
         fig.append_trace(
             go.Box(
-                y=df[var].replace('', np.nan).dropna().str.strip('%').astype(float),
+                y=df[var].dropna(),
                 x=df['SITE'],
                 boxpoints='all',
                 text=df['ASSR'],
@@ -515,7 +511,7 @@ def plot_stats(df, plot_title=None):
             _col)
 
         # Plot horizontal line at median
-        _median = df[var].replace('', np.nan).dropna().str.strip('%').astype(float).median()
+        _median = df[var].median()
         fig.add_trace(
             go.Scatter(
                 x=df['SITE'],
@@ -622,7 +618,7 @@ def make_export_report(filename, garjus, subjects, stats):
         'NewhouseMDDHx': 'MDDHx'
     }
     subjects['PROJECT'] = subjects.PROJECT.replace(p2p)
-    stats['PROJECT'] = stats.PROJECT.replace(p2p)
+    stats['PROJECT'] = stats.PROJECT.astype(object).replace(p2p)
     subjects['SEX'] = subjects.SEX.fillna('')
 
     info['xnat'] = garjus.xnat_host()
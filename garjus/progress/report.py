@@ -8,11 +8,17 @@ import itertools
 from datetime import datetime, date, timedelta
 import tempfile
 import math
+import time
+import hashlib
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import numpy as np
 import pydot
 import pandas as pd
 import plotly
+import plotly.io
 import plotly.graph_objs as go
 import plotly.subplots
 import plotly.express as px
@@ -20,10 +26,22 @@ from fpdf import FPDF
 from fpdf.enums import XPos, YPos
 from PIL import Image
 
+from .data import get_bundle, from_categories
+
 
 logger = logging.getLogger('garjus.progress.report')
 
 
+# Rendered figures are saved here by hash of the figure
+FIGURE_CACHE = os.path.expanduser('~/.garjus/FIGURES')
+
+# Cached figures not used for this many days are removed
+FIGURE_CACHE_DAYS = 60
+
+# Number of processes rendering figures
+RENDER_WORKERS = 4
+
+
 # These are used to set colors of graphs
 RGB_DKBLUE = 'rgb(59,89,152)'
 RGB_BLUE = 'rgb(66,133,244)'
@@ -422,8 +440,130 @@ def _draw_scan_counts(pdf, scans, groupby='site'):
     return pdf
 
 
+def _figure_path(fig_json):
+    # Same figure with same plotly makes the same png
+    key = hashlib.sha256(
+        f'{plotly.__version__}:{fig_json}'.encode()).hexdigest()
+
+    return os.path.join(FIGURE_CACHE, f'{key}.png')
+
+
+def _render_png(fig_json):
+    # Runs in worker processes so figure is passed as json
+    return plotly.io.from_json(fig_json).to_image(format='png')
+
+
+def _save_png(filename, png):
+    try:
+        os.makedirs(FIGURE_CACHE, exist_ok=True)
+
+        # Write to temp then move so readers never see partial file
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(png)
+
+        os.replace(tmpname, filename)
+    except OSError as err:
+        logger.debug(f'failed to cache figure:{err}')
+
+
+def fig2image(fig):
+    """Return figure as PIL Image, reusing cached png of same figure."""
+    fig_json = fig.to_json()
+    filename = _figure_path(fig_json)
+
+    try:
+        with open(filename, 'rb') as f:
+            _png = f.read()
+
+        # Mark as used so it is kept in cache
+        os.utime(filename)
+    except OSError:
+        _png = _render_png(fig_json)
+        _save_png(filename, _png)
+
+    return Image.open(io.BytesIO(_png))
+
+
+def render_figures(figs, workers=RENDER_WORKERS):
+    """Render figures not already cached using a pool of processes.
+
+    Reports built in worker threads render serially so parallel reports do
+    not each start a pool.
+    """
+    todo = {}
+    for fig in figs:
+        if fig is None:
+            continue
+
+        fig_json = fig.to_json()
+        filename = _figure_path(fig_json)
+        if not os.path.exists(filename):
+            todo[filename] = fig_json
+
+    logger.debug(f'figures:{len(figs)} cached:{len(figs) - len(todo)}')
+
+    if not todo:
+        return
+
+    start = time.time()
+
+    if threading.current_thread() is not threading.main_thread():
+        for filename, fig_json in todo.items():
+            try:
+                _save_png(filename, _render_png(fig_json))
+            except Exception as err:
+                logger.warning(f'failed to render figure:{err}')
+
+        logger.info(f'rendered:{len(todo)} figures:{time.time() - start:.1f} secs')
+        return
+
+    try:
+        # Spawn so workers do not inherit locks held by other threads
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            futures = {
+                executor.submit(_render_png, j): f for f, j in todo.items()}
+
+            for future in as_completed(futures):
+                try:
+                    _save_png(futures[future], future.result())
+                except Exception as err:
+                    logger.warning(f'failed to render figure:{err}')
+    except Exception as err:
+        # Figures not rendered here are rendered when used
+        logger.warning(f'failed to render figures:{err}')
+
+    logger.info(f'rendered:{len(todo)} figures:{time.time() - start:.1f} secs')
+
+
+def prune_figures(days=FIGURE_CACHE_DAYS):
+    """Remove cached figures not used in days."""
+    if not os.path.isdir(FIGURE_CACHE):
+        return
+
+    cutoff = time.time() - days * 86400
+
+    for f in os.scandir(FIGURE_CACHE):
+        try:
+            if f.stat().st_mtime < cutoff:
+                os.remove(f.path)
+        except OSError as err:
+            logger.debug(f'failed to remove cached figure:{err}')
+
+
 def plot_timeline(df, startdate=None, enddate=None):
     """Plot timeline of data."""
+    fig = _timeline_figure(df, startdate, enddate)
+    if fig is None:
+        return None
+
+    return fig2image(fig)
+
+
+def _timeline_figure(df, startdate=None, enddate=None):
     palette = itertools.cycle(px.colors.qualitative.Plotly)
     type_list = df.SESSTYPE.unique()
     mod_list = df.MODALITY.unique()
@@ -506,14 +646,15 @@ def plot_timeline(df, startdate=None, enddate=None):
     # Set the size
     fig.update_layout(width=900)
 
-    # Export figure to image
-    _png = fig.to_image(format="png")
-    image = Image.open(io.BytesIO(_png))
-    return image
+    return fig
 
 
 def plot_activity(df, pivot_index):
     """Plot activity data."""
+    return fig2image(_activity_figure(df, pivot_index))
+
+
+def _activity_figure(df, pivot_index):
     status2rgb = ASTATUS2COLOR
 
     fig = plotly.subplots.make_subplots(rows=1, cols=1)
@@ -541,10 +682,7 @@ def plot_activity(df, pivot_index):
     # Customize figure
     fig['layout'].update(barmode='stack', showlegend=True, width=900)
 
-    # Export figure to image
-    _png = fig.to_image(format="png")
-    image = Image.open(io.BytesIO(_png))
-    return image
+    return fig
 
 
 def _add_count_pages(pdf, sessions, enable_monthly=False, groupby='site'):
@@ -801,14 +939,14 @@ def _add_wml_page(pdf, info):
 
     fig.append_trace(
         go.Scatter(
-            x=df['wml_volume_x'].astype(float),
-            y=df['samseg_lesions_y'].astype(float) / 1000.0,
+            x=df['wml_volume_x'],
+            y=df['samseg_lesions_y'] / 1000.0,
             mode='markers',
         ), 1, 1)
 
     _max = max(
-        df['wml_volume_x'].astype(float).max(),
-        df['samseg_lesions_y'].astype(float).max() / 1000.0,
+        df['wml_volume_x'].max(),
+        df['samseg_lesions_y'].max() / 1000.0,
     )
     _max = max(_max, 50)
 
@@ -827,7 +965,7 @@ def _add_wml_page(pdf, info):
         yaxis_title="SAMSEG lesions (mL)")
 
     # Draw to figure as image on PDF
-    _image = Image.open(io.BytesIO(fig.to_image(format="png")))
+    _image = fig2image(fig)
     pdf.image(_image, x=0.75, w=7)
 
     return pdf
@@ -941,9 +1079,7 @@ def _add_timeline_page(pdf, info, enable_monthly=False):
     pdf.ln(5)
 
     if enable_monthly:
-        # Get the dates of last month
-        enddate = date.today().replace(day=1) - timedelta(days=1)
-        startdate = date.today().replace(day=1) - timedelta(days=enddate.day)
+        startdate, enddate = _last_month_dates()
 
         # Get the name of last month
         lastmonth = startdate.strftime("%B")
@@ -1112,9 +1248,7 @@ def _add_phantoms(pdf, info, enable_monthly=False):
     pdf.ln(5)
 
     if enable_monthly:
-        # Get the dates of last month
-        enddate = date.today().replace(day=1) - timedelta(days=1)
-        startdate = date.today().replace(day=1) - timedelta(days=enddate.day)
+        startdate, enddate = _last_month_dates()
 
         # Get the name of last month
         lastmonth = startdate.strftime("%B")
@@ -1158,6 +1292,15 @@ def _add_activity_page(pdf, info):
 
 def plot_qa(dfp):
     """Plot QA bars."""
+    fig = _qa_figure(dfp)
+    if fig is None:
+        return None
+
+    return fig2image(fig)
+
+
+def _qa_figure(dfp):
+    dfp = dfp.copy()
     for col in dfp.columns:
         if col in ('SESSION', 'PROJECT', 'DATE', 'MODALITY'):
             # don't mess with these columns
@@ -1242,23 +1385,20 @@ def plot_qa(dfp):
     # Customize figure
     fig['layout'].update(barmode='stack', showlegend=True, width=900)
 
-    # Export figure to image
-    _png = fig.to_image(format="png")
-    image = Image.open(io.BytesIO(_png))
-
-    return image
+    return fig
 
 
 def _plottable(var):
-    try:
-        _ = var.replace('', np.nan).dropna().str.strip('%').astype(float)
-        return True
-    except Exception:
-        return False
+    # Stats are parsed to numeric columns when loaded
+    return pd.api.types.is_numeric_dtype(var)
 
 
 def plot_stats(df, plot_title=None):
     """Plot stats, one boxlplot per var."""
+    return fig2image(_stats_figure(df, plot_title))
+
+
+def _stats_figure(df, plot_title=None):
     box_width = 250
     min_box_count = 4
 
@@ -1267,10 +1407,7 @@ def plot_stats(df, plot_title=None):
     # Check for empty data
     if len(df) == 0:
         logger.debug('empty data, using empty figure')
-        fig = go.Figure()
-        _png = fig.to_image(format="png")
-        image = Image.open(io.BytesIO(_png))
-        return image
+        return go.Figure()
 
     # Filter var list to only include those that have data
     var_list = [x for x in df.columns if not pd.isnull(df[x]).all()]
@@ -1329,7 +1466,7 @@ def plot_stats(df, plot_title=None):
 
         fig.append_trace(
             go.Box(
-                y=df[var].replace('', np.nan).dropna().str.strip('%').astype(float),
+                y=df[var].dropna(),
                 x=df['SITE'],
                 boxpoints='all',
                 text=df['ASSR'],
@@ -1339,7 +1476,7 @@ def plot_stats(df, plot_title=None):
             _col)
 
         # Plot horizontal line at median
-        _median = df[var].replace('', np.nan).dropna().str.strip('%').astype(float).median()
+        _median = df[var].median()
         fig.add_trace(
             go.Scatter(
                 x=df['SITE'],
@@ -1375,19 +1512,29 @@ def plot_stats(df, plot_title=None):
         width=graph_width,
         margin=dict(l=20, r=40, t=40, b=80, pad=0))
 
-    _png = fig.to_image(format="png")
-    image = Image.open(io.BytesIO(_png))
-    return image
+    return fig
+
+
+def _stat_data(info, proctype):
+    # Limit the data to this proctype
+    stats = info['stats']
+    stat_data = stats[stats.PROCTYPE == proctype]
+
+    # use proclib to filter stats variable names
+    proc_info = info['proclib'].get(proctype, {})
+    _subset = proc_info.get('stats_subset', None)
+    if _subset and not stat_data.empty:
+        stat_data = stat_data[_subset + ['SITE', 'ASSR']]
+
+    return stat_data
 
 
 def _add_stats_pages(pdf, info):
     proclib = info['proclib']
-    stats = info['stats']
     stattypes = info['stattypes']
 
     for proctype in stattypes:
-        # Limit the data to this proctype
-        stat_data = stats[stats.PROCTYPE == proctype]
+        stat_data = _stat_data(info, proctype)
 
         if stat_data.empty:
             logger.debug(f'no stats for proctype:{proctype}')
@@ -1398,11 +1545,6 @@ def _add_stats_pages(pdf, info):
         # Get descriptions for this processing type
         proc_info = proclib.get(proctype, {})
 
-        # use proclib to filter stats variable names
-        _subset = proc_info.get('stats_subset', None)
-        if _subset:
-            stat_data = stat_data[_subset + ['SITE', 'ASSR']]
-
         # Now make the page
         pdf.add_page()
         pdf.set_font('helvetica', size=14)
@@ -1432,6 +1574,49 @@ def _add_stats_pages(pdf, info):
             pdf.cell(text=_url, link=_url)
 
 
+def _report_figures(info):
+    # Build the figures of the pages with the same data the pages use
+    figs = []
+    enable_monthly = info['enable_monthly']
+
+    figs.append(_timeline_figure(info['sessions'].copy()))
+    if len(info['phantoms']) > 0:
+        figs.append(_timeline_figure(info['phantoms'].copy()))
+
+    if enable_monthly:
+        startdate, enddate = _last_month_dates()
+        figs.append(_timeline_figure(
+            info['sessions'].copy(), startdate=startdate, enddate=enddate))
+        if len(info['phantoms']) > 0:
+            figs.append(_timeline_figure(
+                info['phantoms'].copy(), startdate=startdate, enddate=enddate))
+
+    if not info['stats'].empty:
+        for proctype in info['stattypes']:
+            stat_data = _stat_data(info, proctype)
+            if not stat_data.empty and proctype != 'fmriqa_v4':
+                figs.append(_stats_figure(stat_data))
+
+    sessions = info['sessions']
+    for curtype in sessions[sessions.MODALITY == 'MR'].SESSTYPE.unique():
+        scandf, assrdf = _qa_data(info, curtype)
+        figs.append(_qa_figure(scandf))
+        figs.append(_qa_figure(assrdf))
+
+    if enable_monthly:
+        for k in ['recentjobs', 'activity', 'issues']:
+            figs.append(_activity_figure(info[k].copy(), 'CATEGORY'))
+
+    return figs
+
+
+@contextmanager
+def _page_timer(name):
+    start = time.time()
+    yield
+    logger.info(f'page:{name}:{time.time() - start:.1f} secs')
+
+
 def make_pdf(info, filename):
     enable_monthly = info['enable_monthly']
     multi_group = info['multi_group']
@@ -1444,28 +1629,37 @@ def make_pdf(info, filename):
     pdf.set_filename(filename)
     pdf.set_project(info['project'], enable_monthly=enable_monthly)
 
+    # Render figures in parallel, pages then load them from cache
+    with _page_timer('figures'):
+        prune_figures()
+        render_figures(_report_figures(info))
+
     # Add first page showing MRIs
     logger.debug('adding first page')
-    _add_count_pages(pdf, info['sessions'], enable_monthly=enable_monthly, groupby='site')
+    with _page_timer('counts'):
+        _add_count_pages(pdf, info['sessions'], enable_monthly=enable_monthly, groupby='site')
 
-    # Show group pages only when multiple groups found
-    if multi_group:
-        _add_count_pages(pdf, info['sessions'], enable_monthly=enable_monthly, groupby='group')
+        # Show group pages only when multiple groups found
+        if multi_group:
+            _add_count_pages(pdf, info['sessions'], enable_monthly=enable_monthly, groupby='group')
 
     # Add per scan counts
     logger.debug('adding per scan count pages')
-    _add_scan_count_pages(pdf, info['scans'], groupby='site')
-    if multi_group:
-        _add_scan_count_pages(pdf, info['scans'], groupby='group')
+    with _page_timer('scan counts'):
+        _add_scan_count_pages(pdf, info['scans'], groupby='site')
+        if multi_group:
+            _add_scan_count_pages(pdf, info['scans'], groupby='group')
 
     # Timeline
     logger.debug('adding timeline page')
-    _add_timeline_page(pdf, info, enable_monthly=enable_monthly)
+    with _page_timer('timeline'):
+        _add_timeline_page(pdf, info, enable_monthly=enable_monthly)
 
     # Phantom pages
     if len(info['phantoms']) > 0:
         logger.debug('adding phantom page')
-        _add_phantoms(pdf, info, enable_monthly=enable_monthly)
+        with _page_timer('phantoms'):
+            _add_phantoms(pdf, info, enable_monthly=enable_monthly)
     else:
         logger.debug('no phantom page')
 
@@ -1474,7 +1668,8 @@ def make_pdf(info, filename):
         logger.debug('without stats')
     else:
         logger.debug('adding stats pages')
-        _add_stats_pages(pdf, info)
+        with _page_timer('stats'):
+            _add_stats_pages(pdf, info)
 
     # Session type pages - counts per scans, counts per assessor
     logger.debug('adding MR qa pages')
@@ -1485,43 +1680,39 @@ def make_pdf(info, filename):
     for curtype in mr_sessions.SESSTYPE.unique():
         logger.debug('add_qa_page:{}'.format(curtype))
 
-        # Get the scan and assr data
-        scandf = info['scanqa'].copy()
-        assrdf = info['assrqa'].copy()
-
-        # Limit to the current session type
-        scandf = scandf[scandf.SESSTYPE == curtype]
-        assrdf = assrdf[assrdf.SESSTYPE == curtype]
-
-        # Drop columns that are all empty
-        scandf = scandf.dropna(axis=1, how='all')
-        assrdf = assrdf.dropna(axis=1, how='all')
-
         # Add the page for this session type
-        _add_qa_page(pdf, scandf, assrdf, curtype)
+        with _page_timer(f'qa {curtype}'):
+            scandf, assrdf = _qa_data(info, curtype)
+            _add_qa_page(pdf, scandf, assrdf, curtype)
 
     # LST vs SAMSEG
-    _add_wml_page(pdf, info)
+    with _page_timer('wml'):
+        _add_wml_page(pdf, info)
 
     # QA/Jobs/Issues counts
     if info['enable_monthly']:
-        _add_activity_page(pdf, info)
+        with _page_timer('activity'):
+            _add_activity_page(pdf, info)
 
     # Directed Graph of processing
     # TODO: only run if graphviz/dot are installed
     # TODO: build the graph dynamically using same logic as dashboard autofilter
     # to find used scan types, then list unused to the side with counts
     # and then do the for proc types based on enabled in processing or not
-    _add_graph_page(pdf, info)
+    with _page_timer('graph'):
+        _add_graph_page(pdf, info)
 
     # Settings
-    _add_settings_page(pdf, info)
+    with _page_timer('settings'):
+        _add_settings_page(pdf, info)
 
     # NDA
-    _add_nda_page(pdf, info)
+    with _page_timer('nda'):
+        _add_nda_page(pdf, info)
 
     # Analyses
-    _add_analyses_page(pdf, info)
+    with _page_timer('analyses'):
+        _add_analyses_page(pdf, info)
 
 
     # Save to file
@@ -1534,6 +1725,22 @@ def make_pdf(info, filename):
     return True
 
 
+def _qa_data(info, sesstype):
+    # Get the scan and assr data
+    scandf = info['scanqa'].copy()
+    assrdf = info['assrqa'].copy()
+
+    # Limit to the current session type
+    scandf = scandf[scandf.SESSTYPE == sesstype]
+    assrdf = assrdf[assrdf.SESSTYPE == sesstype]
+
+    # Drop columns that are all empty
+    scandf = scandf.dropna(axis=1, how='all')
+    assrdf = assrdf.dropna(axis=1, how='all')
+
+    return scandf, assrdf
+
+
 def _scanqa(scans, scantypes=None):
     dfp = _scan_pivot(scans).reset_index()
 
@@ -1673,22 +1880,25 @@ def make_project_report(
     project,
     pdfname,
     zipname=None,
-    monthly=False
+    monthly=False,
+    bundles=None
 ):
     """"Make the project report PDF and zip files"""
+    data = get_bundle(garjus, project, bundles)
+
     proclib = garjus.processing_library()
     statlib = garjus.stats_library()
-    activity = garjus.activity(project)
-    issues = garjus.issues(project)
-    analyses = garjus.analyses([project], download=False)
+    activity = data.activity()
+    issues = data.issues()
+    analyses = data.analyses()
 
     # Load types for this project
-    proctypes = garjus.proctypes(project)
-    scantypes = garjus.scantypes(project)
-    stattypes = garjus.stattypes(project)
+    proctypes = data.proctypes()
+    scantypes = data.scantypes()
+    stattypes = data.stattypes()
 
     # Loads scans/assessors with type filters applied
-    scans = garjus.scans(projects=[project], scantypes=scantypes)
+    scans = data.scans()
     scans.SESSTYPE = scans.SESSTYPE.replace('', 'UNKNOWN')
     scans.SITE = scans.SITE.replace('', 'UNKNOWN')
     scans.MODALITY = scans.MODALITY.replace('', 'UNKNOWN')
@@ -1701,13 +1911,13 @@ def make_project_report(
     scantypes = list(set([x[:15].strip() for x in scantypes if x]))
     scantypes = sorted(scantypes)
 
-    assessors = garjus.assessors(projects=[project], proctypes=proctypes)
+    assessors = data.assessors(proctypes=proctypes)
     assessors.SESSTYPE = assessors.SESSTYPE.replace('', 'UNKNOWN')
     assessors.SITE = assessors.SITE.replace('', 'UNKNOWN')
     assessors.MODALITY = assessors.MODALITY.replace('', 'UNKNOWN')
     assessors.DATE = assessors.DATE.fillna(datetime.now())
 
-    phantoms = garjus.phantoms(project)
+    phantoms = data.phantoms()
     phantoms = phantoms[SESSCOLS].drop_duplicates().sort_values('SESSION')
 
     # Extract sessions from scans/assessors
@@ -1715,7 +1925,7 @@ def make_project_report(
     sessions = sessions.drop_duplicates().sort_values('SESSION')
 
     # Merge in group from subjects
-    subjects = garjus.subjects(project).reset_index()
+    subjects = data.subjects().reset_index()
     sessions = pd.merge(
         sessions,
         subjects[['ID', 'PROJECT', 'GROUP']],
@@ -1743,7 +1953,10 @@ def make_project_report(
         scans['GROUP'] = scans['GROUP'].fillna('UNKNOWN')
 
     # Load stats with extra assessor columns
-    stats = garjus.stats(project, assessors)
+    stats = data.stats(proctypes=proctypes)
+    if not stats.empty:
+        for c in ['SESSTYPE', 'SITE']:
+            stats[c] = stats[c].astype(object).replace('', 'UNKNOWN')
 
     # Make the info dictionary for PDF
     info = {}
@@ -1787,12 +2000,13 @@ def make_project_report(
     # Save the stats to zip file
     if zipname:
         # TODO: include a QA.csv and a subjects.csv with demographics
-        subjects = garjus.subjects(project)
-        data2zip(subjects, stats, zipname)
+        data2zip(data.subjects(), stats, zipname)
 
 
 def data2zip(subjects, stats, filename):
     """Convert stats dict to zip of csv files, one csv per proctype."""
+    stats = from_categories(stats)
+
     with tempfile.TemporaryDirectory() as tmpdir:
         # Prep output dir
         data_dir = os.path.join(tmpdir, 'data')
@@ -1826,6 +2040,14 @@ def data2zip(subjects, stats, filename):
         shutil.copy(zip_file, filename)
 
 
+def _last_month_dates():
+    # Get the dates of last month
+    enddate = date.today().replace(day=1) - timedelta(days=1)
+    startdate = date.today().replace(day=1) - timedelta(days=enddate.day)
+
+    return startdate, enddate
+
+
 def _last_month():
     from dateutil.relativedelta import relativedelta
     return (datetime.today() - relativedelta(months=1)).strftime('%Y-%m-%d')
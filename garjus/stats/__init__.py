@@ -8,6 +8,7 @@ import csv
 import logging
 import glob
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
@@ -16,6 +17,10 @@ import pandas as pd
 logger = logging.getLogger(__name__)
 
 
+# Number of assessor STATS resources to download concurrently
+DOWNLOAD_WORKERS = 8
+
+
 def update(garjus, projects, proctypes=None):
     """Update project."""
     if not garjus.xnat_enabled():
@@ -69,34 +74,53 @@ def update_project(garjus, project, proctypes):
     dfa = dfa[dfa['QCSTATUS'] != 'Failed']
     logger.debug(f'assessors after filtering out QC Failed:{len(dfa)}')
 
-    # Iterate xnat assessors
-    for r in dfa.sort_values('ASSR').to_dict('records'):
-        try:
-            update_assessor(
+    # Download stats in parallel, upload to redcap in batches
+    with garjus.stats_writer(project) as writer:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = [executor.submit(
+                load_assessor,
                 garjus,
                 r['PROJECT'],
                 r['SUBJECT'],
                 r['SESSION'],
                 r['ASSR'],
-            )
-        except ConnectionError as err:
-            logger.info(err)
-            logger.info('waiting a minute')
-            os.sleep(60)
+            ) for r in dfa.sort_values('ASSR').to_dict('records')]
+
+            for f in as_completed(futures):
+                r, _stats = f.result()
+                if _stats is None:
+                    continue
+
+                garjus.set_stats(
+                    r['PROJECT'],
+                    r['SUBJECT'],
+                    r['SESSION'],
+                    r['ASSR'],
+                    _stats,
+                    writer=writer)
 
 
 def update_assessor(garjus, proj, subj, sess, assr):
     """Update assessor stats."""
     logger.debug(f'uploading assessor stats:{assr}')
+    _, _stats = load_assessor(garjus, proj, subj, sess, assr)
+    if _stats is not None:
+        garjus.set_stats(proj, subj, sess, assr, _stats)
+
+
+def load_assessor(garjus, proj, subj, sess, assr):
+    """Download and transform assessor stats, return None on failure."""
+    logger.debug(f'loading assessor stats:{assr}')
+    row = {'PROJECT': proj, 'SUBJECT': subj, 'SESSION': sess, 'ASSR': assr}
+
     with tempfile.TemporaryDirectory() as tmpdir:
         try:
             _dir = garjus.get_source_stats(proj, subj, sess, assr, tmpdir)
         except Exception as err:
             logger.warn(f'could not get stats:{assr}:{err}')
-            return
+            return row, None
 
-        _stats = transform_stats(_dir)
-        garjus.set_stats(proj, subj, sess, assr, _stats)
+        return row, transform_stats(_dir)
 
 
 def transform_stats(stats_dir):
@@ -199,18 +223,20 @@ def _get_bag(garjus, project):
 
     # Calculate age at scan
     stats['SCANDAYS'] = pd.to_datetime(stats['DATE']) - stats['DOB']
-    stats['BAGDAYS'] = (stats['bag_age_pred'].astype(float) * 365.25).astype('timedelta64[D]')
+    stats['BAGDAYS'] = (stats['bag_age_pred'] * 365.25).astype('timedelta64[D]')
     stats['bag_age_gap'] = (stats['BAGDAYS'] - stats['SCANDAYS'])/np.timedelta64(365, 'D')
 
     # Batch upload new stats
-    for i, s in stats.iterrows():
-        logger.debug(f'set bag_age_gap:{s.ASSR}')
-        garjus.set_stats(
-            project,
-            s.SUBJECT,
-            s.SESSION,
-            s.ASSR,
-            {'bag_age_gap': s.bag_age_gap})
+    with garjus.stats_writer(project) as writer:
+        for i, s in stats.iterrows():
+            logger.debug(f'set bag_age_gap:{s.ASSR}')
+            garjus.set_stats(
+                project,
+                s.SUBJECT,
+                s.SESSION,
+                s.ASSR,
+                {'bag_age_gap': s.bag_age_gap},
+                writer=writer)
 
 
 def _get_bag_nodob(garjus, project):
@@ -229,15 +255,17 @@ def _get_bag_nodob(garjus, project):
         # Only rows without existing bag_age_gap
         stats = stats[stats.bag_age_gap.isna()]
 
-    stats['bag_age_gap'] = (stats['bag_age_pred'].astype(float) - stats['AGE'].astype(float))
+    stats['bag_age_gap'] = (stats['bag_age_pred'] - stats['AGE'].astype(float))
 
     # Batch upload new stats
-    for i, s in stats.iterrows():
-        logger.debug(f'set bag_age_gap:{s.ASSR}')
-        garjus.set_stats(
-            project,
-            s.SUBJECT,
-            s.SESSION,
-            s.ASSR,
-            {'bag_age_gap': s.bag_age_gap})
+    with garjus.stats_writer(project) as writer:
+        for i, s in stats.iterrows():
+            logger.debug(f'set bag_age_gap:{s.ASSR}')
+            garjus.set_stats(
+                project,
+                s.SUBJECT,
+                s.SESSION,
+                s.ASSR,
+                {'bag_age_gap': s.bag_age_gap},
+                writer=writer)
 
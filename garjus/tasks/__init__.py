@@ -1,12 +1,20 @@
 """Tasks."""
 import logging
+import time
 
-from .processors import build_processor
+import pandas as pd
+
+from .processors import load_from_yaml, plan_processor, apply_plan
+from .index import ProjectIndex
 
 
 logger = logging.getLogger('garjus.tasks')
 
 
+PLAN_COLUMNS = [
+    'ACTION', 'PROJECT', 'SUBJECT', 'SESSION', 'PROCTYPE', 'ASSR', 'INPUTS']
+
+
 def update(garjus, projects=None, types=None):
     """Update tasks."""
     if not garjus.xnat_enabled():
@@ -19,17 +27,38 @@ def update(garjus, projects=None, types=None):
             _update_project(garjus, p, types=types)
 
 
+def plan(garjus, projects=None, types=None):
+    """Return dataframe of assessors to create and tasks to build.
+
+    Nothing is changed on XNAT or in the queue.
+    """
+    data = []
+
+    if not garjus.xnat_enabled():
+        logger.debug('no xnat, cannot plan tasks')
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+
+    for p in (projects or garjus.projects()):
+        logger.debug(f'planning tasks:{p}')
+        (_, project_plan) = _plan_project(garjus, p, types=types)
+        data.extend([{k: x[k] for k in PLAN_COLUMNS} for x in project_plan])
+
+    return pd.DataFrame(data, columns=PLAN_COLUMNS)
+
+
 def _update_project(garjus, project, types=None):
-    # Get protocol data, download yaml files as needed
-    protocols = garjus.processing_protocols(project, download=True)
+    (project_data, project_plan) = _plan_project(garjus, project, types=types)
 
-    if len(protocols) == 0:
-        logger.info(f'no processing protocols for project:{project}')
+    if not project_plan:
         return
 
-    if types:
-        protocols = protocols[protocols.TYPE.isin(types)]
+    # Apply the whole plan in one pass
+    start = time.time()
+    apply_plan(garjus, project_plan, project_data)
+    logger.info(f'applied plan:{project}:{time.time() - start:.1f} secs')
 
+
+def _load_project_data(garjus, project):
     # Get scan/assr/sgp data
     assessors = garjus.assessors(projects=[project])
     scans = garjus.scans(projects=[project])
@@ -41,6 +70,31 @@ def _update_project(garjus, project, types=None):
     project_data['assessors'] = assessors
     project_data['sgp'] = sgp
 
+    # Index the data once for all processors
+    project_data['index'] = ProjectIndex(scans, assessors, sgp)
+
+    # Resource file listings, shared by all processors in this build
+    project_data['resource_files'] = {}
+
+    return project_data
+
+
+def _plan_project(garjus, project, types=None):
+    project_plan = []
+    start = time.time()
+
+    # Get protocol data, download yaml files as needed
+    protocols = garjus.processing_protocols(project, download=True)
+
+    if len(protocols) == 0:
+        logger.info(f'no processing protocols for project:{project}')
+        return (None, project_plan)
+
+    if types:
+        protocols = protocols[protocols.TYPE.isin(types)]
+
+    project_data = _load_project_data(garjus, project)
+
     # Iterate processing protocols
     for i, row in protocols.iterrows():
         filepath = row['FILE']
@@ -68,9 +122,23 @@ def _update_project(garjus, project, types=None):
         else:
             include_filters = []
 
-        build_processor(
-            garjus,
+        # Load the processor
+        processor = load_from_yaml(
+            garjus.xnat(),
             filepath,
-            user_inputs,
-            project_data,
-            include_filters)
+            user_inputs=user_inputs)
+
+        if not processor:
+            logger.error(f'loading processor:{filepath}')
+            continue
+
+        project_plan.extend(
+            plan_processor(processor, project_data, include_filters))
+
+    num_create = len([x for x in project_plan if x['ACTION'] == 'create'])
+    num_build = len(project_plan) - num_create
+    logger.info(
+        f'plan:{project}:{num_create} to create:{num_build} to build:'
+        f'{time.time() - start:.1f} secs')
+
+    return (project_data, project_plan)
@@ -3,7 +3,10 @@ import subprocess
 from io import StringIO
 import logging
 import os
+import json
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
@@ -27,6 +30,12 @@ JOB_TAB_COLS = [
     'LABEL', 'PROJECT', 'STATUS', 'PROCTYPE', 'USER',
     'JOBID', 'TIME', 'WALLTIME', 'LASTMOD']
 
+DISKQ_ATTRS = [
+    'procstatus', 'jobid', 'jobnode', 'jobstartdate', 'memused', 'walltimeused']
+
+# Number of threads to stat/read files in DISKQ
+DISKQ_WORKERS = 16
+
 SQUEUE_COLS = [
     'NAME', 'ST', 'STATE', 'PRIORITY', 'JOBID', 'MIN_MEMORY',
     'TIME', 'SUBMIT_TIME', 'START_TIME', 'TIME_LIMIT', 'TIME_LEFT', 'USER']
@@ -49,9 +58,9 @@ STATUS_MAP = {
     'READY_TO_UPLOADNONE': 'COMPLETE'}
 
 
-def _load_dax_queue():
+def _load_dax_queue(index_file=None):
     logger.debug('loading diskq')
-    diskq_df = _load_diskq_queue()
+    diskq_df = _load_diskq_queue(index_file=index_file)
 
     logger.debug('loading squeue')
     squeue_df = _load_slurm_queue()
@@ -96,19 +105,48 @@ def _load_dax_queue():
     return df
 
 
-# Loads the dax queue from disk
-def _load_diskq_queue(status=None):
+# Loads the dax queue from disk, only reading tasks with files modified since
+# the index was saved
+def _load_diskq_queue(status=None, index_file=None):
     task_list = list()
     diskq_dir = os.path.join(RESDIR, 'DISKQ')
     batch_dir = os.path.join(diskq_dir, 'BATCH')
+    start = time.time()
+
+    index = _read_diskq_index(index_file)
+
+    assrs = [os.path.splitext(t)[0] for t in os.listdir(batch_dir)]
+
+    with ThreadPoolExecutor(max_workers=DISKQ_WORKERS) as executor:
+        # Get current modified times of all task files
+        mtimes = dict(zip(assrs, executor.map(
+            lambda x: _get_diskq_mtimes(diskq_dir, x), assrs)))
 
-    for t in os.listdir(batch_dir):
-        assr = os.path.splitext(t)[0]
-        logger.debug(f'load task:{assr}')
-        task = _load_diskq_task(diskq_dir, assr)
+        # Read tasks that are new or changed
+        changed = [x for x in assrs if x not in index or index[x]['mtimes'] != mtimes[x]]
+        tasks = dict(zip(changed, executor.map(
+            lambda x: _load_diskq_task(diskq_dir, x), changed)))
+
+    now = datetime.now()
+    new_index = {}
+    for assr in assrs:
+        if assr in tasks:
+            new_index[assr] = {'mtimes': mtimes[assr], 'task': tasks[assr]}
+        else:
+            new_index[assr] = index[assr]
+
+        task = dict(new_index[assr]['task'])
+        task['LASTMOD'] = _mtimes_lastmod(mtimes[assr], now)
         task['USER'] = USER
         task_list.append(task)
 
+    if index_file:
+        _write_diskq_index(index_file, new_index)
+
+    logger.info(
+        f'loaded diskq:{len(assrs)} tasks:{len(changed)} read:'
+        f'{time.time() - start:.1f} secs')
+
     if len(task_list) > 0:
         df = pd.DataFrame(task_list)
     else:
@@ -129,8 +167,59 @@ def _load_diskq_task(diskq, assr):
         'jobstartdate': _get_diskq_attr(diskq, assr, 'jobstartdate'),
         'memused': _get_diskq_attr(diskq, assr, 'memused'),
         'walltimeused': _get_diskq_attr(diskq, assr, 'walltimeused'),
-        'WALLTIME': _get_diskq_walltime(diskq, assr),
-        'LASTMOD': _get_diskq_lastmod(diskq, assr)}
+        'WALLTIME': _get_diskq_walltime(diskq, assr)}
+
+
+def _get_diskq_mtimes(diskq, assr):
+    # Modified time and size of batch file and each attribute file
+    mtimes = []
+    paths = [os.path.join(diskq, 'BATCH', assr + '.slurm')]
+    paths += [os.path.join(diskq, x, assr) for x in DISKQ_ATTRS]
+
+    for p in paths:
+        try:
+            st = os.stat(p)
+            mtimes.append([st.st_mtime, st.st_size])
+        except OSError:
+            mtimes.append(None)
+
+    return mtimes
+
+
+def _mtimes_lastmod(mtimes, now):
+    # Time since last modified of the procstatus or batch file
+    (batch, procstatus) = mtimes[0], mtimes[1]
+
+    if procstatus:
+        return now - datetime.fromtimestamp(procstatus[0])
+    elif batch:
+        return now - datetime.fromtimestamp(batch[0])
+    else:
+        return None
+
+
+def _read_diskq_index(index_file):
+    if not index_file or not os.path.exists(index_file):
+        return {}
+
+    try:
+        with open(index_file, 'r') as f:
+            return json.load(f)
+    except (ValueError, OSError) as err:
+        logger.info(f'ignoring diskq index:{index_file}:{err}')
+        return {}
+
+
+def _write_diskq_index(index_file, index):
+    # Write to temp file and rename so the index is never partial
+    tmp_file = f'{index_file}.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(tmp_file, index_file)
+    except OSError as err:
+        logger.info(f'could not save diskq index:{index_file}:{err}')
 
 
 # Load slurm data
@@ -168,20 +257,6 @@ def _get_diskq_walltime(diskq, assr):
     return walltime
 
 
-def _get_diskq_lastmod(diskq, assr):
-
-    if os.path.exists(os.path.join(diskq, 'procstatus', assr)):
-        apath = os.path.join(diskq, 'procstatus', assr)
-    elif os.path.exists(os.path.join(diskq, 'BATCH', assr + '.slurm')):
-        apath = os.path.join(diskq, 'BATCH', assr + '.slurm')
-    else:
-        return None
-
-    updatetime = datetime.fromtimestamp(os.path.getmtime(apath))
-    delta = datetime.now() - updatetime
-    return delta
-
-
 def _get_diskq_attr(diskq, assr, attr):
     apath = os.path.join(diskq, attr, assr)
 
@@ -197,29 +272,33 @@ def _get_diskq_attr(diskq, assr, attr):
 
 def _get_changes(garjus_queue, dax_queue):
     # Make list of (ID,PROJECT,STATUS) where status doesn't match
-    df = pd.merge(garjus_queue, dax_queue, left_on='ASSESSOR', right_on='LABEL')
-    df = df[df.STATUS_x != df.STATUS_y]
-    df = df[['ID', 'PROJECT_x', 'STATUS_y']]
-    df = df.rename(columns={'PROJECT_x': 'PROJECT', 'STATUS_y': 'STATUS'})
+    label2status = dax_queue.drop_duplicates('LABEL').set_index('LABEL').STATUS
+
+    df = garjus_queue[['ID', 'PROJECT', 'ASSESSOR', 'STATUS']].copy()
+    df['NEWSTATUS'] = df.ASSESSOR.map(label2status)
+    df = df[df.NEWSTATUS.notna() & (df.STATUS != df.NEWSTATUS)]
+
+    # Use column names expected by garjus
+    df = df[['ID', 'PROJECT', 'NEWSTATUS']].rename(columns={'NEWSTATUS': 'STATUS'})
 
     return df
 
 
 def _get_xnat_changes(garjus_queue, assessors):
     # Make list of (ID,PROJECT,STATUS) where status doesn't match
-    df = pd.merge(garjus_queue, assessors, left_on='ASSESSOR', right_on='ASSR')
+    assr2status = assessors.drop_duplicates('ASSR').set_index('ASSR').PROCSTATUS
 
-    # Only where status mismatch
-    df = df[df.STATUS != df.PROCSTATUS]
+    df = garjus_queue[['ID', 'PROJECT', 'ASSESSOR', 'STATUS']].copy()
+    df['PROCSTATUS'] = df.ASSESSOR.map(assr2status)
 
-    # Subset of columns we need
-    df = df[['ID', 'PROJECT_x', 'PROCSTATUS']]
+    # Only where status mismatch
+    df = df[df.PROCSTATUS.notna() & (df.STATUS != df.PROCSTATUS)]
 
     # Don't revert to JOB_RUNNING
     df = df[df.PROCSTATUS != 'JOB_RUNNING']
 
     # Use column names expected by garjus
-    df = df.rename(columns={'PROJECT_x': 'PROJECT', 'PROCSTATUS': 'STATUS'})
+    df = df[['ID', 'PROJECT', 'PROCSTATUS']].rename(columns={'PROCSTATUS': 'STATUS'})
 
     return df
 
@@ -233,11 +312,14 @@ def dax2queue(garjus):
     if not os.path.isdir(resdir):
         raise FileNotFoundError(f'upload directory not found:{resdir}')
 
+    start = time.time()
+
     # Get the garjus queue as stored in redcap
     gqueue = garjus.tasks()
 
     # Get the dax queue on disk
-    dqueue = _load_dax_queue()
+    dqueue = _load_dax_queue(
+        index_file=os.path.join(garjus.cachedir(), 'diskq_index.json'))
 
     # Filter projects to only those garjus knows
     dqueue = dqueue[dqueue.PROJECT.isin(garjus.projects())]
@@ -245,16 +327,21 @@ def dax2queue(garjus):
     # Get the changes to apply
     df1 = _get_changes(gqueue, dqueue)
 
-    # Get updates from XNAT (if no longer in dax queue), complete or failed
-    df2 = _get_xnat_changes(gqueue, garjus.assessors())
-    df3 = _get_xnat_changes(gqueue, garjus.subject_assessors())
+    # Get updates from XNAT (if no longer in dax queue), complete or failed,
+    # querying only the assessors of open tasks
+    assessors = garjus.assessor_statuses(list(gqueue.ASSESSOR.unique()))
+    df2 = _get_xnat_changes(gqueue, assessors)
 
-    # Combine dataframes
-    df = pd.concat([df1, df2, df3])
+    # Combine dataframes, changes from the dax queue take precedence
+    df = pd.concat([df1, df2])
+    df = df.drop_duplicates(subset=['PROJECT', 'ID'], keep='first')
 
     # Apply changes
     if df.empty:
         logger.info('no changes to apply')
     else:
-        logger.info('applying status changes')
+        logger.info(f'applying status changes:{len(df)}')
         garjus.set_task_statuses(df)
+
+    logger.info(
+        f'dax2queue:{len(gqueue)} open tasks:{time.time() - start:.1f} secs')
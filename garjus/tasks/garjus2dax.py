@@ -3,9 +3,14 @@ import shutil
 import logging
 import os
 import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import pandas as pd
 from dax import cluster
 from .processors import load_from_yaml
+from .dax2garjus import _load_slurm_queue
 
 
 logger = logging.getLogger('garjus2dax')
@@ -36,6 +41,23 @@ HOST = 'https://xnat2.vanderbilt.edu/xnat'
 USER = 'daxspider'
 TEMPLATE = '/data/mcr/centos7/dax_templates/job_template_v3.txt'
 
+# Number of threads to write batch files
+WRITE_WORKERS = 8
+
+# Limits on jobs in flight (in squeue or waiting in DISKQ), tasks over the
+# limits stay QUEUED until a later run, None for no limit. Throttling is
+# opt-in, pass limits to queue2dax to enable it
+MAX_JOBS = None
+MAX_PROJECT_JOBS = None
+MAX_PROCTYPE_JOBS = None
+
+# Order to release queued tasks, any of:
+# oldest (first queued first, by task_procdate), walltime (shortest first)
+PRIORITY = ['oldest']
+PRIORITY_KEYS = ['oldest', 'walltime']
+
+OPEN_STATUSES = ['JOB_RUNNING', 'RUNNING', 'PENDING', 'WAITING']
+
 
 def _write_processor_spec(
     filename,
@@ -69,8 +91,39 @@ def _write_processor_spec(
         f.write('\n')
 
 
+def _check_dirs():
+    # Check for image dir before we give to dax
+    if not os.path.isdir(IMAGEDIR):
+        raise FileNotFoundError(f'singularity images not found:{IMAGEDIR}')
+
+    if not os.path.isdir(RESDIR):
+        raise FileNotFoundError(f'upload directory not found:{RESDIR}')
+
+    if not os.path.isfile(TEMPLATE):
+        raise FileNotFoundError(f'job template not found:{TEMPLATE}')
+
+
+def _load_processor(xnat, yaml_file, user_inputs, processors):
+    # Load the processor once for each yaml content and user inputs, custom
+    # yamls of different tasks can be downloaded to the same filename
+    with open(yaml_file, 'rb') as f:
+        yaml_hash = hashlib.sha256(f.read()).hexdigest()
+
+    key = (yaml_file, yaml_hash, str(user_inputs))
+
+    if key not in processors:
+        processors[key] = load_from_yaml(
+            xnat,
+            yaml_file,
+            user_inputs=user_inputs,
+            singularity_imagedir=IMAGEDIR,
+            job_template=TEMPLATE)
+
+    return processors[key]
+
+
 def _task2dax(
-    xnat,
+    processor,
     assr,
     walltime,
     memreq,
@@ -100,27 +153,9 @@ def _task2dax(
     assr_dir = f'{jobdir}/{assr}'
     dstdir = f'{resdir}/{assr}'
 
-    # Check for image dir before we give to dax
-    if not os.path.isdir(imagedir):
-        raise FileNotFoundError(f'singularity images not found:{imagedir}')
-
-    if not os.path.isdir(resdir):
-        raise FileNotFoundError(f'upload directory not found:{resdir}')
-
-    if not os.path.isfile(job_template):
-        raise FileNotFoundError(f'job template not found:{job_template}')
-
     for i in inputlist:
         i['fpath'] = i['fpath'].replace('xnat.vanderbilt', 'xnat2.vanderbilt')
 
-    # Load the processor
-    processor = load_from_yaml(
-        xnat,
-        yaml_file,
-        user_inputs=user_inputs,
-        singularity_imagedir=imagedir,
-        job_template=job_template)
-
     # Build the command text
     cmds = processor.build_text(
         var2val,
@@ -130,12 +165,12 @@ def _task2dax(
         xnat_host,
         xnat_user)
 
-    print(cmds)
+    logger.debug(cmds)
 
     if 'Multi_Atlas' in cmds:
-        print('removing contain for MultiAtlas')
+        logger.debug('removing contain for MultiAtlas')
         cmds = cmds.replace('--contain --cleanenv', '-e')
-        print(cmds)
+        logger.debug(cmds)
 
     logger.info(f'writing batch file:{batch_file}')
     batch = cluster.PBS(
@@ -169,53 +204,199 @@ def _task2dax(
     shutil.chown(processor_spec_path, group='h_vuiisadmin')
 
 
-def queue2dax(garjus):
+def _walltime_minutes(walltime):
+    # Convert slurm walltime to minutes, formats are M, M:S, H:M:S, D-H,
+    # D-H:M, D-H:M:S
+    try:
+        walltime = str(walltime).strip()
+        if '-' in walltime:
+            (days, walltime) = walltime.split('-', 1)
+            parts = [int(x) for x in walltime.split(':')] + [0, 0]
+            (hours, minutes) = parts[:2]
+        else:
+            days = 0
+            parts = [int(x) for x in walltime.split(':')]
+            if len(parts) == 3:
+                (hours, minutes) = parts[:2]
+            else:
+                (hours, minutes) = (0, parts[0])
+
+        return int(days) * 1440 + hours * 60 + minutes
+    except ValueError:
+        # Unknown goes last
+        return float('inf')
+
+
+def _label_project_proctype(label):
+    # Session assessor labels have 5 parts, subject assessors have 4
+    parts = label.split('-x-')
+    if len(parts) == 5:
+        return (parts[0], parts[3])
+    elif len(parts) == 4:
+        return (parts[0], parts[2])
+    else:
+        return (parts[0], '')
+
+
+def _schedule(
+    tasks,
+    inflight,
+    max_jobs=MAX_JOBS,
+    max_project_jobs=MAX_PROJECT_JOBS,
+    max_proctype_jobs=MAX_PROCTYPE_JOBS,
+    priority=PRIORITY
+):
+    """Return queued tasks to release now, in priority order."""
+    unknown = [x for x in priority if x not in PRIORITY_KEYS]
+    if unknown:
+        raise ValueError(f'unknown priority:{unknown}, use {PRIORITY_KEYS}')
+
+    project_counts = {}
+    proctype_counts = {}
+
+    for label in inflight:
+        (project, proctype) = _label_project_proctype(label)
+        project_counts[project] = project_counts.get(project, 0) + 1
+        proctype_counts[proctype] = proctype_counts.get(proctype, 0) + 1
+
+    total = len(inflight)
+
+    queued = tasks[tasks.STATUS.isin(['JOB_QUEUED', 'QUEUED'])].copy()
+    if queued.empty:
+        return queued
+
+    # Sort by priority, PROCDATE (task_procdate) is when the task was last
+    # queued, tasks queued before it was recorded go first
+    queued['_oldest'] = pd.to_datetime(
+        queued['PROCDATE'], errors='coerce').fillna(pd.Timestamp.min)
+    queued['_walltime'] = queued['WALLTIME'].apply(_walltime_minutes)
+    queued['_id'] = pd.to_numeric(queued['ID'], errors='coerce')
+    sort_cols = [f'_{x}' for x in priority] + ['PROJECT', '_id']
+    queued = queued.sort_values(sort_cols, kind='stable')
+
+    selected = []
+    for i, t in queued.iterrows():
+        if max_jobs is not None and total >= max_jobs:
+            logger.info(f'max jobs in flight:{max_jobs}')
+            break
+
+        (_, proctype) = _label_project_proctype(t['ASSESSOR'])
+        project = t['PROJECT']
+
+        if max_project_jobs is not None and project_counts.get(project, 0) >= max_project_jobs:
+            continue
 
-    # Get the current task table from garjus
-    tasks = garjus.tasks()
+        if max_proctype_jobs is not None and proctype_counts.get(proctype, 0) >= max_proctype_jobs:
+            continue
 
-    # Update each task
-    for i, t in tasks.iterrows():
-        assr = t['ASSESSOR']
-        status = t['STATUS']
+        selected.append(i)
+        total += 1
+        project_counts[project] = project_counts.get(project, 0) + 1
+        proctype_counts[proctype] = proctype_counts.get(proctype, 0) + 1
 
-        if status not in ['JOB_QUEUED', 'QUEUED']:
-            logger.debug(f'skipping:{i}:{assr}:{status}')
-            continue
+    logger.info(f'releasing {len(selected)} of {len(queued)} queued tasks')
 
-        logger.info(f'{i}:{assr}:{status}')
-
-        walltime = t['WALLTIME']
-        memreq = t['MEMREQ']
-        inputlist = json.loads(t['INPUTLIST'], strict=False)
-        var2val = json.loads(t['VAR2VAL'], strict=False)
-        yaml_file = t['YAMLFILE']
-        user_inputs = t['USERINPUTS']
-
-        try:
-            # Locate the yaml file
-            if yaml_file == 'CUSTOM':
-                # Download it locally
-                yaml_file = garjus.save_task_yaml(
-                    t['PROJECT'], t['ID'], f'{RESDIR}/DISKQ/processor')
-                shutil.chown(yaml_file, group='h_vuiisadmin')
-            else:
-                # We already have a local copy so point to it
-                yaml_file = os.path.join(garjus._yamldir, yaml_file)
-
-            _task2dax(
-                garjus.xnat(),
-                assr,
-                walltime,
-                memreq,
-                yaml_file,
-                user_inputs,
-                inputlist,
-                var2val)
-
-            garjus.set_task_status(t['PROJECT'], t['ID'], 'JOB_RUNNING')
-
-        except Exception as err:
-            logger.error(err)
-            import traceback
-            traceback.print_exc()
+    return queued.loc[selected].drop(columns=['_oldest', '_walltime', '_id'])
+
+
+def queue2dax(
+    garjus,
+    max_jobs=MAX_JOBS,
+    max_project_jobs=MAX_PROJECT_JOBS,
+    max_proctype_jobs=MAX_PROCTYPE_JOBS,
+    priority=PRIORITY
+):
+    """Write batch files of queued tasks to DISKQ.
+
+    Tasks are released in priority order. By default all queued tasks are
+    released, set the max limits to hold tasks over them until a later run.
+    """
+    processors = {}
+    futures = {}
+    launched = []
+    start = time.time()
+
+    _check_dirs()
+
+    # Get the current task table from garjus
+    tasks = garjus.tasks()
+
+    # Jobs in slurm or waiting in DISKQ count against limits
+    inflight = set(_load_slurm_queue().LABEL)
+    inflight.update(tasks[tasks.STATUS.isin(OPEN_STATUSES)].ASSESSOR)
+
+    tasks = _schedule(
+        tasks,
+        inflight,
+        max_jobs=max_jobs,
+        max_project_jobs=max_project_jobs,
+        max_proctype_jobs=max_proctype_jobs,
+        priority=priority)
+
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        # Prepare each task and write batch files in parallel
+        for i, t in tasks.iterrows():
+            assr = t['ASSESSOR']
+            status = t['STATUS']
+
+            logger.info(f'{i}:{assr}:{status}')
+
+            walltime = t['WALLTIME']
+            memreq = t['MEMREQ']
+            inputlist = json.loads(t['INPUTLIST'], strict=False)
+            var2val = json.loads(t['VAR2VAL'], strict=False)
+            yaml_file = t['YAMLFILE']
+            user_inputs = t['USERINPUTS']
+
+            try:
+                # Locate the yaml file
+                if yaml_file == 'CUSTOM':
+                    # Download it locally
+                    yaml_file = garjus.save_task_yaml(
+                        t['PROJECT'], t['ID'], f'{RESDIR}/DISKQ/processor')
+                    shutil.chown(yaml_file, group='h_vuiisadmin')
+                else:
+                    # We already have a local copy so point to it
+                    yaml_file = os.path.join(garjus._yamldir, yaml_file)
+
+                processor = _load_processor(
+                    garjus.xnat(), yaml_file, user_inputs, processors)
+
+                f = executor.submit(
+                    _task2dax,
+                    processor,
+                    assr,
+                    walltime,
+                    memreq,
+                    yaml_file,
+                    user_inputs,
+                    inputlist,
+                    var2val)
+
+                futures[f] = t
+            except Exception as err:
+                logger.error(err)
+                import traceback
+                traceback.print_exc()
+
+        for f in as_completed(futures):
+            t = futures[f]
+            try:
+                f.result()
+                launched.append({
+                    'PROJECT': t['PROJECT'],
+                    'ID': t['ID'],
+                    'STATUS': 'JOB_RUNNING'})
+            except Exception as err:
+                logger.error(f'{t["ASSESSOR"]}:{err}')
+                import traceback
+                traceback.print_exception(type(err), err, err.__traceback__)
+
+    # Set status of all written tasks in one call
+    if launched:
+        garjus.set_task_statuses(pd.DataFrame(launched))
+
+    secs = time.time() - start
+    logger.info(
+        f'queue2dax:{len(launched)} tasks written:{len(processors)} processors:'
+        f'{secs:.1f} secs:{len(launched) / max(secs, 0.001):.1f} tasks/sec')
@@ -0,0 +1,155 @@
+"""Indexed project data for building tasks."""
+import logging
+
+
+logger = logging.getLogger('garjus.tasks.index')
+
+
+MR_XSITYPE = 'xnat:mrSessionData'
+PET_XSITYPE = 'xnat:petSessionData'
+
+# Task statuses that are no longer in the queue
+DONE_STATUSES = ['COMPLETE', 'JOB_FAILED', 'DELETED']
+
+
+class ProjectIndex:
+    """Lookups of project scans and assessors by session and subject.
+
+    Built once per project from the scans/assessors/sgp dataframes so that
+    processors can find artefacts without filtering whole dataframes for
+    every session. Records keep the order of rows in the dataframes.
+    """
+
+    def __init__(self, scans, assessors, sgp=None):
+        self.session_scans = {}
+        self.session_subject = {}
+        self.subject_scans = {}
+        self.subject_petscans = {}
+        self.scan_quality = {}
+        self.session_assessors = {}
+        self.subject_assessors = {}
+        self.session_proctype_assessors = {}
+        self.assr_status = {}
+        self.artefact_inputs = {}
+        self.assessor_labels = set()
+        self.subject_proctype_sgp = {}
+        self.first_mr_session = {}
+
+        logger.debug('indexing scans')
+        for s in scans.to_dict('records'):
+            self.session_scans.setdefault(s['SESSION'], []).append(s)
+            self.subject_scans.setdefault(s['SUBJECT'], []).append(s)
+            self.session_subject.setdefault(s['SESSION'], s['SUBJECT'])
+            self.scan_quality.setdefault(
+                (s['SESSION'], s['SCANID']), s['QUALITY'])
+
+            if s['XSITYPE'] == PET_XSITYPE:
+                self.subject_petscans.setdefault(s['SUBJECT'], []).append(s)
+
+        # Find the first MR session of each subject by date
+        mr_scans = scans[scans.XSITYPE == MR_XSITYPE]
+        mr_scans = mr_scans.sort_values('DATE', kind='stable')
+        for s in mr_scans.to_dict('records'):
+            self.first_mr_session.setdefault(s['SUBJECT'], s['SESSION'])
+
+        logger.debug('indexing assessors')
+        for a in assessors.to_dict('records'):
+            self.session_assessors.setdefault(a['SESSION'], []).append(a)
+            self.subject_assessors.setdefault(a['SUBJECT'], []).append(a)
+            self.session_proctype_assessors.setdefault(
+                (a['SESSION'], a['PROCTYPE']), []).append(a)
+            self.assr_status.setdefault(
+                (a['SESSION'], a['ASSR']), (a['PROCSTATUS'], a['QCSTATUS']))
+            self.artefact_inputs[a['full_path']] = a['INPUTS']
+            self.assessor_labels.add(a['ASSR'])
+
+        if sgp is not None:
+            for a in sgp.to_dict('records'):
+                self.subject_proctype_sgp.setdefault(
+                    (a['SUBJECT'], a['PROCTYPE']), []).append(a)
+
+    def is_first_mr_session(self, session):
+        """True unless subject has an earlier MR session than this one."""
+        subject = self.session_subject[session]
+        first = self.first_mr_session.get(subject, None)
+        return first is None or first == session
+
+    def petscans(self, session):
+        """Return PET scans of the subject of this session."""
+        subject = self.session_subject.get(session, '')
+        if not subject:
+            return []
+
+        return self.subject_petscans.get(subject, [])
+
+    def find_assessor(self, session, proctype, inputs):
+        """Return record of existing session assessor with inputs or None."""
+        for a in self.session_proctype_assessors.get((session, proctype), []):
+            if a['INPUTS'] == inputs:
+                return dict(a)
+
+        return None
+
+    def find_sgp(self, subject, proctype, inputs):
+        """Return record of existing subject assessor with inputs or None."""
+        for a in self.subject_proctype_sgp.get((subject, proctype), []):
+            if a['INPUTS'] == inputs:
+                return dict(a)
+
+        return None
+
+
+def get_index(project_data):
+    """Return index of project data, building it on first use."""
+    if project_data.get('index', None) is None:
+        project_data['index'] = ProjectIndex(
+            project_data['scans'],
+            project_data['assessors'],
+            project_data.get('sgp', None))
+
+    return project_data['index']
+
+
+class QueueSnapshot:
+    """Assessor labels of open tasks in the task queue of a project.
+
+    Loaded with one export of the queue per build. The queue of a project
+    is a single REDCap record so it cannot be exported incrementally,
+    tasks we create during the build are added locally instead.
+    """
+
+    def __init__(self, garjus, project):
+        self.assessors = {}
+
+        result = garjus.task_assessors(project)
+        logger.debug(f'loaded queue:{project}:{len(result)}')
+
+        # Done tasks are ignored, their assessors may be gone from XNAT
+        for task_id, (assr, status) in result.items():
+            if status not in DONE_STATUSES:
+                self.assessors.setdefault(assr, task_id)
+
+    def add(self, assr_label):
+        """Add label of a task created in this build."""
+        self.assessors.setdefault(assr_label, None)
+
+    def session_assessors(self, session):
+        """Return labels of queued assessors of session."""
+        return [x for x in self.assessors if _label_session(x) == session]
+
+
+def _label_session(assr_label):
+    # Session is the third part of session assessor labels
+    parts = assr_label.split('-x-')
+    if len(parts) < 5:
+        return None
+
+    return parts[2]
+
+
+def get_queue(garjus, project_data):
+    """Return queue snapshot of project, loaded on first use."""
+    if project_data.get('queue', None) is None:
+        project_data['queue'] = QueueSnapshot(garjus, project_data['name'])
+
+    return project_data['queue']
@@ -7,6 +7,7 @@ import fnmatch
 import re
 import copy
 import itertools
+import functools
 from datetime import date
 from uuid import uuid4
 
@@ -17,25 +18,70 @@ from dax.task import OPEN_STATUS_LIST, RERUN, REPROC, FAILED_NEEDS_REPROC
 from dax.processors_v3 import Processor_v3, get_resource, get_uri
 from dax.errors import AutoProcessorError
 
+from .index import get_index, get_queue
+from .. import utils_xnat
+
 
 logger = logging.getLogger('garjus.processors')
 
 
+# Built tasks are added to the queue in batches of this size, same as the
+# import chunks of Garjus.add_tasks
+TASK_FLUSH = 100
+
+
+@functools.lru_cache(maxsize=None)
+def compile_patterns(expressions):
+    """Compile tuple of fnmatch expressions into a single regex."""
+    return re.compile('|'.join(fnmatch.translate(x) for x in expressions))
+
+
+def get_resource_files(project_data, xnat, artefact, resource):
+    """Return list of files on artefact resource, listed once per build.
+
+    Scan resources are primed with one listing of all scan files in the
+    session the first time any scan of that session is requested.
+    """
+    resource_files = project_data.setdefault('resource_files', {})
+    key = (artefact, resource)
+
+    if key not in resource_files and '/scans/' in artefact:
+        _prime_scan_files(project_data, xnat, artefact.split('/scans/')[0])
+
+    if key not in resource_files:
+        robj = get_resource(xnat, artefact, resource)
+        resource_files[key] = [x._urn for x in robj.files().get('path')]
+
+    return resource_files[key]
+
+
+def _prime_scan_files(project_data, xnat, session_path):
+    primed = project_data.setdefault('primed_sessions', set())
+    if session_path in primed:
+        return
+
+    primed.add(session_path)
+
+    try:
+        scan_files = utils_xnat.get_scan_files(xnat, session_path)
+    except Exception as err:
+        logger.debug(f'failed to list session files:{session_path}:{err}')
+        return
+
+    resource_files = project_data.setdefault('resource_files', {})
+    for (scan_id, resource), files in scan_files.items():
+        resource_files.setdefault(
+            (f'{session_path}/scans/{scan_id}', resource), files)
+
+
 def get_scan_status(project_data, scan_path):
     path_parts = scan_path.split('/')
     sess_label = path_parts[6]
     scan_label = path_parts[8]
 
-    _df = project_data.get('scans')
-    _df = _df[(_df.SESSION == sess_label) & (_df.SCANID == scan_label)]
-
-    # Check for none found
-    if _df.empty:
-        return None
-
-    # Return value from first record
-    scan_quality = _df.iloc[0].QUALITY
-    return scan_quality
+    # Return value from first record, None if not found
+    return get_index(project_data).scan_quality.get(
+        (sess_label, scan_label), None)
 
 
 def get_assr_status(project_data, assr_path):
@@ -43,17 +89,9 @@ def get_assr_status(project_data, assr_path):
     sess_label = path_parts[6]
     assr_label = path_parts[8]
 
-    _df = project_data.get('assessors')
-    _df = _df[(_df.SESSION == sess_label) & (_df.ASSR == assr_label)]
-
-    # Check for none found
-    if _df.empty:
-        return None
-
-    # Return values from first record
-    assr_pstatus = _df.iloc[0].PROCSTATUS
-    assr_qstatus = _df.iloc[0].QCSTATUS
-    return assr_pstatus, assr_qstatus
+    # Return values from first record, None if not found
+    return get_index(project_data).assr_status.get(
+        (sess_label, assr_label), None)
 
 
 def verify_artefact_status(proc_inputs, assr_inputs, project_data):
@@ -96,8 +134,12 @@ def verify_artefact_status(proc_inputs, assr_inputs, project_data):
                         raise NeedInputsException(artk + ': Bad QC')
 
 
-def build_task(garjus, assr, info, processor, project_data):
-    '''Build a task, create assessor in XNAT, add new record to garjus queue'''
+def build_task(garjus, assr, info, processor, project_data, tasks=None):
+    '''Build a task, create assessor in XNAT, add new record to garjus queue
+
+    If tasks is a list, the new task is appended for a later add_tasks()
+    instead of being added to the queue immediately.
+    '''
     old_proc_status = info['PROCSTATUS']
     old_qc_status = info['QCSTATUS']
     assr_label = info['ASSR']
@@ -110,15 +152,32 @@ def build_task(garjus, assr, info, processor, project_data):
 
         # NOTE:this is where dax would write the slurm file, we are delaying
         # that and instead adding to queue in garjus
-        garjus.add_task(
-            project_data['name'],
-            assr_label,
-            inputlist,
-            var2val,
-            processor.walltime_str,
-            processor.memreq_mb,
-            processor.yaml_file,
-            processor.user_inputs)
+        if tasks is not None:
+            tasks.append({
+                'assr': assr_label,
+                'inputlist': inputlist,
+                'var2val': var2val,
+                'walltime': processor.walltime_str,
+                'memreq': processor.memreq_mb,
+                'yamlfile': processor.yaml_file,
+                'userinputs': processor.user_inputs,
+                'restore': {
+                    'assr': assr,
+                    'xsitype': processor.xsitype.lower(),
+                    'procstatus': old_proc_status,
+                    'qcstatus': old_qc_status,
+                },
+            })
+        else:
+            garjus.add_task(
+                project_data['name'],
+                assr_label,
+                inputlist,
+                var2val,
+                processor.walltime_str,
+                processor.memreq_mb,
+                processor.yaml_file,
+                processor.user_inputs)
 
         # Set new statuses to be updated
         new_proc_status = JOB_RUNNING
@@ -163,14 +222,10 @@ class Processor_v3_1(Processor_v3):
 
     def get_assessor(self, session, inputs, project_data):
         proctype = self.get_proctype()
-        dfa = project_data['assessors']
-        dfa = dfa[(dfa.SESSION == session) & (dfa.PROCTYPE == proctype)]
-        dfa = dfa[(dfa.INPUTS == inputs)]
-
-        if len(dfa) > 0:
-            # Get the info for the assessor
-            info = dfa.to_dict('records')[0]
+        index = get_index(project_data)
+        info = index.find_assessor(session, proctype, inputs)
 
+        if info:
             logger.debug('matches existing:{}'.format(info['ASSR']))
 
             # Get the assessor object
@@ -183,8 +238,7 @@ class Processor_v3_1(Processor_v3):
             logger.debug('no existing assessors found, creating a new one')
 
             # Get the subject for this session
-            dfs = project_data['scans']
-            subject = list(dfs[dfs.SESSION == session].SUBJECT.unique())[0]
+            subject = index.session_subject[session]
 
             # Create the assessor
             (assr, info) = self.create_assessor(
@@ -425,13 +479,9 @@ class Processor_v3_1(Processor_v3):
         logger.debug(f'parameter_matrix={parameter_matrix}')
 
         # Apply filters (e.g., removes parameter sets where inputs don't match)
-        artefact_inputs = {}
-        for i, a in project_data['assessors'].iterrows():
-            artefact_inputs[a['full_path']] = a['INPUTS']
-
         parameter_matrix = self._filter_matrix(
             parameter_matrix,
-            artefact_inputs)
+            get_index(project_data).artefact_inputs)
         logger.debug(f'filtered={parameter_matrix}')
 
         return parameter_matrix
@@ -472,13 +522,12 @@ class Processor_v3_1(Processor_v3):
                     cur_res = inp_res
                     break
 
-            # TODO: optimize this to get resource list only once
             for vnum, vinput in enumerate(inputs[v['input']]):
                 fname = None
-                robj = get_resource(assr._intf, vinput, resource)
 
                 # Get list of all files in the resource, relative paths
-                file_list = [x._urn for x in robj.files().get('path')]
+                file_list = get_resource_files(
+                    project_data, assr._intf, vinput, resource)
                 if len(file_list) == 0:
                     logger.debug('empty or missing resource')
                     raise NeedInputsException('No Resource')
@@ -499,7 +548,7 @@ class Processor_v3_1(Processor_v3):
                     fname = os.path.basename(fpath)
                 elif fmatch:
                     # Filter list based on regex matching
-                    regex = re.compile(fnmatch.translate(fmatch))
+                    regex = compile_patterns((fmatch,))
                     file_list = [x for x in file_list if regex.match(x)]
 
                     if len(file_list) == 0:
@@ -602,6 +651,7 @@ class Processor_v3_1(Processor_v3):
 
             self.proc_inputs[name] = {
                 'types': types,
+                'types_regex': compile_patterns(tuple(types)),
                 'artefact_type': 'scan',
                 'needs_qc': needs_qc,
                 'resources': resources,
@@ -656,12 +706,14 @@ class Processor_v3_1(Processor_v3):
 
             self.proc_inputs[name] = {
                 'types': types,
+                'types_regex': compile_patterns(tuple(types)),
                 'artefact_type': 'scan',
                 'needs_qc': p.get('needs_qc', False),
                 'require_usable': p.get('require_usable', False),
                 'resources': resources,
                 'required': True,
                 'tracer': tracer,
+                'tracer_regex': compile_patterns(tuple(tracer)),
                 'skip_unusable': True,
             }
 
@@ -672,34 +724,13 @@ class Processor_v3_1(Processor_v3):
         self._parse_variables()
 
     def _get_petscans(self, session, project_data):
-        petscans = []
-        scans = project_data.get('scans')
-        subject = ''
-
-        for s in scans.to_dict('records'):
-            if s['SESSION'] == session:
-                subject = s['SUBJECT']
-                break
-
-        if subject:
-            petscans = scans[(scans.SUBJECT == subject) & (scans.XSITYPE == 'xnat:petSessionData')].to_dict('records')
-
-        return petscans
+        return get_index(project_data).petscans(session)
 
     def is_first_mr_session(self, session, project_data):
-        is_first = True
-
-        # Get the sessions/dates for this subject
-        _dfs = project_data.get('scans')
-        subject = _dfs[_dfs.SESSION == session].iloc[0]['SUBJECT']
-        logger.debug(f'is_first_mr_session:{session}:{subject}:getting scans')
-        scans = _dfs[(_dfs.SUBJECT == subject) & (_dfs.XSITYPE == 'xnat:mrSessionData')]
-        scans = scans.sort_values('DATE')
-
-        # Check if this is the first
-        if not scans.empty and scans.iloc[0].SESSION != session:
+        # Check if this is the first MR session of the subject
+        is_first = get_index(project_data).is_first_mr_session(session)
+        if not is_first:
             logger.debug(f'is_first_mr_session:{session}:nope')
-            is_first = False
 
         return is_first
 
@@ -709,10 +740,9 @@ class Processor_v3_1(Processor_v3):
 
         # Get lists for scans/assrs for this session
         logger.debug('prepping session data')
-        _dfs = project_data.get('scans')
-        scans = _dfs[_dfs.SESSION == session].to_dict('records')
-        _dfa = project_data.get('assessors')
-        assrs = _dfa[_dfa.SESSION == session].to_dict('records')
+        index = get_index(project_data)
+        scans = index.session_scans.get(session, [])
+        assrs = index.session_assessors.get(session, [])
 
         petscans = []
         # if this is the first mri, add scans
@@ -728,48 +758,31 @@ class Processor_v3_1(Processor_v3):
                 # PET scan
                 for p in petscans:
                     # Match the tracer name
-                    tracer_name = p['TRACER']
-                    tracer_match = False
-                    for expression in iv['tracer']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(tracer_name):
-                            # found a match so exit the loop
-                            tracer_match = True
-                            break
-
-                    if not tracer_match:
+                    if not iv['tracer_regex'].match(p['TRACER']):
                         # None of the expressions matched
                         continue
 
                     # Now try to match the scan type
-                    for expression in iv['types']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(p['SCANTYPE']):
-                            # Found a match, now check quality
-                            if p['QUALITY'] == 'unusable':
-                                logger.debug('excluding unusable scan')
-                            else:
-                                artefacts_by_input[i].append(p['full_path'])
+                    if iv['types_regex'].match(p['SCANTYPE']):
+                        # Found a match, now check quality
+                        if p['QUALITY'] == 'unusable':
+                            logger.debug('excluding unusable scan')
+                        else:
+                            artefacts_by_input[i].append(p['full_path'])
 
             elif iv['artefact_type'] == 'scan':
                 # Input is a scan, so we iterate subject scans
                 # to look for matches
                 for cscan in scans:
-                    # First we try to match the session type of the scan
-                    # match scan type
-                    for expression in iv['types']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(cscan.get('SCANTYPE')):
-                            scanid = cscan.get('SCANID')
-                            logger.debug('match found!')
-                            if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
-                                logger.info(f'Excluding unusable scan:{scanid}')
-                            else:
-                                # Get scan path, scan ID for each matching scan.
-                                # Break if the scan matches so we don't find it again comparing
-                                # vs a different requested type
-                                artefacts_by_input[i].append(cscan['full_path'])
-                                break
+                    # Match scan type with any of the type expressions
+                    if iv['types_regex'].match(cscan.get('SCANTYPE')):
+                        scanid = cscan.get('SCANID')
+                        logger.debug('match found!')
+                        if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
+                            logger.info(f'Excluding unusable scan:{scanid}')
+                        else:
+                            # Get scan path, scan ID for each matching scan
+                            artefacts_by_input[i].append(cscan['full_path'])
 
             elif iv['artefact_type'] == 'assessor':
                 for cassr in assrs:
@@ -897,14 +910,9 @@ class SgpProcessor_v3_1(Processor_v3_1):
 
     def get_assessor(self, subject, inputs, project_data):
         proctype = self.get_proctype()
-        dfa = project_data['sgp']
-        dfa = dfa[(dfa.SUBJECT == subject) & (dfa.PROCTYPE == proctype)]
-        dfa = dfa[(dfa.INPUTS == inputs)]
-
-        if len(dfa) > 0:
-            # Get the info for the assessor
-            info = dfa.to_dict('records')[0]
+        info = get_index(project_data).find_sgp(subject, proctype, inputs)
 
+        if info:
             logger.debug('matches existing:{}'.format(info['ASSR']))
 
             # Get the assessor object
@@ -1212,14 +1220,13 @@ class SgpProcessor_v3_1(Processor_v3_1):
                     cur_res = inp_res
                     break
 
-            # TODO: optimize this to get resource list only once
             for vnum, vinput in enumerate(inputs[v['input']]):
                 # print(vnum, vinput)
                 fname = None
-                robj = get_resource(assr._intf, vinput, resource)
 
                 # Get list of all files in the resource, relative paths
-                file_list = [x._urn for x in robj.files().get('path')]
+                file_list = get_resource_files(
+                    project_data, assr._intf, vinput, resource)
                 if len(file_list) == 0:
                     logger.debug('empty or missing resource')
                     raise NeedInputsException('No Resource')
@@ -1240,7 +1247,7 @@ class SgpProcessor_v3_1(Processor_v3_1):
                     fname = os.path.basename(fpath)
                 elif fmatch:
                     # Filter list based on regex matching
-                    regex = re.compile(fnmatch.translate(fmatch))
+                    regex = compile_patterns((fmatch,))
                     file_list = [x for x in file_list if regex.match(x)]
 
                     if len(file_list) == 0:
@@ -1370,9 +1377,12 @@ class SgpProcessor_v3_1(Processor_v3_1):
 
                 self.proc_inputs[name] = {
                     'tracers': tracers,
+                    'tracers_regex': compile_patterns(tuple(tracers)),
                     'select': select,
                     'sesstypes': sesstypes,
+                    'sesstypes_regex': compile_patterns(tuple(sesstypes)),
                     'types': types,
+                    'types_regex': compile_patterns(tuple(types)),
                     'artefact_type': 'scan',
                     'needs_qc': needs_qc,
                     'require_usable': require_usable,
@@ -1398,6 +1408,7 @@ class SgpProcessor_v3_1(Processor_v3_1):
                 self.proc_inputs[name] = {
                     'select': select,
                     'sesstypes': sesstypes,
+                    'sesstypes_regex': compile_patterns(tuple(sesstypes)),
                     'types': types,
                     'artefact_type': 'assessor',
                     'needs_qc': a.get('needs_qc', False),
@@ -1416,10 +1427,9 @@ class SgpProcessor_v3_1(Processor_v3_1):
         artefacts_by_input = {k: [] for k in inputs}
 
         # Get lists for scans/assrs for this subject
-        scans = project_data.get('scans').to_dict('records')
-        scans = [x for x in scans if x['SUBJECT'] == subject]
-        assrs = project_data.get('assessors').to_dict('records')
-        assrs = [x for x in assrs if x['SUBJECT'] == subject]
+        index = get_index(project_data)
+        scans = index.subject_scans.get(subject, [])
+        assrs = index.subject_assessors.get(subject, [])
 
         # Find list of scans/assessors that match each specified input
         # for i, iv in list(inputs.items()):
@@ -1437,45 +1447,25 @@ class SgpProcessor_v3_1(Processor_v3_1):
 
                     # Check tracers
                     if iv['tracers']:
-                        tracer_match = False
-                        for tracer in iv['tracers']:
-                            regex = re.compile(fnmatch.translate(tracer))
-                            if regex.match(cscan['TRACER']):
-                                logger.debug('tracer match')
-                                tracer_match = True
-
-                        if not tracer_match:
+                        if not iv['tracers_regex'].match(cscan['TRACER']):
                             # Wrong tracer
                             logger.debug(f"wrong tracer:{cscan['TRACER']}")
                             continue
 
                     # Check sesstypes
                     if iv['sesstypes']:
-                        sesstypematch = False
-                        for typeexp in iv['sesstypes']:
-                            regex = re.compile(fnmatch.translate(typeexp))
-                            if regex.match(cscan.get('SESSTYPE')):
-                                sesstypematch = True
-                                logger.debug('session type match')
-                                continue
-
-                        if not sesstypematch:
+                        if not iv['sesstypes_regex'].match(cscan.get('SESSTYPE')):
                             logger.debug('no session type match')
                             continue
 
                     # All matches for session, now match scan type
-                    for expression in iv['types']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(cscan.get('SCANTYPE')):
-                            scanid = cscan.get('ID')
-                            if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
-                                logger.info(f'Excluding unusable scan {scanid}')
-                            else:
-                                # Get scan path, scan ID for each matching scan.
-                                # Break if the scan matches so we don't find it again comparing
-                                # vs a different requested type
-                                artefacts_by_input[i].append(cscan.get('full_path'))
-                                break
+                    if iv['types_regex'].match(cscan.get('SCANTYPE')):
+                        scanid = cscan.get('ID')
+                        if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
+                            logger.info(f'Excluding unusable scan {scanid}')
+                        else:
+                            # Get scan path, scan ID for each matching scan
+                            artefacts_by_input[i].append(cscan.get('full_path'))
 
             elif iv['artefact_type'] == 'assessor':
                 for cassr in assrs:
@@ -1488,16 +1478,7 @@ class SgpProcessor_v3_1(Processor_v3_1):
                     # Then check session types
                     if iv['sesstypes']:
                         sesstype = cassr.get('SESSTYPE')
-                        sess_match = False
-                        for typeexp in iv['sesstypes']:
-                            regex = re.compile(fnmatch.translate(typeexp))
-                            if regex.match(sesstype):
-                                sess_match = True
-                                break
-                            else:
-                                logger.debug(f'wrong type:{typeexp}:{sesstype}')
-
-                        if not sess_match:
+                        if not iv['sesstypes_regex'].match(sesstype):
                             logger.debug(f'no sesstype match:{sesstype}')
                             continue
 
@@ -1616,7 +1597,7 @@ def get_processor_procyamlversion(filepath):
 
 
 def filter_matches(match_input, match_filter):
-    return re.match(fnmatch.translate(match_filter), match_input)
+    return compile_patterns((match_filter,)).match(match_input)
 
 
 def filter_labels(labels, filters):
@@ -1670,114 +1651,102 @@ def load_from_yaml(
     return processor
 
 
-def build_session_processor(garjus, processor, session, project_data):
+def plan_session_processor(processor, session, project_data):
+    """Return planned builds of processor on session, without changes."""
+    plan = []
+
     # Get list of inputs sets (not yet matched with existing)
     inputsets = processor.parse_session(session, project_data)
 
     logger.debug(f'{session}:{processor.name}')
 
     logger.debug(inputsets)
+    proctype = processor.get_proctype()
+    index = get_index(project_data)
+
     for inputs in inputsets:
         if inputs == {}:
             # Blank inputs
-            return
-
-        # check for duplicate build, only just before we create new assessor
-        proctype = processor.get_proctype()
-        df = project_data['assessors']
-        df = df[(df.SESSION == session) & (df.PROCTYPE == proctype)]
-        df = df[(df.INPUTS == inputs)]
-
-        if df.empty:
+            break
 
-            # First let garjus check for new stuff in the queue that we didn't
-            # create for this project
-            garjus.detect_duplicate(project_data)
+        info = index.find_assessor(session, proctype, inputs)
 
-            # Then check on xnat
-            try:
-                # Get list of assessors on session, compare to list in project_data
-                _df = project_data['scans']
-                _df = _df[_df.SESSION == session]
-                project = project_data['name']
-                subject = list(_df.SUBJECT)[0]
-                cur_labels = garjus.session_assessor_labels(project, subject, session)
-                cache_labels = list(project_data['assessors'].ASSR)
-                our_labels = garjus.our_assessors()
-                labels = [x for x in cur_labels if x not in cache_labels and x not in our_labels]
-                if len(labels) > 0:
-                    logger.debug(f'detected duplicate:{labels}')
-                    raise AutoProcessorError('duplicate build detected')
-            except Exception as err:
-                logger.error(f'could not check for duplicates:{err}')
-                import traceback
-                traceback.print_exc()
-                return
+        if info is None:
+            action = 'create'
+        elif info['PROCSTATUS'] in [NEED_TO_RUN, NEED_INPUTS]:
+            action = 'build'
+        else:
+            logger.debug('already built:{}'.format(info['ASSR']))
+            continue
 
-        # Get(create) assessor with given inputs and proc type
-        (assr, info) = processor.get_assessor(session, inputs, project_data)
+        plan.append({
+            'ACTION': action,
+            'PROJECT': project_data['name'],
+            'SUBJECT': index.session_subject[session],
+            'SESSION': session,
+            'PROCTYPE': proctype,
+            'ASSR': info['ASSR'] if info else '',
+            'INPUTS': inputs,
+            'processor': processor,
+        })
 
-        if info['PROCSTATUS'] in [NEED_TO_RUN, NEED_INPUTS]:
-            garjus.add_our_assessor(info['ASSR'])
+    return plan
 
-            logger.debug('building task')
-            (assr, info) = build_task(
-                garjus, assr, info, processor, project_data)
-
-            logger.debug(f'{info}')
-            logger.debug('status:{}:{}'.format(info['ASSR'], info['PROCSTATUS']))
-        else:
-            logger.debug('already built:{}'.format(info['ASSR']))
 
+def plan_subject_processor(processor, subject, project_data):
+    """Return planned builds of processor on subject, without changes."""
+    plan = []
 
-def build_subject_processor(garjus, processor, subject, project_data):
     logger.debug(f'{subject}:{processor.name}')
     # Get list of inputs sets (not yet matched with existing)
     inputsets = processor.parse_subject(subject, project_data)
     logger.debug(inputsets)
+    proctype = processor.get_proctype()
+    index = get_index(project_data)
 
     for inputs in inputsets:
 
         if inputs == {}:
             # Blank inputs
-            return
-
-        # Get(create) assessor with given inputs and proc type
+            break
 
-        (assr, info) = processor.get_assessor(subject, inputs, project_data)
+        info = index.find_sgp(subject, proctype, inputs)
 
-        if info['PROCSTATUS'] in [NEED_TO_RUN, NEED_INPUTS]:
-            logger.debug('building task')
-            (assr, info) = build_task(
-                garjus, assr, info, processor, project_data)
-
-            logger.debug(f'assr after={info}')
+        if info is None:
+            action = 'create'
+        elif info['PROCSTATUS'] in [NEED_TO_RUN, NEED_INPUTS]:
+            action = 'build'
         else:
             logger.debug('already built:{}'.format(info['ASSR']))
+            continue
 
+        plan.append({
+            'ACTION': action,
+            'PROJECT': project_data['name'],
+            'SUBJECT': subject,
+            'SESSION': '',
+            'PROCTYPE': proctype,
+            'ASSR': info['ASSR'] if info else '',
+            'INPUTS': inputs,
+            'processor': processor,
+        })
 
-def build_processor(
-    garjus,
-    filepath,
-    user_inputs,
-    project_data,
-    include_filters
-):
+    return plan
+
+
+def plan_processor(processor, project_data, include_filters):
+    """Return list of assessors to create and tasks to build for processor.
+
+    Planning only reads project_data, nothing is changed on XNAT or in the
+    queue. Each item of the plan is a dict with ACTION of create (new
+    assessor and task) or build (task for existing assessor).
+    """
+    plan = []
 
     # Get lists of subjects/sessions for filtering
     all_sessions = project_data.get('scans').SESSION.unique()
     all_subjects = project_data.get('scans').SUBJECT.unique()
 
-    # Load the processor
-    processor = load_from_yaml(
-        garjus.xnat(),
-        filepath,
-        user_inputs=user_inputs)
-
-    if not processor:
-        logger.error(f'loading processor:{filepath}')
-        return
-
     if isinstance(processor, SgpProcessor_v3_1):
         # Handle subject level processing
 
@@ -1792,7 +1761,7 @@ def build_processor(
         # Apply the processor to filtered sessions
         for subj in sorted(include_subjects):
             logger.debug(f'subject:{subj}')
-            build_subject_processor(garjus, processor, subj, project_data)
+            plan.extend(plan_subject_processor(processor, subj, project_data))
     else:
         # Handle session level processing
 
@@ -1806,4 +1775,142 @@ def build_processor(
 
         # Apply the processor to filtered sessions
         for sess in sorted(include_sessions):
-            build_session_processor(garjus, processor, sess, project_data)
+            plan.extend(plan_session_processor(processor, sess, project_data))
+
+    return plan
+
+
+def check_duplicate(garjus, project_data, session):
+    """Raise AutoProcessorError if session has assessors we don't know."""
+    index = get_index(project_data)
+    our_labels = garjus.our_assessors()
+
+    # First check for new stuff in the queue that we didn't create
+    queue = get_queue(garjus, project_data)
+    labels = [x for x in queue.session_assessors(session)
+              if x not in index.assessor_labels and x not in our_labels]
+    if len(labels) > 0:
+        logger.debug(f'detected duplicate in queue:{labels}')
+        raise AutoProcessorError('duplicate build detected')
+
+    # Then check on xnat
+    # Get list of assessors on session, compare to list in project_data
+    project = project_data['name']
+    subject = index.session_subject[session]
+    cur_labels = garjus.session_assessor_labels(project, subject, session)
+    labels = [x for x in cur_labels
+              if x not in index.assessor_labels and x not in our_labels]
+    if len(labels) > 0:
+        logger.debug(f'detected duplicate:{labels}')
+        raise AutoProcessorError('duplicate build detected')
+
+
+def apply_plan(garjus, plan, project_data):
+    """Create assessors and build tasks in plan."""
+    tasks = []
+
+    try:
+        _apply_plan(garjus, plan, project_data, tasks)
+    finally:
+        _flush_tasks(garjus, project_data, tasks)
+
+
+def _flush_tasks(garjus, project_data, tasks):
+    # Add built tasks to the queue at once and empty the list
+    failed = garjus.add_tasks(project_data['name'], tasks)
+
+    # Assessors without a task would never run, restore to build again
+    for t in tasks:
+        if t['assr'] in failed:
+            _restore_assessor(t['restore'])
+
+    tasks.clear()
+
+
+def _restore_assessor(restore):
+    assr = restore['assr']
+    xsitype = restore['xsitype']
+    logger.info(f'restoring statuses of assessor without task:{assr.label()}')
+
+    try:
+        assr.attrs.set(f'{xsitype}/procstatus', restore['procstatus'])
+        assr.attrs.set(f'{xsitype}/validation/status', restore['qcstatus'])
+    except Exception as err:
+        logger.error(f'failed to restore assessor:{assr.label()}:{err}')
+
+
+def _apply_plan(garjus, plan, project_data, tasks):
+    skipped = set()
+    checked = set()
+
+    for item in plan:
+        processor = item['processor']
+        session = item['SESSION']
+        inputs = item['INPUTS']
+
+        if (processor.name, session) in skipped:
+            continue
+
+        if session and item['ACTION'] == 'create' and session not in checked:
+            # Check for duplicate once before we create new assessors on
+            # the session
+            try:
+                check_duplicate(garjus, project_data, session)
+                checked.add(session)
+            except Exception as err:
+                logger.error(f'could not check for duplicates:{err}')
+                import traceback
+                traceback.print_exc()
+                skipped.add((processor.name, session))
+                continue
+
+        # Get(create) assessor with given inputs and proc type
+        if session:
+            (assr, info) = processor.get_assessor(session, inputs, project_data)
+        else:
+            (assr, info) = processor.get_assessor(
+                item['SUBJECT'], inputs, project_data)
+
+        if info['PROCSTATUS'] in [NEED_TO_RUN, NEED_INPUTS]:
+            if session:
+                garjus.add_our_assessor(info['ASSR'])
+
+            logger.debug('building task')
+            (assr, info) = build_task(
+                garjus, assr, info, processor, project_data, tasks=tasks)
+
+            if project_data.get('queue', None) is not None:
+                # Later checks know the task is ours without a new export
+                project_data['queue'].add(info['ASSR'])
+
+            if len(tasks) >= TASK_FLUSH:
+                # Queue tasks as we go so a killed build leaves few
+                # running assessors without a task
+                _flush_tasks(garjus, project_data, tasks)
+
+            logger.debug(f'{info}')
+            logger.debug('status:{}:{}'.format(info['ASSR'], info['PROCSTATUS']))
+        else:
+            logger.debug('already built:{}'.format(info['ASSR']))
+
+
+def build_processor(
+    garjus,
+    filepath,
+    user_inputs,
+    project_data,
+    include_filters
+):
+    # Load the processor
+    processor = load_from_yaml(
+        garjus.xnat(),
+        filepath,
+        user_inputs=user_inputs)
+
+    if not processor:
+        logger.error(f'loading processor:{filepath}')
+        return
+
+    plan = plan_processor(processor, project_data, include_filters)
+
+    apply_plan(garjus, plan, project_data)
@@ -1,6 +1,12 @@
 import redcap
 import os
+import json
 import logging
+import time
+from datetime import datetime
+
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from requests.exceptions import JSONDecodeError
 
 
 def download_named_file(
@@ -211,3 +217,151 @@ def field2events(project, field_id):
         events = []
 
     return events
+
+
+class RecordWriter:
+    """Buffer records and import them to REDCap in batches.
+
+    Records are imported when the buffer reaches batch_size and when the
+    writer is flushed or closed. Each import is retried with increasing
+    delay on connection errors, except new repeat instances that may have
+    been imported already. A batch rejected by REDCap is split in halves so
+    the valid records are still imported. If log_file is set, each record
+    and each import is also appended to the file as a line of JSON.
+    """
+
+    def __init__(
+        self,
+        project,
+        batch_size=1000,
+        retries=5,
+        delay=10,
+        log_file=None
+    ):
+        self._project = project
+        self._records = []
+        self.batch_size = batch_size
+        self.retries = retries
+        self.delay = delay
+        self.log_file = log_file
+        self.imported = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, records):
+        """Add list of records, importing full batches."""
+        self._records.extend(records)
+        self._log([{'record': r} for r in records])
+
+        while len(self._records) >= self.batch_size:
+            self._import(self._records[:self.batch_size])
+            self._records = self._records[self.batch_size:]
+
+    def flush(self):
+        """Import all buffered records."""
+        while self._records:
+            self._import(self._records[:self.batch_size])
+            self._records = self._records[self.batch_size:]
+
+    def close(self):
+        self.flush()
+        logging.debug(f'records imported={self.imported}, failed={self.failed}')
+
+    def _log(self, entries):
+        if not self.log_file:
+            return
+
+        now = datetime.now().isoformat()
+
+        try:
+            with open(self.log_file, 'a') as f:
+                for e in entries:
+                    f.write(json.dumps({'time': now, **e}, default=str) + '\n')
+        except OSError as err:
+            logging.error(f'failed to write log:{self.log_file}:{err}')
+
+    def _import(self, records):
+        delay = self.delay
+        start = time.time()
+
+        for attempt in range(1, self.retries + 1):
+            try:
+                response = self._project.import_records(records)
+                assert 'count' in response
+                self.imported += len(records)
+                logging.debug(f'imported records:{len(records)}')
+                self._log([{
+                    'imported': len(records),
+                    'attempts': attempt,
+                    'secs': round(time.time() - start, 3)}])
+                return
+            except (redcap.RedcapError, AssertionError) as err:
+                if not is_transient(err):
+                    # Rejected records fail again, split to import the others
+                    if len(records) > 1:
+                        logging.info(f'import rejected:{len(records)}, splitting')
+                        half = len(records) // 2
+                        self._import(records[:half])
+                        self._import(records[half:])
+                        return
+
+                    logging.error(f'import rejected:{records[0]}:{err}')
+                    break
+
+                logging.info(f'import failed, attempt {attempt}:{err}')
+
+                if maybe_sent(err):
+                    # New instances may exist now, importing again would
+                    # duplicate them so only retry the others
+                    new = [r for r in records if is_new_record(r)]
+                    if new:
+                        logging.error(f'import uncertain, not retried:{len(new)}')
+                        self._failed(new, start)
+                        records = [r for r in records if not is_new_record(r)]
+                        if not records:
+                            return
+
+                if attempt < self.retries:
+                    time.sleep(delay)
+                    delay *= 2
+
+        self._failed(records, start)
+
+    def _failed(self, records, start):
+        logging.error(f'failed to import records:{len(records)}')
+        self.failed += len(records)
+        self._log([{
+            'failed': len(records),
+            'secs': round(time.time() - start, 3)}])
+
+
+def is_transient(err):
+    """Return True if err is from the connection or an overloaded server."""
+    if isinstance(err, (ConnectionError, Timeout, JSONDecodeError)):
+        # Servers that fail return error pages rather than json
+        return True
+
+    response = getattr(err, 'response', None)
+    if response is not None and response.status_code >= 500:
+        return True
+
+    return False
+
+
+def is_new_record(record):
+    """Return True if record creates a new repeat instance."""
+    return record.get('redcap_repeat_instance') == 'new'
+
+
+def maybe_sent(err):
+    """Return False if err shows the request never reached REDCap."""
+    # Errors before connecting mean the request was never sent
+    if isinstance(err, ConnectTimeout):
+        return False
+
+    return 'Failed to establish a new connection' not in str(err)
@@ -74,6 +74,39 @@ proc:subjgenprocdata/inputs,\
 last_modified'
 
 
+# Lightweight queries with a row per session or per assessor, used by the
+# local cache to find what has been modified since the last load.
+SESS_MOD_URI = '/REST/experiments?xsiType=xnat:imagesessiondata\
+&columns=\
+project,\
+xnat:imagesessiondata/sharing/share/project,\
+label,\
+last_modified'
+
+
+ASSR_MOD_URI = '/REST/experiments?xsiType=proc:genprocdata\
+&columns=\
+project,\
+proc:genprocdata/sharing/share/project,\
+label,\
+last_modified'
+
+
+# Lightweight queries of assessor status, filtered by label
+ASSR_STATUS_URI = '/REST/experiments?xsiType=proc:genprocdata\
+&columns=\
+project,\
+label,\
+proc:genprocdata/procstatus'
+
+
+SGP_STATUS_URI = '/REST/subjects?xsiType=xnat:subjectdata\
+&columns=\
+project,\
+proc:subjgenprocdata/label,\
+proc:subjgenprocdata/procstatus'
+
+
 SCAN_RENAME = {
     'project': 'PROJECT',
     'subject_label': 'SUBJECT',
@@ -630,3 +663,29 @@ def get_my_favorites(xnat):
     fav_json = json.loads(xnat._exec(uri, 'GET'), strict=False)
     fav = [x['id'] for x in fav_json['ResultSet']['Result']]
     return fav
+
+
+def get_scan_files(xnat, session_path):
+    """Return files of all scan resources in session, keyed by scan/resource.
+
+    Uses a single catalog listing of the session instead of one listing
+    per scan resource. Paths are relative to the resource.
+    """
+    uri = f'/data{session_path}/scans/ALL/files?format=json'
+    logger.debug(uri)
+    json_data = json.loads(xnat._exec(uri, 'GET'), strict=False)
+    result = json_data['ResultSet']['Result']
+
+    scan_files = {}
+    for r in result:
+        # URI is .../scans/<scan>/resources/<id>/files/<path>
+        try:
+            (scan_part, file_path) = r['URI'].split('/files/', 1)
+            scan_id = scan_part.split('/scans/')[1].split('/resources/')[0]
+        except (KeyError, IndexError, ValueError):
+            logger.debug(f'could not parse file URI:{r}')
+            continue
+
+        scan_files.setdefault((scan_id, r['collection']), []).append(file_path)
+
+    return scan_files
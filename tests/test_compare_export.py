@@ -0,0 +1,138 @@
+import logging
+import time
+
+from garjus.compare.dataentry_compare import compare_projects, export_all_records
+
+
+logger = logging.getLogger('test_compare_export')
+
+
+NUM_SUBJECTS = 300
+
+# Simulated secs per REDCap API call
+LATENCY = 0.002
+
+EVENTS = ['baseline_arm_1', 'month6_arm_1']
+
+FIELDS = ['record_id', 'visit_date', 'weight', 'mood_score']
+
+
+class FakeProject:
+    """In memory stand in for a pycap Project, counts export calls."""
+
+    def __init__(self, records, title):
+        self.def_field = 'record_id'
+        self.field_names = FIELDS
+        self.records = records
+        self.title = title
+        self.calls = 0
+
+    def export_project_info(self):
+        return {
+            'secondary_unique_field': '',
+            'project_title': self.title,
+            'project_id': 1}
+
+    def export_events(self):
+        return [{'unique_event_name': x} for x in EVENTS]
+
+    def export_records(self, records=None, fields=None, events=None):
+        self.calls += 1
+        time.sleep(LATENCY)
+
+        result = self.records
+        if records is not None:
+            records = set(records)
+            result = [x for x in result if x['record_id'] in records]
+
+        if events is not None:
+            result = [x for x in result if x['redcap_event_name'] in events]
+
+        if fields is not None:
+            keep = set(fields) | {
+                'record_id', 'redcap_event_name',
+                'redcap_repeat_instrument', 'redcap_repeat_instance'}
+            result = [{k: v for k, v in x.items() if k in keep} for x in result]
+
+        return [dict(x) for x in result]
+
+
+def make_projects(num_subjects=NUM_SUBJECTS):
+    # Second is a copy of First with one mismatch per 10 and one missing
+    records1 = []
+    records2 = []
+    for i in range(num_subjects):
+        for j, e in enumerate(EVENTS):
+            r = {
+                'record_id': f'{i:04d}',
+                'redcap_event_name': e,
+                'redcap_repeat_instrument': '',
+                'redcap_repeat_instance': '',
+                'visit_date': f'2024-0{j + 1}-{(i % 28) + 1:02d}',
+                'weight': str(100 + i),
+                'mood_score': str(i % 7),
+            }
+            records1.append(r)
+
+            if i == 0:
+                continue
+
+            r = dict(r)
+            if i % 10 == 0 and j == 0:
+                r['mood_score'] = '99'
+
+            records2.append(r)
+
+    return FakeProject(records1, 'First'), FakeProject(records2, 'Second')
+
+
+def compare_per_record(p1, p2):
+    # Export second for every record of first as done previously
+    records1 = export_all_records(p1)
+    found = 0
+    for r1 in records1:
+        rid = r1['record_id']
+        found += len(p2.export_records(records=[rid], events=[r1['redcap_event_name']]))
+
+    return found
+
+
+def run(num_subjects=NUM_SUBJECTS):
+    p1, p2 = make_projects(num_subjects)
+
+    start = time.time()
+    compare_per_record(p1, p2)
+    per_record_secs = time.time() - start
+    per_record_calls = p2.calls
+
+    p1.calls = 0
+    p2.calls = 0
+    start = time.time()
+    results = compare_projects(p1, p2)
+    bulk_secs = time.time() - start
+    bulk_calls = p2.calls
+
+    logger.info(f'per record:{per_record_calls} calls:{per_record_secs:.2f} secs')
+    logger.info(f'bulk:{bulk_calls} calls:{bulk_secs:.2f} secs')
+    logger.info(f'speedup:{per_record_secs / bulk_secs:.1f}x')
+
+    counts = results['counts']
+    logger.info(f'counts:{counts}')
+
+    assert counts['missing_subjects'] == 1
+    assert counts['mismatches'] == (num_subjects - 1) // 10
+    assert bulk_calls < per_record_calls
+    assert bulk_secs < per_record_secs
+
+    return per_record_secs, bulk_secs
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s:%(module)s:%(message)s',
+        level=logging.DEBUG,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    run()
+
+    logging.info('Done!')
@@ -0,0 +1,176 @@
+import logging
+import fnmatch
+import os
+import re
+import tempfile
+import time
+
+import pandas as pd
+
+from garjus.tasks.processors import Processor_v3_1
+
+
+logger = logging.getLogger('test_processor_matching')
+
+
+NUM_SESSIONS = 5000
+
+SCANTYPES = [
+    'Localizer',
+    'T1_MPRAGE',
+    'T2_FLAIR',
+    'fMRI_REST1',
+    'fMRI_REST2',
+    'fMRI_MSIT',
+    'DTI_2min_b1000',
+    'DTI_2min_b2000',
+    'B0_Map',
+    'PhoenixZIPReport',
+]
+
+YAML = '''---
+procyamlversion: 3.0.0
+containers:
+  - name: BASH
+    path: bash_latest.sif
+requirements:
+  walltime: 0-1
+  memory: 8G
+inputs:
+  xnat:
+    scans:
+      - name: scan_t1
+        types: T1_MPRAGE,MPRAGE*,*T1*
+        resources:
+          - resource: NIFTI
+      - name: scan_fmri
+        types: fMRI_REST*,rsfMRI*,REST*
+        select: all
+        resources:
+          - resource: NIFTI
+      - name: scan_dti
+        types: DTI_*_b1000,DTI_*_b2000,DWI*
+        select: all
+        resources:
+          - resource: NIFTI
+    assessors:
+      - name: assr_msit
+        types: fmri_msit_v2
+        resources:
+          - resource: 1stLEVEL
+outputs:
+  - dir: DATA
+command:
+  type: singularity_run
+  container: BASH
+description: Synthetic processor for matching benchmark
+'''
+
+
+def make_project(num_sessions=NUM_SESSIONS):
+    # Synthetic project with every scan type in every session
+    scans = []
+    assessors = []
+    for i in range(num_sessions):
+        subj = f'SUBJ{i:05d}'
+        sess = f'SESS{i:05d}'
+        for j, t in enumerate(SCANTYPES):
+            scans.append({
+                'PROJECT': 'PROJ',
+                'SUBJECT': subj,
+                'SESSION': sess,
+                'SCANID': str(j),
+                'SCANTYPE': t,
+                'QUALITY': 'unusable' if (i + j) % 13 == 0 else 'usable',
+                'XSITYPE': 'xnat:mrSessionData',
+                'DATE': '2024-01-01',
+                'full_path': f'/projects/PROJ/subjects/{subj}/experiments/{sess}/scans/{j}',
+            })
+
+        assessors.append({
+            'PROJECT': 'PROJ',
+            'SUBJECT': subj,
+            'SESSION': sess,
+            'ASSR': f'PROJ-x-{subj}-x-{sess}-x-fmri_msit_v2-x-1',
+            'PROCTYPE': 'fmri_msit_v2',
+            'PROCSTATUS': 'COMPLETE',
+            'QCSTATUS': 'Passed',
+            'INPUTS': {},
+            'full_path': f'/projects/PROJ/subjects/{subj}/experiments/{sess}/assessors/1',
+        })
+
+    return {
+        'name': 'PROJ',
+        'scans': pd.DataFrame(scans),
+        'assessors': pd.DataFrame(assessors),
+    }
+
+
+def map_inputs_translate(processor, session, project_data):
+    # Compile every expression for every scan as done previously
+    index = project_data['index']
+    artefacts_by_input = {k: [] for k in processor.proc_inputs}
+
+    for i, iv in sorted(processor.proc_inputs.items()):
+        if iv['artefact_type'] == 'scan':
+            for cscan in index.session_scans.get(session, []):
+                for expression in iv['types']:
+                    regex = re.compile(fnmatch.translate(expression))
+                    if regex.match(cscan.get('SCANTYPE')):
+                        if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
+                            pass
+                        else:
+                            artefacts_by_input[i].append(cscan['full_path'])
+                            break
+        elif iv['artefact_type'] == 'assessor':
+            for cassr in index.session_assessors.get(session, []):
+                if cassr.get('PROCTYPE') in iv['types']:
+                    artefacts_by_input[i].append(cassr['full_path'])
+
+    return artefacts_by_input
+
+
+def run(num_sessions=NUM_SESSIONS):
+    project_data = make_project(num_sessions)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yaml_file = os.path.join(tmpdir, 'bench_matching_v1.0.0.yaml')
+        with open(yaml_file, 'w') as f:
+            f.write(YAML)
+
+        processor = Processor_v3_1(None, yaml_file)
+
+    sessions = sorted(project_data['scans'].SESSION.unique())
+
+    # Build the index once outside of the timing, both paths use it
+    processor._map_inputs(sessions[0], project_data)
+
+    start = time.time()
+    translate_inputs = [
+        map_inputs_translate(processor, x, project_data) for x in sessions]
+    translate_secs = time.time() - start
+
+    start = time.time()
+    mapped_inputs = [processor._map_inputs(x, project_data) for x in sessions]
+    mapped_secs = time.time() - start
+
+    logger.info(f'translate:{len(translate_inputs)} sessions:{translate_secs:.2f} secs')
+    logger.info(f'map_inputs:{len(mapped_inputs)} sessions:{mapped_secs:.2f} secs')
+    logger.info(f'speedup:{translate_secs / mapped_secs:.1f}x')
+
+    assert mapped_inputs == translate_inputs
+    assert all(x['scan_t1'] and x['assr_msit'] for x in mapped_inputs)
+    assert mapped_secs < translate_secs
+
+    return translate_secs, mapped_secs
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s:%(module)s:%(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    run()
+
+    logging.info('Done!')